@@ -1,15 +1,395 @@
 import arcpy
 import sys
 import os
+import traceback
 import numpy as np
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.diversity as diversity
+import NB_SEEA_ESRI.lib.raster_parallel as raster_parallel
+import NB_SEEA_ESRI.lib.spatial_index as spatial_index
+from arcpy.sa import Combine, RegionGroup
 from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log, common])
+refresh_modules([log, common, raster_blocks, diversity, raster_parallel, spatial_index])
 
-def function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSAM, studyAreaMask):
+# Field holding the chunk of each aggregation unit when aggregating in parallel
+chunkField = "AGG_CHUNK"
+
+def unitAreas(units):
+
+    ''' Returns the OIDs and areas (AREA_SQKM) of the aggregation units, in the order they are stored '''
+
+    oids = []
+    areas = []
+
+    with arcpy.da.SearchCursor(units, ['OID@', 'AREA_SQKM']) as cursor:
+        for row in cursor:
+            oids.append(row[0])
+            areas.append(row[1])
+
+    return np.array(oids, dtype=np.int64), np.array(areas, dtype=np.float64)
+
+
+def overlayPatches(dataSet, linkCode, units, intersection):
+
+    '''
+    Intersects the data set with all of the aggregation units in a single overlay.
+
+    Each patch is the part of a data set feature inside an aggregation unit, as Clip_analysis gives for a single unit.
+    Returns the unit OID, the class (the value of linkCode) and the area in hectares of each patch.
+    '''
+
+    arcpy.Intersect_analysis([dataSet, units], intersection, "ONLY_FID")
+
+    # The FID fields are in the same order as the inputs
+    dataField, unitField = [field.name for field in arcpy.ListFields(intersection, "FID_*")][:2]
+
+    classes = {}
+    with arcpy.da.SearchCursor(dataSet, ['OID@', linkCode]) as cursor:
+        for row in cursor:
+            classes[row[0]] = row[1]
+
+    patchUnits = []
+    patchClasses = []
+    patchAreas = []
+
+    with arcpy.da.SearchCursor(intersection, [dataField, unitField, 'SHAPE@AREA']) as cursor:
+        for row in cursor:
+            patchClasses.append(classes[row[0]])
+            patchUnits.append(row[1])
+            patchAreas.append(row[2])
+
+    # Convert the areas from map units to hectares
+    metresPerUnit = arcpy.Describe(intersection).spatialReference.metersPerUnit
+    patchAreas = np.array(patchAreas, dtype=np.float64) * metresPerUnit * metresPerUnit / 10000.0
+
+    return np.array(patchUnits, dtype=np.int64), patchClasses, patchAreas
+
+
+def unitPositions(unitOids, oids):
+
+    ''' Position of each OID in unitOids '''
+
+    order = np.argsort(unitOids)
+
+    return order[np.searchsorted(unitOids[order], oids)]
+
+
+def vectorClassAreas(unitOids, patchUnits, patchClasses, patchAreas):
+
+    '''
+    Builds the unit by class area matrix (in hectares) of a vector data set from its patches,
+    and counts the patches in each unit.
+    '''
+
+    units = unitPositions(unitOids, patchUnits)
+
+    # Number the classes (which may be text, numbers or NULL)
+    classNumbers = {}
+    classIndex = np.array([classNumbers.setdefault(code, len(classNumbers)) for code in patchClasses], dtype=np.int64)
+
+    classAreas = diversity.UnitClassMatrix.fromPairs(units, classIndex, patchAreas, unitOids.size, len(classNumbers))
+
+    return classAreas, np.bincount(units, minlength=unitOids.size)
+
+
+def unitStatistics(unitSizes, classAreas, numPatches):
+
+    '''
+    Calculates the number of covers, Shannon index, inverse Simpson index and mean patch area of each unit
+    from the unit by class area matrix (in hectares) and the number of patches in each unit.
+
+    The proportion of each class is its area divided by the size of the unit (unitSizes, in square kilometres).
+    Units without any data have indices of -1 and a mean patch area of 0.
+    '''
+
+    unitSizesHa = unitSizes * 100.0
+
+    numCovers = classAreas.richness()
+    shannonIndex = classAreas.shannon(unitSizesHa)
+    inverseSimpsonsIndex = classAreas.inverseSimpson(unitSizesHa)
+    meanPatchAreas = classAreas.meanPatchArea(numPatches)
+
+    return numCovers, shannonIndex, inverseSimpsonsIndex, meanPatchAreas
+
+
+def rasterizeUnits(units, gridRaster, unitRaster):
+
+    ''' Rasterizes the aggregation units onto the grid of gridRaster, with the value of each cell the OID of its unit '''
+
+    origSnapRaster = arcpy.env.snapRaster
+    origExtent = arcpy.env.extent
+    origMask = arcpy.env.mask
+
+    try:
+        arcpy.env.snapRaster = gridRaster
+        arcpy.env.extent = gridRaster
+        arcpy.env.mask = None
+
+        grid = raster_blocks.RasterGrid(gridRaster)
+        oidField = arcpy.Describe(units).OIDFieldName
+        arcpy.PolygonToRaster_conversion(units, oidField, unitRaster, "CELL_CENTER", "", grid.cellWidth)
+
+    finally:
+        arcpy.env.snapRaster = origSnapRaster
+        arcpy.env.extent = origExtent
+        arcpy.env.mask = origMask
+
+    return unitRaster
+
+
+def blockClassCounts(units, classes):
+
+    '''
+    Counts the cells of each class in each unit in a block, with a single bincount over unit * numClasses + class.
+    units and classes are numbered within the block. Returns the unit, class and count of each non-zero pair.
+    '''
+
+    blockUnits, unitIndex = np.unique(units, return_inverse=True)
+    blockClasses, classIndex = np.unique(classes, return_inverse=True)
+    numClasses = blockClasses.size
+
+    counts = np.bincount(unitIndex * numClasses + classIndex, minlength=blockUnits.size * numClasses)
+    nonZero = np.flatnonzero(counts)
+
+    return blockUnits[nonZero // numClasses], blockClasses[nonZero % numClasses], counts[nonZero]
+
+
+def rasterClassAreas(dataRaster, units, unitOids, prefix):
+
+    '''
+    Counts the cells of each class of the raster data set in each unit, block by block.
+
+    The units are rasterized onto the grid of the data set once. Patches are the groups of connected cells
+    of the same class within a unit (found with RegionGroup). Returns the unit by class area matrix (in hectares)
+    and the number of patches in each unit.
+    '''
+
+    unitRaster = prefix + "unitRaster"
+    regionRaster = prefix + "regionRaster"
+
+    try:
+        grid = raster_blocks.RasterGrid(dataRaster)
+        numUnits = unitOids.size
+
+        metresPerUnit = grid.spatialRef.metersPerUnit
+        cellArea = grid.cellWidth * grid.cellHeight * metresPerUnit * metresPerUnit / 10000.0
+
+        rasterizeUnits(units, dataRaster, unitRaster)
+
+        # Each region is a connected group of cells with the same unit and class
+        regions = RegionGroup(Combine([unitRaster, dataRaster]), "EIGHT", "WITHIN", "NO_LINK")
+        regions.save(regionRaster)
+        del regions
+
+        unitReader = raster_blocks.BlockReader(unitRaster, grid)
+        dataReader = raster_blocks.BlockReader(dataRaster, grid)
+        regionReader = raster_blocks.BlockReader(regionRaster, grid)
+
+        pairParts = []
+        regionParts = []
+
+        for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(12)):
+
+            unitValues = unitReader.read(block)
+            classValues = dataReader.read(block)
+            regionValues = regionReader.read(block)
+
+            valid = np.isfinite(unitValues) & np.isfinite(classValues) & np.isfinite(regionValues)
+            if not valid.any():
+                continue
+
+            blockUnits = unitPositions(unitOids, unitValues[valid].astype(np.int64))
+            pairParts.append(blockClassCounts(blockUnits, classValues[valid]))
+
+            regionKeys = np.unique(regionValues[valid].astype(np.int64) * numUnits + blockUnits)
+            regionParts.append(regionKeys)
+
+        if len(pairParts) == 0:
+            return diversity.UnitClassMatrix.fromPairs([], [], [], numUnits, 0), np.zeros(numUnits, dtype=np.int64)
+
+        # Merge the counts from each block
+        pairUnits, pairClasses, pairCounts = [np.concatenate(part) for part in zip(*pairParts)]
+        classValues, classIndex = np.unique(pairClasses, return_inverse=True)
+        classAreas = diversity.UnitClassMatrix.fromPairs(pairUnits, classIndex, pairCounts * cellArea, numUnits, classValues.size)
+
+        # Regions crossing block edges are only counted once
+        regionUnits = np.unique(np.concatenate(regionParts)) % numUnits
+
+        return classAreas, np.bincount(regionUnits, minlength=numUnits)
+
+    except Exception:
+        log.error("Could not count the cells of " + str(dataRaster) + " in the aggregation units")
+        raise
+
+    finally:
+        for raster in [unitRaster, regionRaster]:
+            if arcpy.Exists(raster):
+                arcpy.Delete_management(raster)
+
+
+def featureBoxes(featureClass, spatialRef=None):
+
+    '''
+    Reads the OIDs and bounding boxes of the features in the feature class (projected to spatialRef if given).
+    Features with no geometry have empty boxes which do not intersect anything.
+    '''
+
+    try:
+        oids = []
+        boxes = []
+
+        with arcpy.da.SearchCursor(featureClass, ['OID@', 'SHAPE@'], spatial_reference=spatialRef) as cursor:
+            for row in cursor:
+
+                oids.append(row[0])
+
+                if row[1] is None:
+                    boxes.append((np.inf, np.inf, -np.inf, -np.inf))
+                else:
+                    extent = row[1].extent
+                    boxes.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+
+        return np.array(oids, dtype=np.int64), np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+    except Exception:
+        log.error("Bounding boxes of " + str(featureClass) + " could not be read")
+        raise
+
+
+def assignChunks(units, numChunks):
+
+    '''
+    Splits the aggregation units into numChunks spatially compact chunks, writing the chunk number of each unit
+    to chunkField. The units are put in Sort-Tile-Recursive order by their bounding boxes and cut into runs
+    of equal length, so each chunk covers a compact area.
+    '''
+
+    oids, boxes = featureBoxes(units)
+
+    chunkSize = -(-oids.size // numChunks)
+    chunks = np.empty(oids.size, dtype=np.int64)
+    chunks[spatial_index.strOrder(boxes, chunkSize)] = np.arange(oids.size) // chunkSize
+    unitChunks = dict(zip(oids.tolist(), chunks.tolist()))
+
+    arcpy.AddField_management(units, chunkField, "LONG")
+    with arcpy.da.UpdateCursor(units, ['OID@', chunkField]) as cursor:
+        for row in cursor:
+            row[1] = unitChunks[row[0]]
+            cursor.updateRow(row)
+
+    return int(chunks.max()) + 1
+
+
+def overlayChunkInProcess(scratchFolder, dataSet, linkCode, units, chunkNo, resultFile):
+
+    '''
+    Calculates the metrics of one chunk of aggregation units in a worker process, with its own scratch geodatabase
+    in scratchFolder (which also holds the log file). The OIDs and metrics of the chunk's units are saved to resultFile.
+    '''
+
+    try:
+        log.setupLogging(scratchFolder)
+        scratchGDB = raster_parallel.setupProcessWorkspace(scratchFolder)
+
+        chunkLayer = arcpy.MakeFeatureLayer_management(units, "ChunkLayer", chunkField + " = " + str(chunkNo)).getOutput(0)
+        intersection = os.path.join(scratchGDB, "dataIntersectUnits")
+
+        unitOids, unitSizes = unitAreas(chunkLayer)
+        patchUnits, patchClasses, patchAreas = overlayPatches(dataSet, linkCode, chunkLayer, intersection)
+        numCovers, shannonIndex, inverseSimpsonsIndex, meanPatchAreas = unitStatistics(
+            unitSizes, *vectorClassAreas(unitOids, patchUnits, patchClasses, patchAreas))
+
+        np.savez(resultFile, oids=unitOids, numCovers=numCovers, shannon=shannonIndex,
+                 inverseSimpsons=inverseSimpsonsIndex, meanPatch=meanPatchAreas)
+
+        arcpy.Delete_management(intersection)
+        arcpy.Delete_management(chunkLayer)
+
+    except (Exception, SystemExit):
+        # Errors are recorded in the log file, and the exit code tells the parent process the chunk failed
+        log.error(traceback.format_exc())
+        sys.exit(1)
+
+
+def parallelOverlayStatistics(dataSet, linkCode, units, unitOids, numChunks):
+
+    '''
+    Calculates the metrics of the units chunk by chunk, with each chunk intersected with the data set in its own
+    process. The metrics of each chunk are merged into arrays in the order of unitOids.
+    '''
+
+    scratchRoot = os.path.dirname(os.path.dirname(arcpy.env.scratchGDB))
+
+    processArgs = []
+    for chunkNo in range(numChunks):
+        chunkScratch = os.path.join(scratchRoot, 'scratch_aggchunk' + str(chunkNo))
+        resultFile = os.path.join(arcpy.env.scratchFolder, 'aggchunk' + str(chunkNo) + '.npz')
+        processArgs.append((chunkScratch, dataSet, linkCode, units, chunkNo, resultFile))
+
+    log.info('Intersecting ' + str(dataSet) + ' with ' + str(numChunks) + ' chunks of aggregation units in parallel')
+
+    try:
+        exitCodes = raster_parallel.runProcesses(overlayChunkInProcess, processArgs)
+
+        for args, exitCode in zip(processArgs, exitCodes):
+            if exitCode != 0:
+                log.error('Aggregation failed for chunk ' + str(args[4]) + '. See the log file in ' + os.path.join(args[0], 'logs'))
+                raise RuntimeError('Aggregation failed for chunk ' + str(args[4]))
+
+        numUnits = unitOids.size
+        stats = [np.zeros(numUnits, dtype=np.int64), np.zeros(numUnits), np.zeros(numUnits), np.zeros(numUnits)]
+
+        for args in processArgs:
+            with np.load(args[5]) as chunk:
+                positions = unitPositions(unitOids, chunk['oids'])
+                for stat, name in zip(stats, ['numCovers', 'shannon', 'inverseSimpsons', 'meanPatch']):
+                    stat[positions] = chunk[name]
+
+        return stats
+
+    finally:
+        raster_parallel.deleteArrays([args[5] for args in processArgs])
+
+
+def isRaster(dataSet):
+
+    return arcpy.Describe(dataSet).dataType in ['RasterDataset', 'RasterLayer', 'RasterBand']
+
+
+def rasterizeData(dataSet, linkCode, units, cellSize, dataRaster):
+
+    ''' Rasterizes the classes of a vector data set over the extent of the aggregation units '''
+
+    origExtent = arcpy.env.extent
+
+    try:
+        arcpy.env.extent = arcpy.Describe(units).extent
+        arcpy.PolygonToRaster_conversion(dataSet, linkCode, dataRaster, "CELL_CENTER", "", cellSize)
+
+    finally:
+        arcpy.env.extent = origExtent
+
+    return dataRaster
+
+
+def function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSAM, studyAreaMask, cellSize=None,
+             numWorkers=None):
+
+    '''
+    Calculates the number of covers, Shannon index, inverse Simpson index and mean patch area of each data set
+    in each aggregation unit.
+
+    Vector data sets are intersected with all of the units in one overlay. Raster data sets (and vector data sets,
+    if cellSize is given, after rasterizing them at that cell size) are aggregated in raster mode, by counting
+    the cells of each class in each unit block by block.
+
+    If more than one worker process is set (numWorkers, defaulting to the user settings), the units are split
+    into spatially compact chunks for the overlay, and each chunk is intersected in its own process.
+    '''
 
     try:
         # Set temporary variables
@@ -23,18 +403,21 @@ def function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSA
         else:
             memoryPrefix = 'memory'
 
-        singleAggUnit = os.path.join(memoryPrefix, "singleAggUnit")
-        dataClippedToUnit = os.path.join(memoryPrefix, "dataClippedToUnit")
-        dataInUnitDissolved = os.path.join(memoryPrefix, "dataInUnitDissolved")
-        
+        intersection = os.path.join(memoryPrefix, "dataIntersectUnits")
+        dataRaster = prefix + "dataRaster"
+
         tempLayer = "MaskLayer"
-        unitMaskLayer = "UnitMaskLayer"
 
         # Clip aggregation mask to extent of study area
         tmpLyr1 = arcpy.MakeFeatureLayer_management(aggregateMask, tempLayer).getOutput(0)
-        arcpy.Dissolve_management(studyAreaMask, studyAreaMaskDissolved)
 
         if maskFullyWithinSAM:
+
+            # Raster study area masks are converted to polygons first
+            if isRaster(studyAreaMask):
+                studyAreaMask = common.extractRasterMask(studyAreaMask)
+
+            arcpy.Dissolve_management(studyAreaMask, studyAreaMaskDissolved)
             arcpy.SelectLayerByLocation_management(tempLayer, "COMPLETELY_WITHIN", studyAreaMaskDissolved)
             arcpy.CopyFeatures_management(tempLayer, aggregateMaskClipped)
         else:
@@ -49,93 +432,73 @@ def function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSA
 
         outputStats = []
 
-        for dataToAggregate in dataSetsToAggregate:
+        # Calculate size of each aggregation unit
+        arcpy.AddField_management(aggregateMaskClipped, "AREA_SQKM", "DOUBLE")
+        arcpy.CalculateField_management(aggregateMaskClipped, "AREA_SQKM", "!SHAPE.AREA@SQUAREKILOMETERS!", "PYTHON_9.3")
 
-            dataSet = dataToAggregate.dataSet
-            linkCode = dataToAggregate.linkCode
+        unitOids, unitSizes = unitAreas(aggregateMaskClipped)
 
-            # Calculate size of each aggregation unit
-            arcpy.AddField_management(aggregateMaskClipped, "AREA_SQKM", "DOUBLE")
-            arcpy.CalculateField_management(aggregateMaskClipped, "AREA_SQKM", "!SHAPE.AREA@SQUAREKILOMETERS!", "PYTHON_9.3")
+        if numWorkers is None:
+            numWorkers = raster_parallel.getNumWorkers()
 
-            # Productivity metrics
-            tmpLyr2 = arcpy.MakeFeatureLayer_management(aggregateMaskClipped, unitMaskLayer).getOutput(0)
-            OID = str(arcpy.Describe(aggregateMaskClipped).oidFieldName)
-
-            # Initialise variables
-            unitNo = 0
-            numCovers = []
-            shannonIndex = []
-            inverseSimpsonsIndex = []
-            meanPatchAreas = []
+        numChunks = 1
+        if numWorkers > 1 and numRecords > 1:
+            numChunks = assignChunks(aggregateMaskClipped, min(numWorkers, numRecords))
 
-            with arcpy.da.SearchCursor(unitMaskLayer, OID) as gridCursor:
-
-                # Loop through each aggregation unit
-                for gridRow in gridCursor:
-
-                    unitNo = unitNo + 1
-                    log.info("Aggregating data from unit " + str(unitNo) + " of " + str(numRecords))
+        for dataToAggregate in dataSetsToAggregate:
 
-                    expression = OID + "=%s" % gridRow[0]
-                    arcpy.SelectLayerByAttribute_management(unitMaskLayer, "NEW_SELECTION", expression)
-                    arcpy.CopyFeatures_management(unitMaskLayer, singleAggUnit)
+            dataSet = dataToAggregate.dataSet
+            linkCode = dataToAggregate.linkCode
 
-                    # Find aggregation unit size
-                    for row in arcpy.da.SearchCursor(singleAggUnit, "AREA_SQKM"):
-                        unitSize = row[0]
+            if isRaster(dataSet) or cellSize is not None:
 
-                    # Clip data to unit and calculate area
-                    arcpy.Clip_analysis(dataSet, singleAggUnit, dataClippedToUnit)
-                    arcpy.AddField_management(dataClippedToUnit, "AREA_HA", "DOUBLE")
-                    arcpy.CalculateField_management(dataClippedToUnit, "AREA_HA", "!SHAPE.AREA@HECTARES!", "PYTHON_9.3")
+                if isRaster(dataSet):
+                    classRaster = dataSet
+                else:
+                    log.info("Rasterizing " + str(dataSet) + " with a cell size of " + str(cellSize))
+                    classRaster = rasterizeData(dataSet, linkCode, aggregateMaskClipped, cellSize, dataRaster)
 
-                    # Dissolve clipped data and calculate area
-                    arcpy.Dissolve_management(dataClippedToUnit, dataInUnitDissolved, linkCode)
-                    arcpy.AddField_management(dataInUnitDissolved, "AREA_SQKM", "DOUBLE")
-                    arcpy.CalculateField_management(dataInUnitDissolved, "AREA_SQKM", "!SHAPE.AREA@SQUAREKILOMETERS!", "PYTHON_9.3")
+                log.info("Counting cells of " + str(dataSet) + " in " + str(numRecords) + " aggregation units")
+                classAreas = rasterClassAreas(classRaster, aggregateMaskClipped, unitOids, prefix)
 
-                    classificationsCount = 0
-                    probOcc = [] # list which will hold probability of occurence of each type
+                if classRaster == dataRaster:
+                    arcpy.Delete_management(dataRaster)
 
-                    for row in arcpy.da.SearchCursor(dataInUnitDissolved, [linkCode, "AREA_SQKM"]):
-                        classificationsCount += 1
-                        probOcc.append(row[1] / unitSize)
+                # Calculate the metrics for all units at once
+                numCovers, shannonIndex, inverseSimpsonsIndex, meanPatchAreas = unitStatistics(unitSizes, *classAreas)
 
-                    if len(probOcc) == 0:
-                        shannon = -1
-                        inverseSimpsons = -1
-                    else:
-                        shannon = -sum(probOcc * np.log(probOcc))
-                        inverseSimpsons = 1 / sum(np.array(probOcc) * np.array(probOcc))
+            elif numChunks > 1:
+                numCovers, shannonIndex, inverseSimpsonsIndex, meanPatchAreas = parallelOverlayStatistics(
+                    dataSet, linkCode, aggregateMaskClipped, unitOids, numChunks)
 
-                    shannonIndex.append(shannon)
-                    inverseSimpsonsIndex.append(inverseSimpsons)
-                    numCovers.append(classificationsCount)
+            else:
+                log.info("Intersecting " + str(dataSet) + " with " + str(numRecords) + " aggregation units")
 
-                    patchAreas = []
-                    for row in arcpy.da.SearchCursor(dataClippedToUnit, [linkCode, "AREA_HA"]):
-                        patchAreas.append(row[1])
+                # Clip the data to all of the units in one overlay
+                patchUnits, patchClasses, patchAreas = overlayPatches(dataSet, linkCode, aggregateMaskClipped, intersection)
+                classAreas = vectorClassAreas(unitOids, patchUnits, patchClasses, patchAreas)
 
-                    if len(patchAreas) == 0:
-                        meanPatchArea = 0
-                    else:
-                        meanPatchArea = np.mean(patchAreas)
+                arcpy.Delete_management(intersection)
 
-                    meanPatchAreas.append(meanPatchArea)
+                # Calculate the metrics for all units at once
+                numCovers, shannonIndex, inverseSimpsonsIndex, meanPatchAreas = unitStatistics(unitSizes, *classAreas)
 
-            log.info("Completed iteration through aggregation units for " + str(dataSet))
+            log.info("Completed aggregation of " + str(dataSet) + " to " + str(numRecords) + " units")
 
             # Determine output file name for data set statistics
             baseDataSetName = os.path.basename(dataSet).replace('-', '')
             if baseDataSetName[0] == '{':
                 statsFilename = baseDataSetName[1:-1] + '_stats.shp'
             else:
-                statsFilename = baseDataSetName[0:-4] + '_stats.shp'
+                statsFilename = os.path.splitext(baseDataSetName)[0] + '_stats.shp'
 
             aggregateStats = os.path.join(outputFolder, statsFilename)
 
             arcpy.CopyFeatures_management(aggregateMaskClipped, aggregateStats)
+
+            if numChunks > 1:
+                arcpy.DeleteField_management(aggregateStats, chunkField)
+
             arcpy.AddField_management(aggregateStats, "NUM_COVERS", "SHORT")
             arcpy.AddField_management(aggregateStats, "SHANNON", "DOUBLE", 6, 2)
             arcpy.AddField_management(aggregateStats, "INVSIMPSON", "DOUBLE", 6, 2)
@@ -145,10 +508,10 @@ def function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSA
             with arcpy.da.UpdateCursor(aggregateStats, ['NUM_COVERS', 'SHANNON', 'INVSIMPSON', 'MEANPATCH']) as cursor:
                 for row in cursor:
 
-                    row[0] = numCovers[unitNo]
-                    row[1] = shannonIndex[unitNo]
-                    row[2] = inverseSimpsonsIndex[unitNo]
-                    row[3] = meanPatchAreas[unitNo]
+                    row[0] = int(numCovers[unitNo])
+                    row[1] = float(shannonIndex[unitNo])
+                    row[2] = float(inverseSimpsonsIndex[unitNo])
+                    row[3] = float(meanPatchAreas[unitNo])
 
                     cursor.updateRow(row)
                     unitNo = unitNo + 1
@@ -7,9 +7,10 @@ import configuration
 
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.resample as resample
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log, common])
+refresh_modules([log, common, resample])
 
 def bufferMask(inputDEM, studyAreaMask, outputStudyAreaMaskBuff):
 
@@ -52,27 +53,20 @@ def bufferMask(inputDEM, studyAreaMask, outputStudyAreaMaskBuff):
 
 def clipLargeDEM(DEM, StudyAreaMask):
 
+    '''
+    Clips DEMs larger than 1Gb to a 5km buffer around the study area mask, if clipping large DEMs is switched on
+    in the user settings. Otherwise the whole DEM is used, as preprocessing runs in tiles when it does not fit in memory.
+    '''
+
     try:
-        # Work out filesize of DEM
-        cols = arcpy.GetRasterProperties_management(DEM, "COLUMNCOUNT").getOutput(0)
-        rows = arcpy.GetRasterProperties_management(DEM, "ROWCOUNT").getOutput(0)
-        bitType = int(arcpy.GetRasterProperties_management(DEM, "VALUETYPE").getOutput(0))
-
-        if bitType <= 4:    # 8 bit
-            bytes = 1
-        elif bitType <= 6:  # 16 bit
-            bytes = 2
-        elif bitType <= 9:  # 32 bit
-            bytes = 4
-        elif bitType <= 14: # 64 bit
-            bytes = 8
-        else:
-            bytes = 4
+        if common.getUserSetting('clipLargeDEM', 'No') != 'Yes':
+            return DEM
 
-        sizeInGb = int(cols) * int(rows) * bytes / (1024 * 1024 * 1024)
+        # Work out filesize of DEM
+        sizeInGb = checkRasterSizeGB(DEM)
 
         if sizeInGb > 1: # 1Gb
-            log.info('Clipping DEM as original DEM is too large (approximately ' + str(sizeInGb) + 'Gb)')
+            log.info('Clipping DEM as original DEM is too large (approximately ' + str(round(sizeInGb, 2)) + 'Gb)')
 
             # Buffer study area mask by 5km            
             bufferSAM = os.path.join(arcpy.env.scratchGDB, "bufferSAM")
@@ -145,7 +139,7 @@ def reprojectGeoDEM(inputDEM, outputDEM):
     log.info("DEM coordinate system is now " + DEMSpatRef.Name)
 
 
-def clipInputs(outputFolder, studyAreaMaskBuff, inputDEM, inputLC, inputSoil, inputStreamNetwork, outputDEM, outputLC, outputSoil, outputStream):
+def clipInputs(outputFolder, studyAreaMaskBuff, inputDEM, inputLC, inputSoil, inputStreamNetwork, outputDEM, outputLC, outputSoil, outputStream, engine=None):
 
     try:
         log.info("Clipping input data")
@@ -157,6 +151,10 @@ def clipInputs(outputFolder, studyAreaMaskBuff, inputDEM, inputLC, inputSoil, in
         lcResample = prefix + "lcResample"
         soilResample = prefix + "soilResample"
 
+        # The 'NumPy' engine resamples raster land cover and soil block by block, clipping them in the same pass
+        if engine is None:
+            engine = common.getUserSetting('hydrologyEngine', 'ArcPy')
+
         # Clip DEM
         # Check DEM not compressed. If it is, uncompress before clipping.
         compression = arcpy.Describe(inputDEM).compressionType
@@ -181,7 +179,11 @@ def clipInputs(outputFolder, studyAreaMaskBuff, inputDEM, inputLC, inputSoil, in
         # Resample and clip land cover
         lcFormat = arcpy.Describe(inputLC).dataType
 
-        if lcFormat in ['RasterDataset', 'RasterLayer']:
+        if lcFormat in ['RasterDataset', 'RasterLayer'] and engine == 'NumPy':
+            # Land cover classes are resampled by majority and clipped in a single pass
+            resample.resampleToGrid(inputLC, outputLC, outputDEM, 'MAJORITY', studyAreaMaskBuff, outputFolder)
+
+        elif lcFormat in ['RasterDataset', 'RasterLayer']:
             lcResampleInt = arcpy.sa.ApplyEnvironment(inputLC)
             lcResampleInt.save(lcResample)
             del lcResampleInt
@@ -197,7 +199,11 @@ def clipInputs(outputFolder, studyAreaMaskBuff, inputDEM, inputLC, inputSoil, in
         # Resample and clip soil
         soilFormat = arcpy.Describe(inputSoil).dataType
 
-        if soilFormat in ['RasterDataset', 'RasterLayer']:
+        if soilFormat in ['RasterDataset', 'RasterLayer'] and engine == 'NumPy':
+            # Soil classes are resampled by majority and clipped in a single pass
+            resample.resampleToGrid(inputSoil, outputSoil, outputDEM, 'MAJORITY', studyAreaMaskBuff, outputFolder)
+
+        elif soilFormat in ['RasterDataset', 'RasterLayer']:
             soilResampleInt = arcpy.sa.ApplyEnvironment(inputSoil)
             soilResampleInt.save(soilResample)
             del soilResampleInt
@@ -296,6 +296,24 @@ def runSystemChecks(folder=None, rerun=False):
         log.warning("Disk containing scratch workspace has less than " + str(freeSpaceGb) + "Gb free space. This may cause this tool to fail.")
 
 
+def getUserSetting(settingName, default=None):
+
+    ''' Returns the value of a setting from the user settings file, or the default if it has not been set '''
+
+    value = None
+    try:
+        if os.path.exists(configuration.userSettingsFile):
+            value = readXML(configuration.userSettingsFile, settingName, showErrors=False)
+
+    except Exception:
+        pass # If any errors occur, ignore them. Just use the default value.
+
+    if value is None or value == '':
+        value = default
+
+    return value
+
+
 def paramsAsText(params):
 
     paramsText = []
@@ -0,0 +1,145 @@
+'''
+Unit by class area matrix and the diversity metrics calculated from it.
+
+The area of each class in each aggregation unit is held as a sparse matrix in compressed sparse row (CSR) form:
+the non-zero class areas of all units in one array, ordered by unit, with the start of each unit's row in indptr.
+Both the vector (overlay) and raster (cell count) aggregation modes build the same matrix, and the metrics are
+reductions over its rows for all units at once, so they scale to millions of units without a loop over units.
+The module does not depend on arcpy.
+'''
+
+import numpy as np
+
+
+class UnitClassMatrix(object):
+
+    '''
+    Sparse matrix of the area of each class in each unit, in CSR form.
+
+    The classes present in unit i are classes[indptr[i]:indptr[i + 1]], with their areas in the same positions
+    of areas. Only classes with a non-zero area are stored.
+    '''
+
+    def __init__(self, indptr, classes, areas, numClasses):
+
+        self.indptr = indptr
+        self.classes = classes
+        self.areas = areas
+        self.numUnits = indptr.size - 1
+        self.numClasses = numClasses
+
+    @classmethod
+    def fromPairs(cls, units, classes, areas, numUnits, numClasses=None):
+
+        '''
+        Builds the matrix from (unit, class, area) entries, with units and classes given as integer indices.
+        The areas of repeated (unit, class) pairs are summed.
+        '''
+
+        units = np.asarray(units, dtype=np.int64)
+        classes = np.asarray(classes, dtype=np.int64)
+        areas = np.asarray(areas, dtype=np.float64)
+
+        if numClasses is None:
+            numClasses = int(classes.max()) + 1 if classes.size > 0 else 0
+
+        pairs, pairIndex = np.unique(units * max(numClasses, 1) + classes, return_inverse=True)
+        pairAreas = np.bincount(pairIndex, weights=areas, minlength=pairs.size)
+
+        nonZero = pairAreas > 0
+        pairs = pairs[nonZero]
+        pairAreas = pairAreas[nonZero]
+
+        pairUnits = pairs // max(numClasses, 1)
+
+        indptr = np.zeros(numUnits + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairUnits, minlength=numUnits), out=indptr[1:])
+
+        return cls(indptr, pairs % max(numClasses, 1), pairAreas, numClasses)
+
+    def rowUnits(self):
+
+        ''' Unit of each stored entry '''
+
+        return np.repeat(np.arange(self.numUnits), np.diff(self.indptr))
+
+    def rowSums(self, values):
+
+        ''' Sums values (one for each stored entry) over each unit '''
+
+        return np.bincount(self.rowUnits(), weights=values, minlength=self.numUnits)
+
+    def unitTotals(self):
+
+        ''' Total area of all classes in each unit '''
+
+        return self.rowSums(self.areas)
+
+    def proportions(self, unitSizes=None):
+
+        '''
+        Area of each stored entry as a proportion of its unit's size.
+        unitSizes defaults to the total area of the classes in each unit, and must be in the same units as the areas.
+        '''
+
+        if unitSizes is None:
+            unitSizes = self.unitTotals()
+
+        return self.areas / np.asarray(unitSizes, dtype=np.float64)[self.rowUnits()]
+
+    def richness(self):
+
+        ''' Number of classes present in each unit '''
+
+        return np.diff(self.indptr)
+
+    def shannon(self, unitSizes=None, noData=-1.0):
+
+        ''' Shannon index of each unit, -sum(p ln p). Units without any classes are set to noData. '''
+
+        p = self.proportions(unitSizes)
+        hasClasses = self.richness() > 0
+
+        index = np.full(self.numUnits, noData)
+        index[hasClasses] = -self.rowSums(p * np.log(p))[hasClasses]
+
+        return index
+
+    def inverseSimpson(self, unitSizes=None, noData=-1.0):
+
+        ''' Inverse Simpson index of each unit, 1 / sum(p^2). Units without any classes are set to noData. '''
+
+        p = self.proportions(unitSizes)
+        hasClasses = self.richness() > 0
+
+        index = np.full(self.numUnits, noData)
+        index[hasClasses] = 1.0 / self.rowSums(p * p)[hasClasses]
+
+        return index
+
+    def evenness(self, unitSizes=None, noData=-1.0):
+
+        '''
+        Pielou's evenness of each unit, the Shannon index divided by the log of the number of classes.
+        Units with fewer than two classes are set to noData.
+        '''
+
+        richness = self.richness()
+        hasEvenness = richness > 1
+
+        index = np.full(self.numUnits, noData)
+        index[hasEvenness] = self.shannon(unitSizes)[hasEvenness] / np.log(richness[hasEvenness])
+
+        return index
+
+    def meanPatchArea(self, numPatches, noData=0.0):
+
+        ''' Mean patch area of each unit, given the number of patches in each unit. Units without patches are set to noData. '''
+
+        numPatches = np.asarray(numPatches)
+        hasPatches = numPatches > 0
+
+        meanArea = np.full(self.numUnits, noData)
+        meanArea[hasPatches] = self.unitTotals()[hasPatches] / numPatches[hasPatches]
+
+        return meanArea
@@ -0,0 +1,1027 @@
+'''
+NumPy hydrology kernels for preprocessing the DEM.
+
+The kernels work on whole arrays (or tiles) in which NoData cells are NaN, and do not depend on arcpy.
+Cells are visited through flat indices into an array padded with one cell of NoData on each side,
+so that every cell with data has eight neighbours and the edge of the grid is treated in the same way as NoData.
+'''
+
+import heapq
+import collections
+import array
+import numpy as np
+
+
+def pad_nodata(values):
+
+    ''' Pads a float array with one cell of NaN (NoData) on each side '''
+
+    return np.pad(np.asarray(values, dtype=np.float32), 1, mode='constant', constant_values=np.nan)
+
+
+def neighbour_offsets(n_cols):
+
+    ''' Flat index offsets of the eight neighbours of a cell in a padded array with n_cols columns (excluding padding) '''
+
+    stride = n_cols + 2
+
+    return [-stride - 1, -stride, -stride + 1, -1, 1, stride - 1, stride, stride + 1]
+
+
+def next_to_nodata(padded):
+
+    ''' Cells of a padded array which have data and at least one NoData neighbour (or are on the edge of the grid) '''
+
+    nodata = np.isnan(padded)
+    edge = np.zeros(padded.shape, dtype=bool)
+    core = edge[1:-1, 1:-1]
+
+    rows, cols = padded.shape
+    for rowOffset in (-1, 0, 1):
+        for colOffset in (-1, 0, 1):
+            if rowOffset != 0 or colOffset != 0:
+                core |= nodata[1 + rowOffset:rows - 1 + rowOffset, 1 + colOffset:cols - 1 + colOffset]
+
+    return edge & ~nodata
+
+
+def priority_flood_fill(dem, outlets=None):
+
+    '''
+    Fills the depressions in a DEM, in the same way as the Spatial Analyst Fill tool (with no z limit).
+
+    Uses the Priority-Flood algorithm: cells at the edge of the data (next to NoData or the edge of the grid)
+    are outlets, and cells are visited from the lowest outlet inwards, raising each cell to at least the level
+    of the cell it was reached from. Cells raised into a depression (or on a flat) are visited through a
+    plain queue rather than the priority queue, so filled areas cost O(1) per cell.
+
+    outlets is an optional boolean array of cells which also drain freely (such as cells on the study area boundary).
+    Returns the filled DEM as a float32 array.
+    '''
+
+    n_rows, n_cols = dem.shape
+    padded = pad_nodata(dem)
+
+    seeds = next_to_nodata(padded)
+    if outlets is not None:
+        seeds[1:-1, 1:-1] |= np.asarray(outlets, dtype=bool) & ~np.isnan(padded[1:-1, 1:-1])
+
+    # Python arrays are much faster than NumPy arrays for single element access
+    elevation = array.array('f', padded.tobytes())
+    closed = bytearray(np.isnan(padded).tobytes())
+
+    seedIndex = np.flatnonzero(seeds)
+    for index in seedIndex.tolist():
+        closed[index] = 1
+
+    openCells = list(zip(padded.flat[seedIndex].tolist(), seedIndex.tolist()))
+    heapq.heapify(openCells)
+
+    pit = collections.deque()
+    offsets = neighbour_offsets(n_cols)
+
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    while openCells or pit:
+
+        if pit:
+            cell = pit.popleft()
+            level = elevation[cell]
+        else:
+            level, cell = heappop(openCells)
+
+        for offset in offsets:
+            neighbour = cell + offset
+
+            if closed[neighbour]:
+                continue
+
+            closed[neighbour] = 1
+
+            if elevation[neighbour] <= level:
+                elevation[neighbour] = level
+                pit.append(neighbour)
+            else:
+                heappush(openCells, (elevation[neighbour], neighbour))
+
+    filled = np.frombuffer(elevation, dtype=np.float32).reshape(n_rows + 2, n_cols + 2)
+
+    return np.array(filled[1:-1, 1:-1])
+
+
+# Watershed labels used by the tiled fill: NoData cells, cells not yet reached, and cells which drain out of the DEM
+label_nodata = -1
+label_none = 0
+label_drains = 1
+
+
+def priority_flood_labels(dem, drains):
+
+    '''
+    First pass of the tiled fill (the parallel Priority-Flood of Barnes et al.): fills one tile of a DEM on its own.
+
+    Cells which drain out of the DEM (drains, such as cells next to NoData in the whole grid) are outlets as in
+    priority_flood_fill. Cells on the edge of the tile are also flooded from, but each is given a new label
+    unless it has already been reached from a lower cell, and every cell reached from it shares its label.
+    Where two labels meet, the lowest level at which water spills between them is recorded.
+
+    Returns the filled tile (float32), the labels (int32: label_nodata, label_drains, or 2 upwards for
+    the areas draining to each edge cell) and the spill edges within the tile as three arrays: the two labels
+    (lower label first) and the spill elevation.
+    '''
+
+    n_rows, n_cols = dem.shape
+    padded = pad_nodata(dem)
+
+    drains = np.asarray(drains, dtype=bool) & ~np.isnan(padded[1:-1, 1:-1])
+
+    edge = np.zeros(padded.shape, dtype=bool)
+    edge[1, 1:-1] = edge[-2, 1:-1] = edge[1:-1, 1] = edge[1:-1, -2] = True
+    edge &= ~np.isnan(padded)
+    edge[1:-1, 1:-1] &= ~drains
+
+    labelGrid = np.where(np.isnan(padded), label_nodata, label_none).astype(np.int32)
+    labelGrid[1:-1, 1:-1][drains] = label_drains
+
+    elevation = array.array('f', padded.tobytes())
+    labels = array.array('i', labelGrid.tobytes())
+
+    seedIndex = np.flatnonzero(labelGrid == label_drains)
+    edgeIndex = np.flatnonzero(edge)
+    seedIndex = np.concatenate([seedIndex, edgeIndex])
+
+    openCells = list(zip(padded.flat[seedIndex].tolist(), seedIndex.tolist()))
+    heapq.heapify(openCells)
+
+    pit = collections.deque()
+    offsets = neighbour_offsets(n_cols)
+    spills = {}
+    nextLabel = label_drains + 1
+
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    while openCells or pit:
+
+        if pit:
+            cell = pit.popleft()
+            level = elevation[cell]
+        else:
+            level, cell = heappop(openCells)
+
+        label = labels[cell]
+        if label == label_none:
+            label = nextLabel
+            labels[cell] = label
+            nextLabel += 1
+
+        for offset in offsets:
+            neighbour = cell + offset
+            neighbourLabel = labels[neighbour]
+
+            if neighbourLabel != label_none:
+
+                # Record the lowest level at which water spills between two labels
+                if neighbourLabel > label_none and neighbourLabel != label:
+                    key = (min(label, neighbourLabel), max(label, neighbourLabel))
+                    spill = max(level, elevation[neighbour])
+                    if spill < spills.get(key, np.inf):
+                        spills[key] = spill
+                continue
+
+            labels[neighbour] = label
+
+            if elevation[neighbour] <= level:
+                elevation[neighbour] = level
+                pit.append(neighbour)
+            else:
+                heappush(openCells, (elevation[neighbour], neighbour))
+
+    filled = np.frombuffer(elevation, dtype=np.float32).reshape(n_rows + 2, n_cols + 2)
+    labelGrid = np.frombuffer(labels, dtype=np.int32).reshape(n_rows + 2, n_cols + 2)
+
+    keys = np.array(list(spills.keys()), dtype=np.int64).reshape(-1, 2)
+    levels = np.array(list(spills.values()), dtype=np.float64)
+
+    return np.array(filled[1:-1, 1:-1]), np.array(labelGrid[1:-1, 1:-1]), (keys[:, 0], keys[:, 1], levels)
+
+
+def global_labels(labels, base):
+
+    '''
+    Converts the labels of a tile to labels unique across all tiles: 0 for cells which drain out of the DEM,
+    base upwards for the tile's own labels and -1 for NoData.
+    '''
+
+    labels = np.asarray(labels)
+
+    return np.where(labels > label_drains, labels - (label_drains + 1) + base,
+                    np.where(labels == label_drains, 0, -1)).astype(labels.dtype)
+
+
+def boundary_spills(elev_a, labels_a, elev_b, labels_b):
+
+    '''
+    Spill edges between two lines of cells facing each other across a tile boundary, where cell i of line a
+    touches cells i - 1, i and i + 1 of line b. The labels are global labels (see global_labels).
+    Returns the two labels and the spill elevation of each edge.
+    '''
+
+    labelParts = []
+    otherParts = []
+    spillParts = []
+
+    length = labels_a.size
+    for shift in (-1, 0, 1):
+
+        a = slice(max(-shift, 0), length - max(shift, 0))
+        b = slice(max(shift, 0), length - max(-shift, 0))
+
+        valid = (labels_a[a] >= 0) & (labels_b[b] >= 0) & (labels_a[a] != labels_b[b])
+
+        labelParts.append(labels_a[a][valid])
+        otherParts.append(labels_b[b][valid])
+        spillParts.append(np.maximum(elev_a[a], elev_b[b])[valid].astype(np.float64))
+
+    return np.concatenate(labelParts), np.concatenate(otherParts), np.concatenate(spillParts)
+
+
+def spill_levels(num_labels, label_a, label_b, spill):
+
+    '''
+    Second pass of the tiled fill: solves the level each label's area must be filled to before it drains out of the DEM.
+
+    The labels form a graph joined by the spill edges, and label 0 drains out of the DEM. The fill level of each label
+    is the lowest possible value of the highest spill along a path to label 0, found by a priority flood over the graph.
+    Returns a float64 array of the fill level of each label (-inf for label 0, and for labels which are not reached).
+    '''
+
+    label_a = np.asarray(label_a, dtype=np.int64)
+    label_b = np.asarray(label_b, dtype=np.int64)
+    spill = np.asarray(spill, dtype=np.float64)
+
+    # Both directions of each edge, sorted by label for a compressed adjacency list
+    sources = np.concatenate([label_a, label_b])
+    targets = np.concatenate([label_b, label_a])
+    spills = np.concatenate([spill, spill])
+
+    order = np.argsort(sources, kind='mergesort')
+    targets = targets[order].tolist()
+    spills = spills[order].tolist()
+    starts = np.searchsorted(sources[order], np.arange(num_labels + 1)).tolist()
+
+    levels = [np.inf] * num_labels
+    levels[0] = -np.inf
+    done = bytearray(num_labels)
+    openLabels = [(-np.inf, 0)]
+
+    while openLabels:
+
+        level, label = heapq.heappop(openLabels)
+        if done[label]:
+            continue
+        done[label] = 1
+
+        for edge in range(starts[label], starts[label + 1]):
+            other = targets[edge]
+            otherLevel = max(level, spills[edge])
+            if otherLevel < levels[other]:
+                levels[other] = otherLevel
+                heapq.heappush(openLabels, (otherLevel, other))
+
+    levels = np.array(levels, dtype=np.float64)
+    levels[np.isinf(levels)] = -np.inf
+
+    return levels
+
+
+def tile_spill_levels(num_labels, tile_spills, tile_sides, tiles_per_row):
+
+    '''
+    Solves the fill level of each label of a tiled fill (see spill_levels) from the results of filling each tile on its own.
+
+    tile_spills are the spill edges within each tile, and tile_sides the filled values and global labels of each tile's
+    top row, bottom row, left column and right column, as (values, labels) pairs. The tiles are in row-major order,
+    with tiles_per_row tiles across the grid. Spill edges across the tile boundaries are found along whole columns and
+    rows of tile edges, so the edges between diagonal neighbours at the corners of tiles are included.
+    '''
+
+    spills = list(tile_spills)
+    numTileRows = len(tile_sides) // tiles_per_row
+
+    def joinedSides(tileNos, side):
+        return [np.concatenate([tile_sides[tileNo][side][i] for tileNo in tileNos]) for i in range(2)]
+
+    for tileCol in range(1, tiles_per_row):
+        left = joinedSides([tileRow * tiles_per_row + tileCol - 1 for tileRow in range(numTileRows)], 3)
+        right = joinedSides([tileRow * tiles_per_row + tileCol for tileRow in range(numTileRows)], 2)
+        spills.append(boundary_spills(left[0], left[1], right[0], right[1]))
+
+    for tileRow in range(1, numTileRows):
+        above = joinedSides(range((tileRow - 1) * tiles_per_row, tileRow * tiles_per_row), 1)
+        below = joinedSides(range(tileRow * tiles_per_row, (tileRow + 1) * tiles_per_row), 0)
+        spills.append(boundary_spills(above[0], above[1], below[0], below[1]))
+
+    return spill_levels(num_labels, *[np.concatenate([spill[i] for spill in spills]) for i in range(3)])
+
+
+def raise_to_levels(filled, labels, levels):
+
+    ''' Raises the cells of a filled tile to the fill level of their label, with NaN for NoData (label -1) '''
+
+    return np.where(labels >= 0, np.maximum(filled, levels[np.maximum(labels, 0)]), np.nan).astype(np.float32)
+
+
+# D8 flow direction codes (as used by the Spatial Analyst FlowDirection tool) and the (row, col) offset of each
+d8_codes = [1, 2, 4, 8, 16, 32, 64, 128]
+d8_offsets = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+
+# Flow direction for cells with no flow (sinks), and for NoData cells in uint8 flow direction arrays
+no_flow = 0
+fdr_nodata = 255
+
+# Flow direction in degrees for each D8 code
+d8_degrees = {1: 90, 2: 135, 4: 180, 8: 225, 16: 270, 32: 315, 64: 0, 128: 45}
+
+
+def d8_flow_direction(dem, cell_width, cell_height):
+
+    '''
+    Calculates D8 flow directions from a (filled) DEM, as a uint8 array of the codes used by FlowDirection.
+
+    Each cell flows to the neighbour with the steepest drop. Ties go to the first neighbour in code order.
+    Cells with no lower neighbour flow out of the grid if they are next to NoData or the edge of the grid
+    (as in the NORMAL option of FlowDirection). Otherwise they are on a flat, and are resolved by a breadth-first
+    search out from the cells draining the flat, so each cell on a flat flows towards its nearest outlet.
+    Cells which still have no flow (sinks) are 0, and NoData cells are 255.
+    '''
+
+    n_rows, n_cols = dem.shape
+    padded = pad_nodata(dem)
+    centre = padded[1:-1, 1:-1]
+    nodata = np.isnan(centre)
+
+    diagonal = np.hypot(cell_width, cell_height)
+
+    fdr = np.zeros((n_rows, n_cols), dtype=np.uint8)
+    maxDrop = np.zeros((n_rows, n_cols), dtype=np.float32)
+    toNoData = np.zeros((n_rows, n_cols), dtype=np.uint8)
+
+    with np.errstate(invalid='ignore'):
+        for code, (rowOffset, colOffset) in zip(d8_codes, d8_offsets):
+
+            neighbour = padded[1 + rowOffset:n_rows + 1 + rowOffset, 1 + colOffset:n_cols + 1 + colOffset]
+
+            if rowOffset != 0 and colOffset != 0:
+                distance = diagonal
+            elif rowOffset != 0:
+                distance = cell_height
+            else:
+                distance = cell_width
+
+            drop = (centre - neighbour) / np.float32(distance)
+
+            steeper = drop > maxDrop
+            fdr[steeper] = code
+            maxDrop[steeper] = drop[steeper]
+
+            # First NoData neighbour, for cells at the edge of the data
+            toNoData[(toNoData == 0) & np.isnan(neighbour)] = code
+
+    # Edge cells with no lower neighbour flow out of the grid
+    outward = (fdr == no_flow) & (toNoData != 0)
+    fdr[outward] = toNoData[outward]
+
+    fdr[nodata] = fdr_nodata
+
+    resolve_flats(padded, fdr)
+
+    return fdr
+
+
+def resolve_flats(padded, fdr):
+
+    '''
+    Gives flow directions to cells on flats (cells with no flow), in place.
+
+    Starting from the cells which already have a flow direction, cells with no flow at the same elevation
+    are given a direction towards the cell they were reached from, breadth first.
+    '''
+
+    n_rows, n_cols = fdr.shape
+    unresolved = fdr == no_flow
+
+    if not unresolved.any():
+        return
+
+    stride = n_cols + 2
+    offsets = neighbour_offsets(n_cols)
+
+    # Code for each flat index offset
+    offsetCodes = {}
+    for code, (rowOffset, colOffset) in zip(d8_codes, d8_offsets):
+        offsetCodes[rowOffset * stride + colOffset] = code
+
+    # Cells with a flow direction next to unresolved cells are the starting points
+    flat = np.zeros(padded.shape, dtype=bool)
+    flat[1:-1, 1:-1] = unresolved
+
+    nextToFlat = np.zeros(padded.shape, dtype=bool)
+    core = nextToFlat[1:-1, 1:-1]
+    for rowOffset, colOffset in d8_offsets:
+        core |= flat[1 + rowOffset:n_rows + 1 + rowOffset, 1 + colOffset:n_cols + 1 + colOffset]
+
+    nextToFlat &= ~flat & ~np.isnan(padded)
+
+    elevation = array.array('f', padded.tobytes())
+    openCells = bytearray(flat.tobytes())
+    codes = bytearray(padded.size)
+
+    queue = collections.deque(np.flatnonzero(nextToFlat).tolist())
+
+    while queue:
+        cell = queue.popleft()
+        level = elevation[cell]
+
+        for offset in offsets:
+            neighbour = cell + offset
+
+            if openCells[neighbour] and elevation[neighbour] == level:
+                openCells[neighbour] = 0
+                codes[neighbour] = offsetCodes[-offset]
+                queue.append(neighbour)
+
+    resolved = np.frombuffer(bytes(codes), dtype=np.uint8).reshape(padded.shape)[1:-1, 1:-1]
+    fdr[unresolved] = resolved[unresolved]
+
+
+def fdr_degrees(fdr):
+
+    ''' Flow directions in degrees (clockwise from north) for a uint8 array of D8 codes, with -1 where there is no flow or NoData '''
+
+    lookup = np.full(256, -1, dtype=np.int16)
+    for code, degrees in d8_degrees.items():
+        lookup[code] = degrees
+
+    return lookup[np.asarray(fdr, dtype=np.uint8)]
+
+
+def downstream_index(fdr):
+
+    '''
+    Flat index of the cell each cell flows to, for a uint8 array of D8 codes.
+    Cells which flow out of the grid or into NoData, have no flow, or are NoData themselves are -1.
+    '''
+
+    n_rows, n_cols = fdr.shape
+    codes = fdr.ravel()
+
+    receivers = np.full(codes.size, -1, dtype=np.int64)
+
+    for code, (rowOffset, colOffset) in zip(d8_codes, d8_offsets):
+
+        cells = np.flatnonzero(codes == code)
+        rows = cells // n_cols + rowOffset
+        cols = cells % n_cols + colOffset
+
+        inside = (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+        receivers[cells[inside]] = rows[inside] * n_cols + cols[inside]
+
+    flowing = receivers >= 0
+    intoNoData = flowing.copy()
+    intoNoData[flowing] = codes[receivers[flowing]] == fdr_nodata
+    receivers[intoNoData] = -1
+
+    return receivers
+
+
+def accumulate(receivers, weights):
+
+    '''
+    Adds the weight of each cell to every cell downstream of it, returning the float64 total for each cell
+    (its own weight plus the weight of all the cells upstream).
+
+    Cells are visited in topological order: the in-degree of each cell is counted, and cells are
+    taken from a queue once all the cells flowing into them have been visited. Each level of the queue
+    is handled with vectorised operations, so the whole sweep is O(N).
+    '''
+
+    total = np.array(weights, dtype=np.float64).ravel()
+
+    hasReceiver = receivers >= 0
+    inDegree = np.bincount(receivers[hasReceiver], minlength=receivers.size)
+
+    queue = np.flatnonzero((inDegree == 0) & hasReceiver)
+
+    while queue.size > 0:
+
+        targets = receivers[queue]
+        flowing = targets >= 0
+        sources = queue[flowing]
+        targets = targets[flowing]
+
+        if targets.size == 0:
+            break
+
+        cells, index = np.unique(targets, return_inverse=True)
+
+        total[cells] += np.bincount(index, weights=total[sources])
+        inDegree[cells] -= np.bincount(index)
+
+        queue = cells[inDegree[cells] == 0]
+
+    return total
+
+
+def flow_accumulation(fdr, weights=None):
+
+    '''
+    Calculates flow accumulation from a uint8 array of D8 codes, in the same way as FlowAccumulation:
+    the accumulated weight (or number of cells, if weights is None) of all the cells flowing into each cell.
+    NoData weights count as zero. Returns a float32 array, NaN where the flow direction is NoData.
+    '''
+
+    nodata = fdr == fdr_nodata
+
+    if weights is None:
+        weights = np.ones(fdr.shape, dtype=np.float64)
+    else:
+        weights = np.where(np.isnan(weights), 0.0, weights).astype(np.float64)
+
+    weights[nodata] = 0.0
+
+    total = accumulate(downstream_index(fdr), weights)
+    total -= weights.ravel()
+
+    acc = total.reshape(fdr.shape).astype(np.float32)
+    acc[nodata] = np.nan
+
+    return acc
+
+
+def tile_flow(fdr):
+
+    '''
+    Flow links for one tile of a flow direction array, read with a halo of one cell (NoData outside the grid).
+
+    Returns, for the cells of the tile (without the halo):
+    - receivers: flat index of the cell each cell flows to within the tile, or -1
+    - outflow: whether each cell flows into another tile
+    - target_rows, target_cols: the row and column (relative to the tile) of the cell each cell flows to
+    - inlets: flat indices of the cells which receive flow from other tiles
+    '''
+
+    n_rows = fdr.shape[0] - 2
+    n_cols = fdr.shape[1] - 2
+    stride = n_cols + 2
+
+    haloReceivers = downstream_index(fdr)
+
+    # Cells of the tile as flat indices into the array with the halo
+    rows, cols = np.divmod(np.arange(n_rows * n_cols), n_cols)
+    core = (rows + 1) * stride + cols + 1
+
+    targets = haloReceivers[core]
+    target_rows, target_cols = np.divmod(targets, stride)
+    target_rows -= 1
+    target_cols -= 1
+
+    inTile = (targets >= 0) & (target_rows >= 0) & (target_rows < n_rows) & (target_cols >= 0) & (target_cols < n_cols)
+    receivers = np.where(inTile, target_rows * n_cols + target_cols, -1)
+    outflow = (targets >= 0) & ~inTile
+
+    # Halo cells flowing into the tile
+    halo = np.ones(fdr.shape, dtype=bool)
+    halo[1:-1, 1:-1] = False
+    haloTargets = haloReceivers[np.flatnonzero(halo)]
+    haloTargets = haloTargets[haloTargets >= 0]
+
+    inletRows, inletCols = np.divmod(haloTargets, stride)
+    intoTile = (inletRows >= 1) & (inletRows <= n_rows) & (inletCols >= 1) & (inletCols <= n_cols)
+    inlets = np.unique((inletRows[intoTile] - 1) * n_cols + inletCols[intoTile] - 1)
+
+    return receivers, outflow, target_rows, target_cols, inlets
+
+
+def tile_exits(receivers, outflow):
+
+    '''
+    For each cell of a tile, the cell where its flow path leaves the tile (an outflow cell), or -1 if the path ends in the tile.
+    Found by pointer jumping, so the cost is O(N log L) for flow paths up to L cells long.
+    '''
+
+    cells = np.arange(receivers.size)
+    pointers = np.where(receivers >= 0, receivers, cells)
+
+    while True:
+        jumped = pointers[pointers]
+        if np.array_equal(jumped, pointers):
+            break
+        pointers = jumped
+
+    return np.where(outflow[pointers], pointers, -1)
+
+
+def solve_tile_links(out_cells, out_targets, out_totals, inlet_cells, inlet_exits):
+
+    '''
+    Solves the flow between tiles.
+
+    Each outflow cell (out_cells, as global flat indices) sends its local total (out_totals) to its target cell
+    in another tile (out_targets), an inlet of that tile. The flow path from each inlet (inlet_cells) leaves
+    its tile at an outflow cell (inlet_exits, -1 if it does not), which forms a small graph of outflow cells
+    solved with accumulate. Returns the inlet cells receiving flow and the total inflow to each.
+    '''
+
+    # Outflow cell at which the flow from each outflow cell next leaves a tile
+    inletOrder = np.argsort(inlet_cells)
+    position = np.searchsorted(inlet_cells[inletOrder], out_targets)
+    position = np.clip(position, 0, max(inlet_cells.size - 1, 0))
+    found = inlet_cells[inletOrder][position] == out_targets
+    exits = np.where(found, inlet_exits[inletOrder][position], -1)
+
+    nodeOrder = np.argsort(out_cells)
+    position = np.clip(np.searchsorted(out_cells[nodeOrder], exits), 0, max(out_cells.size - 1, 0))
+    linked = (exits >= 0) & (out_cells[nodeOrder][position] == exits)
+    receivers = np.where(linked, nodeOrder[position], -1)
+
+    outFlow = accumulate(receivers, out_totals)
+
+    cells, index = np.unique(out_targets, return_inverse=True)
+    inflow = np.bincount(index, weights=outFlow, minlength=cells.size)
+
+    return cells, inflow
+
+
+def stream_classes(acc_ha, min_thresh, maj_thresh):
+
+    '''
+    Classifies a block of flow accumulation (in hectares) using the stream and river initiation thresholds.
+
+    Returns the inverse stream values (0 for stream, 1 for no stream) and the stream classes
+    (1 for streams, 2 for major rivers, NaN elsewhere), with NaN for NoData in both.
+    Accumulation equal to a threshold falls in the class below it, as in Reclassify.
+    '''
+
+    with np.errstate(invalid='ignore'):
+        stream = acc_ha > min_thresh
+        river = acc_ha > maj_thresh
+
+    inverse = np.where(stream, np.float32(0), np.float32(1))
+    inverse[np.isnan(acc_ha)] = np.nan
+
+    classes = np.where(river, np.float32(2), np.where(stream, np.float32(1), np.float32(np.nan)))
+
+    return inverse, classes
+
+
+def stream_receivers(fdr, streams):
+
+    ''' Flat index of the stream cell each stream cell flows to, or -1 if it does not flow to a stream cell '''
+
+    isStream = np.asarray(streams, dtype=bool).ravel()
+
+    receivers = downstream_index(fdr)
+    receivers[~isStream] = -1
+
+    flowing = receivers >= 0
+    notStream = flowing.copy()
+    notStream[flowing] = ~isStream[receivers[flowing]]
+    receivers[notStream] = -1
+
+    return receivers
+
+
+def strahler_order(receivers, streams):
+
+    '''
+    Strahler order of each stream cell, as in StreamOrder with the STRAHLER method (0 for cells which are not streams).
+
+    receivers are from stream_receivers. The stream cells are visited in topological order, as in accumulate.
+    Each cell keeps the highest order flowing into it and how many of its inflows have that order:
+    its order is the highest inflow order, plus one if two or more inflows have it (1 for stream sources).
+    '''
+
+    isStream = np.asarray(streams, dtype=bool).ravel()
+
+    order = np.zeros(receivers.size, dtype=np.int32)
+    best = np.zeros(receivers.size, dtype=np.int32)
+    bestCount = np.zeros(receivers.size, dtype=np.int32)
+
+    hasReceiver = receivers >= 0
+    inDegree = np.bincount(receivers[hasReceiver], minlength=receivers.size)
+
+    queue = np.flatnonzero((inDegree == 0) & isStream)
+    order[queue] = 1
+
+    while queue.size > 0:
+
+        targets = receivers[queue]
+        flowing = targets >= 0
+        sources = queue[flowing]
+        targets = targets[flowing]
+
+        if targets.size == 0:
+            break
+
+        cells, index = np.unique(targets, return_inverse=True)
+
+        # Highest order flowing into each cell at this level, and the number of inflows with that order
+        levelBest = np.zeros(cells.size, dtype=np.int32)
+        np.maximum.at(levelBest, index, order[sources])
+        levelCount = np.bincount(index, weights=(order[sources] == levelBest[index])).astype(np.int32)
+
+        newBest = np.maximum(best[cells], levelBest)
+        bestCount[cells] = np.where(best[cells] == newBest, bestCount[cells], 0) + np.where(levelBest == newBest, levelCount, 0)
+        best[cells] = newBest
+
+        inDegree[cells] -= np.bincount(index)
+
+        queue = cells[inDegree[cells] == 0]
+        order[queue] = best[queue] + (bestCount[queue] >= 2)
+
+    return order.reshape(np.shape(streams))
+
+
+def stream_links(receivers, streams):
+
+    '''
+    Traces the stream links: the stretches of stream between sources, confluences and outlets.
+
+    A link starts at a source or a confluence (a stream cell without exactly one inflow) and follows the flow
+    downstream until the next confluence, whose cell is the last vertex of the link so that links join up.
+    Returns (offsets, vertices), where vertices holds the flat index of the cell at each vertex, link by link,
+    and the vertices of link i are vertices[offsets[i]:offsets[i + 1]]. The cells of each link are found by pointer jumping,
+    so the cost is O(N log L) for links up to L cells long.
+    '''
+
+    isStream = np.asarray(streams, dtype=bool).ravel()
+    streamCells = np.flatnonzero(isStream)
+
+    if streamCells.size == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    hasReceiver = receivers >= 0
+    inDegree = np.bincount(receivers[hasReceiver], minlength=receivers.size)
+
+    # Upstream cell of each cell with one inflow (the head of each link points to itself)
+    cells = np.arange(receivers.size)
+    upstream = cells.copy()
+    sources = np.flatnonzero(hasReceiver)
+    single = inDegree[receivers[sources]] == 1
+    upstream[receivers[sources[single]]] = sources[single]
+
+    # Jump upstream to the head of each link, counting the cells passed
+    pointers = upstream
+    steps = (upstream != cells).astype(np.int64)
+
+    while True:
+        jumped = pointers[pointers]
+        if np.array_equal(jumped, pointers):
+            break
+        steps = steps + steps[pointers]
+        pointers = jumped
+
+    linkHead = pointers[streamCells]
+    position = steps[streamCells]
+
+    # Order the cells link by link, downstream along each link
+    sortOrder = np.lexsort((position, linkHead))
+    linkCells = streamCells[sortOrder]
+    linkHeads = linkHead[sortOrder]
+
+    starts = np.flatnonzero(np.r_[True, linkHeads[1:] != linkHeads[:-1]])
+    ends = np.r_[starts[1:], linkCells.size]
+
+    # Add the confluence downstream of each link as its last vertex
+    lastCells = linkCells[ends - 1]
+    joins = receivers[lastCells]
+    hasJoin = joins >= 0
+
+    counts = (ends - starts) + hasJoin
+    offsets = np.r_[0, np.cumsum(counts)]
+
+    vertices = np.empty(offsets[-1], dtype=np.int64)
+    within = np.arange(linkCells.size) - np.repeat(starts, ends - starts)
+    vertices[np.repeat(offsets[:-1], ends - starts) + within] = linkCells
+    vertices[offsets[1:][hasJoin] - 1] = joins[hasJoin]
+
+    return offsets, vertices
+
+
+def douglas_peucker(x, y, offsets, tolerance):
+
+    '''
+    Simplifies each line (vertices offsets[i] to offsets[i + 1] of x and y) with the Douglas-Peucker algorithm.
+
+    All the lines are simplified together: at each step, the distances of the points in every segment still
+    to be checked are calculated in one vectorised operation, and each segment whose furthest point is more
+    than tolerance away is split at that point. Returns a boolean array of the vertices to keep.
+    '''
+
+    keep = np.zeros(x.size, dtype=bool)
+    keep[offsets[:-1]] = True
+    keep[offsets[1:] - 1] = True
+
+    starts = offsets[:-1]
+    ends = offsets[1:] - 1
+
+    toCheck = ends - starts >= 2
+    starts = starts[toCheck]
+    ends = ends[toCheck]
+
+    while starts.size > 0:
+
+        lengths = ends - starts - 1
+        segment = np.repeat(np.arange(starts.size), lengths)
+        segmentStarts = np.r_[0, np.cumsum(lengths)[:-1]]
+        points = np.repeat(starts + 1, lengths) + (np.arange(segment.size) - np.repeat(segmentStarts, lengths))
+
+        x0 = x[starts][segment]
+        y0 = y[starts][segment]
+        dx = x[ends][segment] - x0
+        dy = y[ends][segment] - y0
+        length = np.hypot(dx, dy)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distance = np.abs(dx * (y0 - y[points]) - dy * (x0 - x[points])) / length
+
+        # Where the segment starts and ends at the same point, use the distance from that point
+        closed = length == 0
+        distance[closed] = np.hypot(x[points][closed] - x0[closed], y[points][closed] - y0[closed])
+
+        maxDistance = np.maximum.reduceat(distance, segmentStarts)
+
+        # First point in each segment at the maximum distance
+        furthest = np.flatnonzero(distance == maxDistance[segment])
+        firstIndex = np.unique(segment[furthest], return_index=True)[1]
+        furthest = points[furthest[firstIndex]]
+
+        split = maxDistance > tolerance
+        furthest = furthest[split]
+        keep[furthest] = True
+
+        starts = np.r_[starts[split], furthest]
+        ends = np.r_[furthest, ends[split]]
+
+        toCheck = ends - starts >= 2
+        starts = starts[toCheck]
+        ends = ends[toCheck]
+
+    return keep
+
+
+def line_segments(rows, cols, offsets):
+
+    '''
+    Splits lines into their segments. rows and cols are the positions of the line vertices in cells from the top left
+    corner of the grid, with the vertices of line i from offsets[i] to offsets[i + 1].
+    Returns the start row, start column, end row and end column of each segment.
+    '''
+
+    # Segments join each vertex to the next, except the last vertex of each line
+    lastVertex = np.zeros(rows.size, dtype=bool)
+    lastVertex[offsets[1:] - 1] = True
+    starts = np.flatnonzero(~lastVertex)
+
+    return rows[starts], cols[starts], rows[starts + 1], cols[starts + 1]
+
+
+def rasterize_segments(row_start, col_start, row_end, col_end, n_rows, n_cols):
+
+    '''
+    Marks the cells crossed by line segments, as a boolean array of n_rows by n_cols.
+
+    All the segments are sampled together (a vectorised DDA), at intervals of no more than one cell along
+    the longer axis of each segment. Parts of segments outside the array are ignored.
+    '''
+
+    streams = np.zeros((n_rows, n_cols), dtype=bool)
+
+    if row_start.size == 0:
+        return streams
+
+    rowChange = row_end - row_start
+    colChange = col_end - col_start
+
+    samples = np.ceil(np.maximum(np.abs(rowChange), np.abs(colChange))).astype(np.int64) + 1
+    segment = np.repeat(np.arange(row_start.size), samples)
+    step = np.arange(segment.size) - np.repeat(np.cumsum(samples) - samples, samples)
+    fraction = step / np.maximum(samples - 1, 1)[segment].astype(np.float64)
+
+    sampleRows = np.floor(row_start[segment] + fraction * rowChange[segment]).astype(np.int64)
+    sampleCols = np.floor(col_start[segment] + fraction * colChange[segment]).astype(np.int64)
+
+    inside = (sampleRows >= 0) & (sampleRows < n_rows) & (sampleCols >= 0) & (sampleCols < n_cols)
+    streams[sampleRows[inside], sampleCols[inside]] = True
+
+    return streams
+
+
+def rasterize_lines(rows, cols, offsets, n_rows, n_cols):
+
+    '''
+    Marks the cells crossed by lines, as a boolean array of n_rows by n_cols.
+    The vertices are given as for line_segments, and the segments are rasterized by rasterize_segments.
+    '''
+
+    row_start, col_start, row_end, col_end = line_segments(rows, cols, offsets)
+
+    return rasterize_segments(row_start, col_start, row_end, col_end, n_rows, n_cols)
+
+
+def band_distance(streams, max_distance):
+
+    '''
+    Exact Euclidean distance (in cells) from each cell to the nearest stream cell, for cells within max_distance
+    cells of a stream. Cells further away are inf.
+
+    Uses the separable linear-time distance transform of Meijster et al.: distances down each column,
+    then the lower envelope of parabolas along each row. Only the window of the array within max_distance of
+    the streams is calculated, and column distances are capped just beyond max_distance. Each pass is vectorised
+    across all the columns (or rows) of the window at once. For large grids, run it block by block on blocks read
+    with a halo of at least max_distance cells (as hydrology_engine.burnStreams does), which gives the same distances.
+    '''
+
+    n_rows, n_cols = streams.shape
+    distance = np.full((n_rows, n_cols), np.inf, dtype=np.float32)
+
+    streamRows = np.flatnonzero(streams.any(axis=1))
+    streamCols = np.flatnonzero(streams.any(axis=0))
+
+    if streamRows.size == 0:
+        return distance
+
+    band = int(np.ceil(max_distance))
+    rowStart = max(streamRows[0] - band, 0)
+    rowEnd = min(streamRows[-1] + band + 1, n_rows)
+    colStart = max(streamCols[0] - band, 0)
+    colEnd = min(streamCols[-1] + band + 1, n_cols)
+
+    window = streams[rowStart:rowEnd, colStart:colEnd]
+    nRows, nCols = window.shape
+
+    # Column pass: distance down (and up) each column to the nearest stream cell, capped beyond the band
+    cap = band + 1
+    g = np.empty((nRows, nCols), dtype=np.int64)
+    g[0] = np.where(window[0], 0, cap)
+    for row in range(1, nRows):
+        g[row] = np.where(window[row], 0, np.minimum(g[row - 1] + 1, cap))
+    for row in range(nRows - 2, -1, -1):
+        g[row] = np.minimum(g[row], g[row + 1] + 1)
+
+    g2 = g * g
+    del g
+
+    # Row pass: lower envelope of the parabolas (x - u)^2 + g(u)^2 along each row
+    lines = np.arange(nRows)
+    s = np.zeros((nRows, nCols), dtype=np.int64)
+    t = np.zeros((nRows, nCols), dtype=np.int64)
+    q = np.zeros(nRows, dtype=np.int64)
+
+    def f(x, i):
+        return (x - i) ** 2 + g2[lines, i]
+
+    for u in range(1, nCols):
+
+        gu = g2[:, u]
+
+        # Remove parabolas which the new one is lower than at their start
+        active = np.ones(nRows, dtype=bool)
+        while True:
+            qa = np.maximum(q, 0)
+            tq = t[lines, qa]
+            sq = s[lines, qa]
+            drop = active & (q >= 0) & ((tq - sq) ** 2 + g2[lines, sq] > (tq - u) ** 2 + gu)
+            if not drop.any():
+                break
+            q[drop] -= 1
+            active = drop
+
+        empty = q < 0
+        q[empty] = 0
+        s[empty, 0] = u
+        t[empty, 0] = 0
+
+        # Rows which were just emptied start again at u, so are not added to
+        sq = s[lines, q]
+        w = 1 + (u * u - sq * sq + gu - g2[lines, sq]) // (2 * np.maximum(u - sq, 1))
+        add = ~empty & (w < nCols)
+
+        q[add] += 1
+        s[add, q[add]] = u
+        t[add, q[add]] = w[add]
+
+    result = np.empty((nRows, nCols), dtype=np.int64)
+    for u in range(nCols - 1, -1, -1):
+        sq = s[lines, q]
+        result[:, u] = f(u, sq)
+        q -= (u == t[lines, q])
+
+    windowDistance = np.sqrt(result).astype(np.float32)
+    windowDistance[windowDistance > max_distance] = np.inf
+
+    distance[rowStart:rowEnd, colStart:colEnd] = windowDistance
+
+    return distance
@@ -0,0 +1,537 @@
+'''
+NumPy hydrology engine for the preprocessing tool.
+
+Used in place of the Spatial Analyst hydrology tools when the hydrology engine in the user settings is NumPy.
+The DEM-derived layers are read into NumPy arrays on the DEM grid, calculated with the kernels in
+hydro_kernels.py and written back to rasters block by block.
+
+Filling and flow accumulation can also be calculated tile by tile (in parallel if more than one worker process
+is set in the user settings), for DEMs which do not fit in memory. Each tile is processed on its own, the links
+between tiles are solved as a small graph of the cells on the tile edges, and the result for each tile is then
+corrected in a second pass. Flow direction resolves flats over the whole grid, so DEMs which do not fit in
+memory use the Spatial Analyst FlowDirection tool instead.
+'''
+
+import arcpy
+from arcpy.sa import FlowDirection
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.raster_parallel as raster_parallel
+import NB_SEEA_ESRI.lib.hydro_kernels as hydro_kernels
+import NB_SEEA_ESRI.lib.tile_workers as tile_workers
+import NB_SEEA_ESRI.lib.study_mask as study_mask
+import NB_SEEA_ESRI.lib.terrain as terrain
+import NB_SEEA_ESRI.lib.spatial_index as spatial_index
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, raster_blocks, raster_parallel, hydro_kernels, tile_workers, study_mask, terrain, spatial_index])
+
+# NoData value used when writing integer rasters
+intNoData = int(np.iinfo(np.int32).min)
+
+
+def readGrid(raster, grid):
+
+    '''
+    Reads the whole raster on the grid as a float32 array, with NoData cells set to NaN.
+    Callers check the grid fits in the memory budget first, and use tiles or the Spatial Analyst tools if not.
+    '''
+
+    if not raster_blocks.fitsInBudget(grid):
+        log.error(str(raster) + ' is larger than the memory budget and cannot be read into memory as a whole')
+        raise MemoryError('Raster larger than the memory budget')
+
+    reader = raster_blocks.BlockReader(raster, grid)
+
+    return reader.read(raster_blocks.Block(0, 0, grid.nRows, grid.nCols))
+
+
+def writeGrid(values, outRaster, grid, dtype=np.float32, noDataValue=None):
+
+    ''' Writes a whole-grid array to a raster block by block '''
+
+    writer = raster_blocks.BlockWriter(outRaster, grid, dtype, noDataValue)
+
+    for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(2)):
+        writer.write(block, values[block.row:block.row + block.nRows, block.col:block.col + block.nCols])
+
+    writer.close()
+
+
+def readPolylines(lines, grid):
+
+    '''
+    Reads the vertices of each part of the polylines, as row and column positions in cells from the top left corner
+    of the grid. The vertices of part i are from offsets[i] to offsets[i + 1].
+    '''
+
+    rows = []
+    cols = []
+    offsets = [0]
+
+    with arcpy.da.SearchCursor(lines, ['SHAPE@'], spatial_reference=grid.spatialRef) as cursor:
+        for row in cursor:
+
+            shape = row[0]
+            if shape is None:
+                continue
+
+            for part in shape:
+                points = [point for point in part if point is not None]
+                if len(points) == 0:
+                    continue
+
+                cols.extend([(point.X - grid.xMin) / grid.cellWidth for point in points])
+                rows.extend([(grid.yMax - point.Y) / grid.cellHeight for point in points])
+                offsets.append(len(rows))
+
+    return np.array(rows, dtype=np.float64), np.array(cols, dtype=np.float64), np.array(offsets, dtype=np.int64)
+
+
+def studyMaskOutlets(studyMask, gridRaster, grid):
+
+    ''' Cells inside the study area mask which are next to cells outside it '''
+
+    maskGrid = study_mask.getMaskGrid(studyMask, gridRaster)
+    inside = maskGrid.inside(raster_blocks.Block(0, 0, grid.nRows, grid.nCols))
+
+    padded = hydro_kernels.pad_nodata(np.where(inside, np.float32(1), np.float32(np.nan)))
+
+    return hydro_kernels.next_to_nodata(padded)[1:-1, 1:-1]
+
+
+def stageStudyMaskOutlets(studyMask, gridRaster, grid, arrayFile):
+
+    ''' Writes the study area mask outlets (1, or 0 elsewhere) to a memory-mapped array block by block '''
+
+    maskGrid = study_mask.getMaskGrid(studyMask, gridRaster)
+    raster_parallel.createArray(arrayFile, grid)
+
+    for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(3, halo=1), halo=1):
+        outlets = hydro_kernels.next_to_nodata(maskGrid.read(block))[1:-1, 1:-1]
+        tile_workers.writeTile(arrayFile, (block.row, block.col, block.nRows, block.nCols), outlets.astype(np.float32))
+
+    return arrayFile
+
+
+def fillSinks(inDEM, outDEM, studyMask=None, numWorkers=None):
+
+    '''
+    Fills the sinks in the DEM, in the same way as the Spatial Analyst Fill tool.
+
+    Cells next to NoData (or the edge of the DEM) are outlets. If studyMask is given,
+    cells on the boundary of the study area mask are outlets as well. If the DEM does not fit within
+    the memory budget, or more than one worker process is used, the DEM is filled tile by tile.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(inDEM)
+
+        if numWorkers is None:
+            numWorkers = raster_parallel.getNumWorkers()
+
+        # DEM, filled DEM, labels and queues for the whole grid
+        if numWorkers > 1 or not raster_blocks.fitsInBudget(grid, numArrays=6):
+            tiledFillSinks(inDEM, outDEM, studyMask, numWorkers)
+            return
+
+        dem = readGrid(inDEM, grid)
+
+        outlets = None
+        if studyMask is not None:
+            outlets = studyMaskOutlets(studyMask, inDEM, grid)
+
+        filled = hydro_kernels.priority_flood_fill(dem, outlets)
+        numRaised = int(np.count_nonzero(filled > dem))
+        del dem
+
+        writeGrid(filled, outDEM, grid)
+
+        log.info('Number of cells raised by filling: ' + str(numRaised))
+
+    except Exception:
+        log.error("Sinks in " + str(inDEM) + " could not be filled")
+        raise
+
+
+def tiledFillSinks(inDEM, outDEM, studyMask=None, numWorkers=1, blockSize=None):
+
+    '''
+    Fills the sinks in the DEM tile by tile, with the same result as filling the whole grid at once.
+
+    Each tile is filled on its own with its edges as outlets, labelling the area draining to each edge cell.
+    The levels at which water spills between the labels (within and across tiles) form a graph, which is solved
+    for the level each label must be filled to before it drains out of the DEM. The tiles are then raised to
+    those levels in a second pass.
+    '''
+
+    grid = raster_blocks.RasterGrid(inDEM)
+
+    demFile = raster_parallel.arrayFilename('fillDEM')
+    outletFile = None
+    filledFile = raster_parallel.arrayFilename('filled')
+    labelFile = raster_parallel.arrayFilename('fillLabels')
+    arrayFiles = [demFile, filledFile, labelFile]
+
+    try:
+        # Each tile holds about ten arrays of 8 bytes per cell
+        if blockSize is None:
+            blockSize = raster_blocks.blockSizeForBudget(10 * numWorkers, bytesPerCell=8)
+
+        raster_parallel.stageRaster(inDEM, grid, demFile)
+
+        if studyMask is not None:
+            outletFile = raster_parallel.arrayFilename('fillOutlets')
+            arrayFiles.append(outletFile)
+            stageStudyMaskOutlets(studyMask, inDEM, grid, outletFile)
+
+        raster_parallel.createArray(filledFile, grid)
+        raster_parallel.createArray(labelFile, grid, np.int32, hydro_kernels.label_nodata)
+
+        tiles = raster_parallel.listTiles(grid, blockSize)
+        log.info('Filling sinks in ' + str(len(tiles)) + ' tiles')
+
+        # Each tile has at most one label for each cell on its edge
+        tasks = []
+        numLabels = 1
+        for tile in tiles:
+            tasks.append((tile, demFile, outletFile, filledFile, labelFile, numLabels))
+            numLabels += 2 * (tile[2] + tile[3])
+
+        # First pass: fill each tile on its own
+        results = runTasks(tile_workers.fillTile, tasks, numWorkers)
+
+        # Spill edges within the tiles and across the tile boundaries
+        tilesPerRow = (grid.nCols + blockSize - 1) // blockSize
+        levels = hydro_kernels.tile_spill_levels(numLabels, [spillEdges for spillEdges, sides in results],
+                                                 [sides for spillEdges, sides in results], tilesPerRow)
+        del results
+
+        log.info('Spill levels solved between the areas of ' + str(len(tiles)) + ' tiles')
+
+        # Second pass: raise each area to the level at which it spills out of the DEM
+        writer = raster_blocks.BlockWriter(outDEM, grid)
+        numRaised = 0
+
+        for tile in tiles:
+
+            filled = tile_workers.readTile(filledFile, tile)
+            labels = tile_workers.readTile(labelFile, tile, dtype=np.int32)
+
+            filled = hydro_kernels.raise_to_levels(filled, labels, levels)
+            numRaised += int(np.count_nonzero(filled > tile_workers.readTile(demFile, tile)))
+
+            writer.write(raster_blocks.Block(*tile), filled)
+
+        writer.close()
+
+        log.info('Number of cells raised by filling: ' + str(numRaised))
+
+    except Exception:
+        log.error("Sinks could not be filled in tiles")
+        raise
+
+    finally:
+        raster_parallel.deleteArrays(arrayFiles)
+
+
+def burnStreams(inDEM, streamNetwork, smoothDropBuffer, smoothDrop, streamDrop, outDEM):
+
+    '''
+    Burns the stream network into the DEM using the AGREE method, in the same way as reconditionDEM.function.
+
+    The DEM is processed block by block, each block read with a halo of smoothDropBuffer (in cells), so
+    the distance to the nearest stream cell is exact for every cell within the buffer. The stream segments
+    crossing each block (found with an STR-tree of the segment bounding boxes) are rasterized onto the block,
+    cells within the buffer are dropped smoothly by up to smoothDrop and stream cells by a further streamDrop.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(inDEM)
+        smoothDropBuffer = float(smoothDropBuffer)
+        smoothDrop = float(smoothDrop)
+        streamDrop = float(streamDrop)
+
+        rows, cols, offsets = readPolylines(streamNetwork, grid)
+        rowStart, colStart, rowEnd, colEnd = hydro_kernels.line_segments(rows, cols, offsets)
+        del rows, cols, offsets
+
+        # Distances in map units, using the cell width as the cell size (as EucDistance does)
+        maxDistance = smoothDropBuffer / grid.cellWidth
+        halo = int(np.ceil(maxDistance))
+
+        # The distance transform holds about ten arrays of 8 bytes per cell, including the halo
+        blocks = list(raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(10, bytesPerCell=8, halo=halo), halo))
+
+        # Segments crossing each block (plus halo), as (block, segment) pairs sorted by block
+        segmentBoxes = np.column_stack([np.minimum(colStart, colEnd), np.minimum(rowStart, rowEnd),
+                                        np.maximum(colStart, colEnd), np.maximum(rowStart, rowEnd)])
+        windows = [block.window(grid)[0] for block in blocks]
+        windowBoxes = [[window.col, window.row, window.col + window.nCols, window.row + window.nRows] for window in windows]
+
+        blockNos, segments = spatial_index.STRTree(segmentBoxes).queryBoxes(windowBoxes)
+        blockStarts = np.searchsorted(blockNos, np.arange(len(blocks) + 1))
+
+        reader = raster_blocks.BlockReader(inDEM, grid)
+        writer = raster_blocks.BlockWriter(outDEM, grid)
+        numStreamCells = 0
+
+        for blockNo, block in enumerate(blocks):
+
+            window = windows[blockNo]
+            inBlock = segments[blockStarts[blockNo]:blockStarts[blockNo + 1]]
+
+            streams = hydro_kernels.rasterize_segments(rowStart[inBlock] - window.row, colStart[inBlock] - window.col,
+                                                       rowEnd[inBlock] - window.row, colEnd[inBlock] - window.col,
+                                                       window.nRows, window.nCols)
+
+            distance = hydro_kernels.band_distance(streams, maxDistance) * np.float32(grid.cellWidth)
+
+            # Remove the halo (which is clipped to the grid)
+            core = (slice(block.row - window.row, block.row - window.row + block.nRows),
+                    slice(block.col - window.col, block.col - window.col + block.nCols))
+            streams = streams[core]
+            distance = distance[core]
+
+            drop = np.float32(smoothDrop / smoothDropBuffer) * np.maximum(np.float32(smoothDropBuffer) - distance, 0)
+            drop += np.float32(streamDrop) * streams
+            numStreamCells += int(np.count_nonzero(streams))
+
+            dem = reader.read(raster_blocks.Block(block.row, block.col, block.nRows, block.nCols))
+            writer.write(block, dem - drop.astype(np.float32))
+
+        writer.close()
+
+        log.info('Number of stream cells burned into the DEM: ' + str(numStreamCells))
+
+    except Exception:
+        log.error("Streams could not be burned into " + str(inDEM))
+        raise
+
+
+def flowDirection(inDEM, outFDR):
+
+    '''
+    Calculates D8 flow directions from the filled DEM, in the same way as FlowDirection with the NORMAL option.
+    The flow directions are written as an 8-bit unsigned raster, with flats resolved towards their outlets.
+
+    Flats are resolved over the whole grid, so if the DEM does not fit within the memory budget
+    the Spatial Analyst FlowDirection tool is used instead.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(inDEM)
+
+        # DEM, padded DEM, drops, flow directions and the queue for resolving flats
+        if not raster_blocks.fitsInBudget(grid, numArrays=8):
+            log.info('DEM does not fit within the memory budget. Calculating flow direction with the FlowDirection tool.')
+            FlowDirection(inDEM, "NORMAL").save(outFDR)
+            return
+
+        fdr = hydro_kernels.d8_flow_direction(readGrid(inDEM, grid), grid.cellWidth, grid.cellHeight)
+
+        writeGrid(fdr, outFDR, grid, np.uint8, hydro_kernels.fdr_nodata)
+
+    except Exception:
+        log.error("Flow direction could not be calculated from " + str(inDEM))
+        raise
+
+
+def fdrBlock(values):
+
+    ''' Converts a block of flow directions read as float32 (NaN for NoData) to uint8 codes '''
+
+    return np.where(np.isnan(values), hydro_kernels.fdr_nodata, values).astype(np.uint8)
+
+
+def degreesBlock(fdr):
+
+    return hydro_kernels.fdr_degrees(fdrBlock(fdr))
+
+
+def flowDirectionDegrees(fdrRaster, outRaster):
+
+    ''' Converts the flow direction raster to degrees (for display), block by block '''
+
+    raster_blocks.processBlocks(fdrRaster, outRaster, degreesBlock, dtype=np.int16, noDataValue=-1)
+
+
+def writeAccumulation(acc, grid, outFAC, outFACInt=None):
+
+    ''' Writes the flow accumulation array (and optionally its integer version) in a single pass over the blocks '''
+
+    writers = [(raster_blocks.BlockWriter(outFAC, grid), np.float32)]
+    if outFACInt is not None:
+        writers.append((raster_blocks.BlockWriter(outFACInt, grid, np.int32, intNoData), np.int32))
+
+    for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(3)):
+
+        values = acc[block.row:block.row + block.nRows, block.col:block.col + block.nCols]
+
+        for writer, dtype in writers:
+            if dtype == np.int32:
+                writer.write(block, np.where(np.isnan(values), intNoData, np.trunc(values)).astype(np.int32))
+            else:
+                writer.write(block, values)
+
+    for writer, dtype in writers:
+        writer.close()
+
+
+def flowAccumulation(fdrRaster, outFAC, outFACInt=None, weightRaster=None, numWorkers=None):
+
+    '''
+    Calculates flow accumulation from the flow direction raster, in the same way as FlowAccumulation with FLOAT output.
+
+    If outFACInt is given, the integer version of the accumulation is written in the same pass over the blocks.
+    weightRaster gives an optional weight for each cell. If the arrays do not fit within the memory budget,
+    or more than one worker process is used, the accumulation is calculated tile by tile.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(fdrRaster)
+
+        if numWorkers is None:
+            numWorkers = raster_parallel.getNumWorkers()
+
+        # Flow directions, weights, totals and receivers for the whole grid
+        if numWorkers > 1 or not raster_blocks.fitsInBudget(grid, numArrays=4, bytesPerCell=8):
+            tiledFlowAccumulation(fdrRaster, outFAC, outFACInt, weightRaster, numWorkers)
+            return
+
+        fdr = fdrBlock(readGrid(fdrRaster, grid))
+
+        weights = None
+        if weightRaster is not None:
+            weights = readGrid(weightRaster, grid)
+
+        acc = hydro_kernels.flow_accumulation(fdr, weights)
+        del fdr, weights
+
+        writeAccumulation(acc, grid, outFAC, outFACInt)
+
+    except Exception:
+        log.error("Flow accumulation could not be calculated from " + str(fdrRaster))
+        raise
+
+
+def tiledFlowAccumulation(fdrRaster, outFAC, outFACInt=None, weightRaster=None, numWorkers=1, blockSize=None):
+
+    '''
+    Calculates flow accumulation tile by tile, with the same result as calculating it for the whole grid at once.
+
+    The totals are held as float64, so accumulated cell counts are exact and match the whole-grid result bit for bit.
+    '''
+
+    grid = raster_blocks.RasterGrid(fdrRaster)
+
+    fdrFile = raster_parallel.arrayFilename('fdr')
+    weightFile = None
+    totalFile = raster_parallel.arrayFilename('facTotal')
+    accFile = raster_parallel.arrayFilename('fac')
+    arrayFiles = [fdrFile, totalFile, accFile]
+
+    try:
+        # Each tile holds about twelve arrays of 8 bytes per cell
+        if blockSize is None:
+            blockSize = raster_blocks.blockSizeForBudget(12 * numWorkers, bytesPerCell=8)
+
+        raster_parallel.stageRaster(fdrRaster, grid, fdrFile)
+
+        if weightRaster is not None:
+            weightFile = raster_parallel.arrayFilename('facWeight')
+            arrayFiles.append(weightFile)
+            raster_parallel.stageRaster(weightRaster, grid, weightFile)
+
+        raster_parallel.createArray(totalFile, grid, np.float64)
+        raster_parallel.createArray(accFile, grid)
+
+        tiles = raster_parallel.listTiles(grid, blockSize)
+        log.info('Calculating flow accumulation in ' + str(len(tiles)) + ' tiles')
+
+        # First pass: accumulate within each tile
+        tasks = [(tile, fdrFile, weightFile, totalFile, grid.nCols) for tile in tiles]
+        links = runTasks(tile_workers.accumulationTile, tasks, numWorkers)
+
+        # Solve the flows between tiles
+        linkArrays = [np.concatenate([link[i] for link in links]) for i in range(5)]
+        inletCells, inflow = hydro_kernels.solve_tile_links(*linkArrays)
+        log.info('Flow between tiles solved for ' + str(inletCells.size) + ' cells on tile edges')
+
+        # Second pass: add the inflow from other tiles
+        inletRows, inletCols = np.divmod(inletCells, grid.nCols)
+        tilesPerRow = (grid.nCols + blockSize - 1) // blockSize
+        inletTiles = (inletRows // blockSize) * tilesPerRow + inletCols // blockSize
+
+        tasks = []
+        for tileIndex, tile in enumerate(tiles):
+            row, col, nRows, nCols = tile
+            inTile = inletTiles == tileIndex
+            inlets = (inletRows[inTile] - row) * nCols + inletCols[inTile] - col
+            tasks.append((tile, fdrFile, weightFile, totalFile, accFile, inlets, inflow[inTile]))
+
+        runTasks(tile_workers.inflowTile, tasks, numWorkers)
+
+        writeAccumulation(np.load(accFile, mmap_mode='r'), grid, outFAC, outFACInt)
+
+    except Exception:
+        log.error("Flow accumulation could not be calculated in tiles")
+        raise
+
+    finally:
+        raster_parallel.deleteArrays(arrayFiles)
+
+
+def runTasks(workerFunction, tasks, numWorkers):
+
+    ''' Runs the tile tasks in worker processes, or in this process if there is only one worker '''
+
+    if numWorkers > 1:
+        return raster_parallel.runTiles(workerFunction, tasks, numWorkers)
+    else:
+        return [workerFunction(task) for task in tasks]
+
+
+def slopeRasters(inDEM, outDegrees=None, outPercent=None):
+
+    '''
+    Calculates slope in degrees and/or percent rise from the DEM block by block, as the Slope tool does.
+    The gradients are calculated once for each block and both outputs written from them.
+    Only the outputs which are given are calculated.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(inDEM)
+        reader = raster_blocks.BlockReader(inDEM, grid)
+
+        degreesWriter = None
+        percentWriter = None
+
+        if outDegrees is not None:
+            degreesWriter = raster_blocks.BlockWriter(outDegrees, grid)
+
+        if outPercent is not None:
+            percentWriter = raster_blocks.BlockWriter(outPercent, grid)
+
+        # Slope needs a halo of one cell around each block
+        for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(14, halo=1), halo=1):
+
+            slopeDegrees, slopePercent = terrain.slope_degrees_percent(reader.read(block), grid.cellWidth, grid.cellHeight,
+                                                                       degrees=degreesWriter is not None,
+                                                                       percent=percentWriter is not None)
+
+            if degreesWriter is not None:
+                degreesWriter.write(block, slopeDegrees)
+
+            if percentWriter is not None:
+                percentWriter.write(block, slopePercent)
+
+        for writer in [degreesWriter, percentWriter]:
+            if writer is not None:
+                writer.close()
+
+    except Exception:
+        log.error("Slope could not be calculated from " + str(inDEM))
+        raise
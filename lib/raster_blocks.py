@@ -0,0 +1,310 @@
+'''
+Block-wise reading and writing of rasters as NumPy arrays.
+
+Rasters are read from and written to a RasterGrid (normally the DEM grid) one block at a time,
+so that calculations can be carried out in NumPy without saving intermediate rasters.
+Blocks can be read with a halo of extra cells around them for neighbourhood operations such as slope,
+and the block size is limited so that the arrays held in memory fit within the memory budget
+set in the user settings file.
+'''
+
+import arcpy
+import os
+import math
+import itertools
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common])
+
+# Number of rows and columns in a block, and the default memory budget (in megabytes) for the arrays held in memory
+defaultBlockSize = 2048
+defaultMemoryBudgetMb = 1024
+minBlockSize = 64
+
+# NoData value used when writing floating point blocks
+floatNoData = float(np.finfo(np.float32).min)
+
+# Numbers the block writers, so that writers open at the same time use different temporary files
+writerNumbers = itertools.count()
+
+# Pixel types used when writing blocks to rasters
+pixelTypes = {'float32': '32_BIT_FLOAT',
+              'float64': '64_BIT',
+              'int8': '8_BIT_SIGNED',
+              'uint8': '8_BIT_UNSIGNED',
+              'int16': '16_BIT_SIGNED',
+              'uint16': '16_BIT_UNSIGNED',
+              'int32': '32_BIT_SIGNED',
+              'uint32': '32_BIT_UNSIGNED'}
+
+
+class RasterGrid(object):
+
+    ''' Extent, cell size and dimensions of the grid that blocks are read from and written to '''
+
+    def __init__(self, raster):
+
+        desc = arcpy.Describe(raster)
+
+        self.xMin = desc.extent.XMin
+        self.yMin = desc.extent.YMin
+        self.xMax = desc.extent.XMax
+        self.yMax = desc.extent.YMax
+        self.cellWidth = desc.meanCellWidth
+        self.cellHeight = desc.meanCellHeight
+        self.nCols = desc.width
+        self.nRows = desc.height
+        self.spatialRef = desc.spatialReference
+
+    def sizeMb(self, bytesPerCell=4):
+
+        return float(self.nRows) * float(self.nCols) * bytesPerCell / (1024.0 * 1024.0)
+
+
+class Block(object):
+
+    '''
+    A rectangular window of rows and columns within a RasterGrid.
+
+    Arrays read for the block include a halo of extra cells on each side, which is
+    NaN (NoData) where it falls outside the grid. Arrays written for the block do not include the halo.
+    '''
+
+    def __init__(self, row, col, nRows, nCols, halo=0):
+
+        self.row = row
+        self.col = col
+        self.nRows = nRows
+        self.nCols = nCols
+        self.halo = halo
+
+    def lowerLeft(self, grid):
+
+        x = grid.xMin + self.col * grid.cellWidth
+        y = grid.yMax - (self.row + self.nRows) * grid.cellHeight
+
+        return arcpy.Point(x, y)
+
+    def window(self, grid):
+
+        ''' Returns the block including its halo, clipped to the grid, and the padding needed on each side '''
+
+        row = max(self.row - self.halo, 0)
+        col = max(self.col - self.halo, 0)
+        rowEnd = min(self.row + self.nRows + self.halo, grid.nRows)
+        colEnd = min(self.col + self.nCols + self.halo, grid.nCols)
+
+        padding = ((row - (self.row - self.halo), (self.row + self.nRows + self.halo) - rowEnd),
+                   (col - (self.col - self.halo), (self.col + self.nCols + self.halo) - colEnd))
+
+        return Block(row, col, rowEnd - row, colEnd - col), padding
+
+    def core(self, values):
+
+        ''' Removes the halo from an array read for this block '''
+
+        if self.halo == 0:
+            return values
+
+        return values[self.halo:-self.halo, self.halo:-self.halo]
+
+
+def getMemoryBudgetMb():
+
+    ''' Memory budget (in megabytes) for the arrays held in memory during block-wise processing '''
+
+    try:
+        return float(common.getUserSetting('memoryBudgetMb', defaultMemoryBudgetMb))
+    except ValueError:
+        log.warning('Memory budget in user settings is not a number. Using default of ' + str(defaultMemoryBudgetMb) + 'Mb')
+        return float(defaultMemoryBudgetMb)
+
+
+def getTileSize():
+
+    ''' Maximum number of rows and columns in a block, from the user settings file '''
+
+    try:
+        return int(common.getUserSetting('tileSize', defaultBlockSize))
+    except ValueError:
+        log.warning('Tile size in user settings is not a whole number. Using default of ' + str(defaultBlockSize))
+        return defaultBlockSize
+
+
+def blockSizeForBudget(numArrays, bytesPerCell=4, halo=0):
+
+    '''
+    Returns the largest block size (up to the tile size in the user settings) for which
+    numArrays arrays of bytesPerCell bytes per cell, each including the halo, fit within the memory budget.
+    '''
+
+    budgetBytes = getMemoryBudgetMb() * 1024.0 * 1024.0
+    maxCells = budgetBytes / (float(max(numArrays, 1)) * bytesPerCell)
+
+    blockSize = int(math.sqrt(maxCells)) - 2 * halo
+    blockSize = min(blockSize, getTileSize())
+
+    if blockSize < minBlockSize:
+        log.warning('Memory budget is too small for ' + str(numArrays) + ' arrays. Using minimum block size of ' + str(minBlockSize))
+        blockSize = minBlockSize
+
+    return blockSize
+
+
+def fitsInBudget(grid, numArrays=1, bytesPerCell=4):
+
+    ''' Checks if numArrays whole-grid arrays fit within the memory budget '''
+
+    return grid.sizeMb(bytesPerCell) * numArrays <= getMemoryBudgetMb()
+
+
+def iterBlocks(grid, blockSize=None, halo=0):
+
+    ''' Yields the blocks covering the grid, row by row '''
+
+    if blockSize is None:
+        blockSize = min(defaultBlockSize, getTileSize())
+
+    for row in range(0, grid.nRows, blockSize):
+        for col in range(0, grid.nCols, blockSize):
+
+            nRows = min(blockSize, grid.nRows - row)
+            nCols = min(blockSize, grid.nCols - col)
+
+            yield Block(row, col, nRows, nCols, halo)
+
+
+class BlockReader(object):
+
+    ''' Reads blocks of a raster as float32 arrays, with NoData cells set to NaN '''
+
+    def __init__(self, raster, grid):
+
+        self.raster = arcpy.Raster(raster)
+        self.grid = grid
+        self.noDataValue = self.raster.noDataValue
+
+    def read(self, block):
+
+        window, padding = block.window(self.grid)
+
+        data = arcpy.RasterToNumPyArray(self.raster, window.lowerLeft(self.grid), window.nCols, window.nRows)
+        values = data.astype(np.float32)
+
+        if self.noDataValue is not None:
+            values[data == self.noDataValue] = np.nan
+
+        if block.halo > 0:
+            values = np.pad(values, padding, mode='constant', constant_values=np.nan)
+
+        return values
+
+
+class BlockWriter(object):
+
+    '''
+    Writes arrays block by block to a raster on the grid.
+
+    Each block is saved to a temporary raster in the scratch folder. When the writer is closed,
+    the blocks are mosaicked together into the output raster and the temporary rasters deleted.
+    NaN values in floating point blocks are written as NoData. For integer blocks, cells equal
+    to noDataValue (if given) are written as NoData.
+    '''
+
+    def __init__(self, outRaster, grid, dtype=np.float32, noDataValue=None):
+
+        self.outRaster = outRaster
+        self.grid = grid
+        self.dtype = np.dtype(dtype)
+        self.noDataValue = noDataValue
+        self.blockFiles = []
+
+        self.isFloat = np.issubdtype(self.dtype, np.floating)
+        tempName = os.path.basename(outRaster).split('.')[0]
+        self.tempPrefix = os.path.join(arcpy.env.scratchFolder, "blk" + str(next(writerNumbers)) + "_" + tempName + "_")
+
+    def write(self, block, values):
+
+        # NaN in floating point values written to an integer raster become NoData
+        if not self.isFloat and self.noDataValue is not None and np.issubdtype(np.asarray(values).dtype, np.floating):
+            values = np.where(np.isnan(values), self.noDataValue, values)
+
+        values = np.asarray(values, dtype=self.dtype)
+
+        if self.isFloat:
+            values = np.where(np.isnan(values), self.dtype.type(floatNoData), values)
+            blockRaster = arcpy.NumPyArrayToRaster(values, block.lowerLeft(self.grid),
+                                                   self.grid.cellWidth, self.grid.cellHeight, floatNoData)
+        elif self.noDataValue is not None:
+            blockRaster = arcpy.NumPyArrayToRaster(values, block.lowerLeft(self.grid),
+                                                   self.grid.cellWidth, self.grid.cellHeight, self.noDataValue)
+        else:
+            blockRaster = arcpy.NumPyArrayToRaster(values, block.lowerLeft(self.grid),
+                                                   self.grid.cellWidth, self.grid.cellHeight)
+
+        blockFile = self.tempPrefix + str(len(self.blockFiles)) + ".tif"
+        blockRaster.save(blockFile)
+        del blockRaster
+
+        self.blockFiles.append(blockFile)
+
+    def close(self):
+
+        try:
+            if len(self.blockFiles) == 1:
+                arcpy.CopyRaster_management(self.blockFiles[0], self.outRaster)
+                arcpy.DefineProjection_management(self.outRaster, self.grid.spatialRef)
+
+            elif len(self.blockFiles) > 1:
+                arcpy.MosaicToNewRaster_management(self.blockFiles,
+                                                   os.path.dirname(self.outRaster),
+                                                   os.path.basename(self.outRaster),
+                                                   self.grid.spatialRef,
+                                                   pixelTypes[self.dtype.name],
+                                                   self.grid.cellWidth, 1)
+
+        except Exception:
+            log.error("Blocks could not be written to raster " + str(self.outRaster))
+            raise
+
+        finally:
+            # Delete temporary block rasters
+            for blockFile in self.blockFiles:
+                arcpy.Delete_management(blockFile)
+
+            self.blockFiles = []
+
+
+def processBlocks(inRasters, outRaster, blockFunction, gridRaster=None, halo=0, numArrays=None,
+                  dtype=np.float32, noDataValue=None):
+
+    '''
+    Applies blockFunction to the input rasters block by block and writes the result to outRaster.
+
+    blockFunction is called with one block (including the halo) from each input raster and must return
+    the output values for the block without the halo. gridRaster defines the output grid and defaults
+    to the first input. numArrays is the number of block-sized arrays blockFunction holds in memory at once,
+    used to choose a block size which fits within the memory budget.
+    '''
+
+    if type(inRasters) is not list:
+        inRasters = [inRasters]
+
+    if gridRaster is None:
+        gridRaster = inRasters[0]
+
+    if numArrays is None:
+        numArrays = len(inRasters) + 1
+
+    grid = RasterGrid(gridRaster)
+    readers = [BlockReader(raster, grid) for raster in inRasters]
+    writer = BlockWriter(outRaster, grid, dtype, noDataValue)
+
+    for block in iterBlocks(grid, blockSizeForBudget(numArrays, halo=halo), halo):
+        writer.write(block, blockFunction(*[reader.read(block) for reader in readers]))
+
+    writer.close()
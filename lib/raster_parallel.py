@@ -0,0 +1,191 @@
+'''
+Process pool tile parallelism for block-wise raster processing.
+
+Input rasters are staged once into memory-mapped .npy arrays in the scratch folder. Tiles are then
+processed by a pool of worker processes (see tile_workers.py), each writing its own window of the
+memory-mapped outputs, so the results do not depend on the order in which the tiles finish.
+Finally the outputs are written to rasters block by block.
+'''
+
+import arcpy
+import os
+import sys
+import multiprocessing
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.tile_workers as tile_workers
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, raster_blocks, tile_workers])
+
+
+def getNumWorkers():
+
+    ''' Number of worker processes to use, from the user settings file (1 means run serially) '''
+
+    try:
+        numWorkers = int(common.getUserSetting('numWorkers', 1))
+    except ValueError:
+        log.warning('Number of worker processes in user settings is not a whole number. Running serially.')
+        numWorkers = 1
+
+    return max(1, min(numWorkers, multiprocessing.cpu_count()))
+
+
+def setExecutable():
+
+    # Inside ArcGIS sys.executable is the ArcGIS application rather than Python,
+    # so worker processes must be started with the Python interpreter instead
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        pythonExe = os.path.join(sys.exec_prefix, 'python.exe')
+        if os.path.exists(pythonExe):
+            multiprocessing.set_executable(pythonExe)
+
+
+def createPool(numWorkers):
+
+    setExecutable()
+
+    return multiprocessing.Pool(numWorkers)
+
+
+def arrayFilename(name):
+
+    return os.path.join(arcpy.env.scratchFolder, "arr_" + name + ".npy")
+
+
+def createArray(arrayFile, grid, dtype=np.float32, fillValue=np.nan):
+
+    ''' Creates a memory-mapped array covering the grid, filled with NaN (NoData) or fillValue for integer arrays '''
+
+    data = np.lib.format.open_memmap(arrayFile, mode='w+', dtype=dtype, shape=(grid.nRows, grid.nCols))
+    data[:] = fillValue
+    data.flush()
+    del data
+
+    return arrayFile
+
+
+def stageRaster(raster, grid, arrayFile, blockSize=None):
+
+    ''' Reads a raster block by block into a memory-mapped float32 array on the grid '''
+
+    data = np.lib.format.open_memmap(arrayFile, mode='w+', dtype=np.float32, shape=(grid.nRows, grid.nCols))
+    reader = raster_blocks.BlockReader(raster, grid)
+
+    for block in raster_blocks.iterBlocks(grid, blockSize):
+        data[block.row:block.row + block.nRows, block.col:block.col + block.nCols] = reader.read(block)
+
+    data.flush()
+    del data
+
+    return arrayFile
+
+
+class ArrayReader(object):
+
+    ''' Reads blocks of a memory-mapped array staged on the grid, in the same way as raster_blocks.BlockReader '''
+
+    def __init__(self, arrayFile):
+
+        self.arrayFile = arrayFile
+
+    def read(self, block):
+
+        return tile_workers.readTile(self.arrayFile, (block.row, block.col, block.nRows, block.nCols), block.halo)
+
+
+def writeArrayToRaster(arrayFile, grid, outRaster, blockSize=None):
+
+    ''' Writes a memory-mapped array to a raster block by block '''
+
+    data = np.load(arrayFile, mmap_mode='r')
+    writer = raster_blocks.BlockWriter(outRaster, grid)
+
+    for block in raster_blocks.iterBlocks(grid, blockSize):
+        writer.write(block, data[block.row:block.row + block.nRows, block.col:block.col + block.nCols])
+
+    writer.close()
+    del data
+
+
+def deleteArrays(arrayFiles):
+
+    for arrayFile in arrayFiles:
+        try:
+            os.remove(arrayFile)
+        except OSError:
+            pass
+
+
+def listTiles(grid, blockSize):
+
+    return [(block.row, block.col, block.nRows, block.nCols) for block in raster_blocks.iterBlocks(grid, blockSize)]
+
+
+def runTiles(workerFunction, tasks, numWorkers):
+
+    ''' Runs workerFunction on each task in a pool of worker processes, returning the results in task order '''
+
+    log.info('Processing ' + str(len(tasks)) + ' tiles using ' + str(numWorkers) + ' worker processes')
+
+    pool = createPool(numWorkers)
+    try:
+        results = pool.map(workerFunction, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def setupProcessWorkspace(scratchFolder):
+
+    '''
+    Sets up a process started by runProcesses to use its own scratch geodatabase in scratchFolder,
+    so that its temporary files do not collide with those of other processes.
+    '''
+
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("Spatial")
+
+    # Set scratch and current workspaces
+    if not os.path.exists(scratchFolder):
+        os.makedirs(scratchFolder)
+
+    scratchGDB = os.path.join(scratchFolder, 'scratch.gdb')
+    if not arcpy.Exists(scratchGDB):
+        arcpy.CreateFileGDB_management(scratchFolder, 'scratch.gdb')
+
+    arcpy.env.scratchWorkspace = scratchGDB
+    arcpy.env.workspace = scratchGDB
+
+    if not os.path.exists(arcpy.env.scratchFolder):
+        os.mkdir(arcpy.env.scratchFolder)
+
+    return scratchGDB
+
+
+def runProcesses(target, argsList):
+
+    '''
+    Runs target once for each set of arguments in argsList, each in its own process, and waits for them all to finish.
+
+    Unlike pool workers, these processes are not daemonic, so each may start its own pool for tile parallelism.
+    Returns the exit code of each process (0 if it succeeded).
+    '''
+
+    setExecutable()
+
+    processes = [multiprocessing.Process(target=target, args=args) for args in argsList]
+
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+
+    return [process.exitcode for process in processes]
@@ -0,0 +1,245 @@
+'''
+Block-wise resampling of rasters onto a target grid (normally the DEM grid).
+
+Each block of the target grid is filled from a window of the source raster using precomputed
+row and column index maps, by nearest neighbour, bilinear interpolation or (for categorical data such as
+land cover) the majority of the source cells in each target cell. Cells outside the study area mask can be
+set to NoData in the same pass, so the resampled and clipped raster is written once.
+Where the source cells already line up with the target cells, the source blocks are written without resampling
+(they are still read and written block by block, as the output is a new raster).
+'''
+
+import arcpy
+import os
+import sys
+import math
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.resample_kernels as resample_kernels
+import NB_SEEA_ESRI.lib.study_mask as study_mask
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, raster_blocks, resample_kernels, study_mask])
+
+methods = ['NEAREST', 'BILINEAR', 'MAJORITY']
+
+# NoData value used when writing integer rasters
+intNoData = int(np.iinfo(np.int32).min)
+
+
+def isAligned(sourceGrid, targetGrid):
+
+    ''' Checks if the source cells line up exactly with the target cells '''
+
+    tolerance = 1e-6
+
+    if abs(sourceGrid.cellWidth - targetGrid.cellWidth) > tolerance * targetGrid.cellWidth:
+        return False
+
+    if abs(sourceGrid.cellHeight - targetGrid.cellHeight) > tolerance * targetGrid.cellHeight:
+        return False
+
+    colShift = (targetGrid.xMin - sourceGrid.xMin) / sourceGrid.cellWidth
+    rowShift = (sourceGrid.yMax - targetGrid.yMax) / sourceGrid.cellHeight
+
+    return abs(colShift - round(colShift)) < tolerance and abs(rowShift - round(rowShift)) < tolerance
+
+
+def sameSpatialReference(spatialRefA, spatialRefB):
+
+    '''
+    Checks if two spatial references are the same coordinate system, by their factory (EPSG) codes
+    or, for custom coordinate systems without a code, by their well-known text.
+    '''
+
+    if spatialRefA.factoryCode and spatialRefB.factoryCode:
+        return spatialRefA.factoryCode == spatialRefB.factoryCode
+
+    return spatialRefA.exportToString() == spatialRefB.exportToString()
+
+
+def sourceWindow(sourceGrid, targetGrid, block, margin=1):
+
+    ''' Returns the block of source cells covering the target block (plus a margin of cells), or None if there are none '''
+
+    xStart = targetGrid.xMin + block.col * targetGrid.cellWidth
+    xEnd = xStart + block.nCols * targetGrid.cellWidth
+    yStart = targetGrid.yMax - block.row * targetGrid.cellHeight
+    yEnd = yStart - block.nRows * targetGrid.cellHeight
+
+    colStart = max(int(math.floor((xStart - sourceGrid.xMin) / sourceGrid.cellWidth)) - margin, 0)
+    colEnd = min(int(math.ceil((xEnd - sourceGrid.xMin) / sourceGrid.cellWidth)) + margin, sourceGrid.nCols)
+    rowStart = max(int(math.floor((sourceGrid.yMax - yStart) / sourceGrid.cellHeight)) - margin, 0)
+    rowEnd = min(int(math.ceil((sourceGrid.yMax - yEnd) / sourceGrid.cellHeight)) + margin, sourceGrid.nRows)
+
+    if colEnd <= colStart or rowEnd <= rowStart:
+        return None
+
+    return raster_blocks.Block(rowStart, colStart, rowEnd - rowStart, colEnd - colStart)
+
+
+def readAligned(reader, sourceGrid, targetGrid, block):
+
+    ''' Reads the source cells lining up with the target block, with NoData where the block is outside the source '''
+
+    rowShift = int(round((sourceGrid.yMax - targetGrid.yMax) / sourceGrid.cellHeight))
+    colShift = int(round((targetGrid.xMin - sourceGrid.xMin) / sourceGrid.cellWidth))
+
+    row = block.row + rowShift
+    col = block.col + colShift
+
+    rowStart = max(row, 0)
+    colStart = max(col, 0)
+    rowEnd = min(row + block.nRows, sourceGrid.nRows)
+    colEnd = min(col + block.nCols, sourceGrid.nCols)
+
+    if rowEnd <= rowStart or colEnd <= colStart:
+        return np.full((block.nRows, block.nCols), np.nan, dtype=np.float32)
+
+    values = reader.read(raster_blocks.Block(rowStart, colStart, rowEnd - rowStart, colEnd - colStart))
+
+    padding = ((rowStart - row, row + block.nRows - rowEnd), (colStart - col, col + block.nCols - colEnd))
+    if padding != ((0, 0), (0, 0)):
+        values = np.pad(values, padding, mode='constant', constant_values=np.nan)
+
+    return values
+
+
+def resampleBlock(reader, sourceGrid, targetGrid, block, method):
+
+    ''' Returns the source values resampled onto the target block '''
+
+    window = sourceWindow(sourceGrid, targetGrid, block)
+    if window is None:
+        return np.full((block.nRows, block.nCols), np.nan, dtype=np.float32)
+
+    values = reader.read(window)
+
+    # Position of the target block relative to the source window
+    colOffset = (targetGrid.xMin + block.col * targetGrid.cellWidth) - (sourceGrid.xMin + window.col * sourceGrid.cellWidth)
+    rowOffset = (sourceGrid.yMax - window.row * sourceGrid.cellHeight) - (targetGrid.yMax - block.row * targetGrid.cellHeight)
+
+    if method == 'BILINEAR':
+        rows = resample_kernels.bilinear_weights(rowOffset, targetGrid.cellHeight, block.nRows, sourceGrid.cellHeight, window.nRows)
+        cols = resample_kernels.bilinear_weights(colOffset, targetGrid.cellWidth, block.nCols, sourceGrid.cellWidth, window.nCols)
+
+        return resample_kernels.bilinear(values, rows, cols)
+
+    rows = resample_kernels.nearest_index(rowOffset, targetGrid.cellHeight, block.nRows, sourceGrid.cellHeight, window.nRows)
+    cols = resample_kernels.nearest_index(colOffset, targetGrid.cellWidth, block.nCols, sourceGrid.cellWidth, window.nCols)
+    resampled = resample_kernels.nearest(values, rows, cols)
+
+    # Majority only differs from nearest neighbour where several source cells fall inside a target cell
+    if method == 'MAJORITY' and (sourceGrid.cellWidth < targetGrid.cellWidth or sourceGrid.cellHeight < targetGrid.cellHeight):
+
+        targetRows = resample_kernels.nearest_index(-rowOffset, sourceGrid.cellHeight, window.nRows, targetGrid.cellHeight, block.nRows)
+        targetCols = resample_kernels.nearest_index(-colOffset, sourceGrid.cellWidth, window.nCols, targetGrid.cellWidth, block.nCols)
+
+        majority, hasSource = resample_kernels.mode(values, targetRows, targetCols, block.nRows, block.nCols)
+        resampled = np.where(hasSource, majority, resampled)
+
+    return resampled
+
+
+def applyEnvironment(inRaster, outRaster, gridRaster, method, studyMask=None):
+
+    ''' Resamples (and clips) the raster using ArcPy, for sources which cannot be resampled block by block '''
+
+    tempRaster = os.path.join(arcpy.env.scratchGDB, "resample_temp")
+
+    origSnapRaster = arcpy.env.snapRaster
+    origCellSize = arcpy.env.cellSize
+    origResampling = arcpy.env.resamplingMethod
+
+    try:
+        arcpy.env.snapRaster = gridRaster
+        arcpy.env.cellSize = gridRaster
+
+        if method == 'BILINEAR':
+            arcpy.env.resamplingMethod = 'BILINEAR'
+        else:
+            arcpy.env.resamplingMethod = 'NEAREST'
+
+        resampledTemp = arcpy.sa.ApplyEnvironment(inRaster)
+
+        if studyMask is not None:
+            resampledTemp.save(tempRaster)
+            arcpy.Clip_management(tempRaster, "#", outRaster, studyMask, clipping_geometry="ClippingGeometry")
+            arcpy.Delete_management(tempRaster)
+        else:
+            resampledTemp.save(outRaster)
+
+        del resampledTemp
+
+    finally:
+        arcpy.env.snapRaster = origSnapRaster
+        arcpy.env.cellSize = origCellSize
+        arcpy.env.resamplingMethod = origResampling
+
+
+def resampleToGrid(inRaster, outRaster, gridRaster, method='NEAREST', studyMask=None, cacheFolder=None):
+
+    '''
+    Resamples inRaster onto the grid of gridRaster block by block, writing the result to outRaster.
+
+    method is 'NEAREST', 'BILINEAR' or 'MAJORITY'. If studyMask is given, cells outside the study area mask
+    are set to NoData, in place of clipping the resampled raster. The rasterized mask is cached in cacheFolder
+    (see study_mask.getMaskGrid). Integer rasters resampled by nearest neighbour or majority are written as integers.
+    Sources in a different coordinate system to the grid are resampled using ArcPy instead.
+    '''
+
+    try:
+        method = method.upper()
+        if method not in methods:
+            log.error('Invalid resampling method ' + str(method))
+            sys.exit()
+
+        targetGrid = raster_blocks.RasterGrid(gridRaster)
+        sourceGrid = raster_blocks.RasterGrid(inRaster)
+
+        if not sameSpatialReference(sourceGrid.spatialRef, targetGrid.spatialRef):
+            log.info(str(inRaster) + ' has a different coordinate system to the DEM. Resampling using ArcPy.')
+            applyEnvironment(inRaster, outRaster, gridRaster, method, studyMask)
+            return outRaster
+
+        if arcpy.Raster(inRaster).isInteger and method != 'BILINEAR':
+            writer = raster_blocks.BlockWriter(outRaster, targetGrid, np.int32, intNoData)
+        else:
+            writer = raster_blocks.BlockWriter(outRaster, targetGrid)
+
+        reader = raster_blocks.BlockReader(inRaster, sourceGrid)
+
+        maskReader = None
+        if studyMask is not None:
+            maskReader = study_mask.getMaskGrid(studyMask, gridRaster, cacheFolder)
+
+        aligned = isAligned(sourceGrid, targetGrid)
+
+        # Limit the block size by the number of source cells read for each target cell
+        cellRatio = max(1.0, (targetGrid.cellWidth * targetGrid.cellHeight) / (sourceGrid.cellWidth * sourceGrid.cellHeight))
+        blockSize = raster_blocks.blockSizeForBudget(4 + int(math.ceil(6 * cellRatio)))
+
+        for block in raster_blocks.iterBlocks(targetGrid, blockSize):
+
+            if aligned:
+                values = readAligned(reader, sourceGrid, targetGrid, block)
+            else:
+                values = resampleBlock(reader, sourceGrid, targetGrid, block, method)
+
+            if maskReader is not None:
+                values = np.where(np.isnan(maskReader.read(block)), np.float32(np.nan), values)
+
+            writer.write(block, values)
+
+        writer.close()
+
+        if aligned:
+            log.info(str(inRaster) + ' is aligned with the DEM grid, so its cells were written without resampling')
+
+        return outRaster
+
+    except Exception:
+        log.error("Could not resample " + str(inRaster) + " to the DEM grid")
+        raise
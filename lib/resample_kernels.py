@@ -0,0 +1,144 @@
+'''
+NumPy kernels for resampling a block of a source raster onto a target grid.
+
+Positions along each axis are given as distances from the edge of the source block (from the left edge for
+columns and from the top edge for rows), so the same functions are used for rows and columns. The kernels
+work on float32 blocks in which NoData cells are NaN, and do not depend on arcpy.
+'''
+
+import numpy as np
+
+
+def cell_centres(offset, cell_size, n):
+
+    ''' Positions of the centres of n cells of size cell_size, starting at offset '''
+
+    return offset + (np.arange(n) + 0.5) * cell_size
+
+
+def nearest_index(offset, target_cell, n_target, source_cell, n_source):
+
+    '''
+    Index of the source cell containing the centre of each target cell, or -1 if the centre is outside the source.
+
+    offset is the position of the start of the target cells relative to the start of the source cells.
+    '''
+
+    index = np.floor(cell_centres(offset, target_cell, n_target) / source_cell).astype(np.int64)
+    index[(index < 0) | (index >= n_source)] = -1
+
+    return index
+
+
+def bilinear_weights(offset, target_cell, n_target, source_cell, n_source):
+
+    '''
+    For each target cell, returns the two nearest source cells along the axis (i0, i1), the weight of i1
+    and whether the target cell centre is inside the source.
+    '''
+
+    centres = cell_centres(offset, target_cell, n_target)
+    position = centres / source_cell - 0.5
+
+    i0 = np.floor(position).astype(np.int64)
+    weight = (position - i0).astype(np.float32)
+    i1 = i0 + 1
+
+    inside = (centres >= 0) & (centres < n_source * source_cell)
+
+    return np.clip(i0, 0, n_source - 1), np.clip(i1, 0, n_source - 1), weight, inside
+
+
+def nearest(source, rows, cols):
+
+    ''' Resamples source by nearest neighbour, using the row and column index maps from nearest_index '''
+
+    out = source[np.clip(rows, 0, None)[:, None], np.clip(cols, 0, None)[None, :]].astype(np.float32)
+    out[(rows < 0)[:, None] | (cols < 0)[None, :]] = np.nan
+
+    return out
+
+
+def bilinear(source, rows, cols):
+
+    '''
+    Resamples source by bilinear interpolation, using the row and column weights from bilinear_weights.
+
+    NoData neighbours are left out and the weights of the others renormalised,
+    so that the result is only NoData where all four neighbours are NoData.
+    '''
+
+    r0, r1, wr, rowsInside = rows
+    c0, c1, wc, colsInside = cols
+
+    out = np.zeros((r0.size, c0.size), dtype=np.float32)
+    total = np.zeros((r0.size, c0.size), dtype=np.float32)
+
+    for rowIndex, rowWeight in [(r0, 1.0 - wr), (r1, wr)]:
+        for colIndex, colWeight in [(c0, 1.0 - wc), (c1, wc)]:
+
+            values = source[rowIndex[:, None], colIndex[None, :]]
+            weights = rowWeight[:, None] * colWeight[None, :]
+
+            weights = np.where(np.isnan(values), np.float32(0), weights)
+            out += weights * np.where(np.isnan(values), np.float32(0), values)
+            total += weights
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out /= total
+
+    out[total == 0] = np.nan
+    out[~rowsInside[:, None] | ~colsInside[None, :]] = np.nan
+
+    return out
+
+
+def mode(source, target_rows, target_cols, n_rows, n_cols):
+
+    '''
+    Resamples categorical source values by taking the most common value (the mode) of the source cells
+    whose centres fall inside each target cell. Ties are resolved in favour of the lowest value.
+
+    target_rows and target_cols give the target cell containing each source row and column (-1 if none),
+    as returned by nearest_index with the source and target swapped.
+    Returns the mode, and whether any source cell with data falls inside each target cell.
+    '''
+
+    out = np.full((n_rows, n_cols), np.nan, dtype=np.float32)
+
+    rowIndex, colIndex = np.meshgrid(target_rows, target_cols, indexing='ij')
+    valid = (rowIndex >= 0) & (colIndex >= 0) & np.isfinite(source)
+
+    targets = rowIndex[valid] * n_cols + colIndex[valid]
+    values = source[valid]
+
+    if targets.size == 0:
+        return out, np.zeros((n_rows, n_cols), dtype=bool)
+
+    # Count each (target, value) pair
+    order = np.lexsort((values, targets))
+    targets = targets[order]
+    values = values[order]
+
+    runStart = np.ones(targets.size, dtype=bool)
+    runStart[1:] = (targets[1:] != targets[:-1]) | (values[1:] != values[:-1])
+    starts = np.flatnonzero(runStart)
+    counts = np.diff(np.append(starts, targets.size))
+
+    runTargets = targets[starts]
+    runValues = values[starts]
+
+    # For each target, the run with the highest count comes first (lowest value first within ties)
+    order = np.lexsort((-counts, runTargets))
+    runTargets = runTargets[order]
+    runValues = runValues[order]
+
+    first = np.ones(runTargets.size, dtype=bool)
+    first[1:] = runTargets[1:] != runTargets[:-1]
+
+    out.flat[runTargets[first]] = runValues[first]
+
+    hasSource = np.zeros(n_rows * n_cols, dtype=bool)
+    hasSource[runTargets[first]] = True
+
+    return out, hasSource.reshape((n_rows, n_cols))
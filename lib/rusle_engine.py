@@ -0,0 +1,501 @@
+'''
+Fused NumPy soil loss engine for the RUSLE tools.
+
+Instead of saving each factor layer as a raster and then multiplying the saved layers together,
+each input is read block by block, the factors are multiplied together in a single float32 pass
+and only the soil loss raster (and the factor layers, if requested) are written.
+
+If more than one worker process is set in the user settings, the tiles are processed in parallel.
+Block functions must then be picklable, so they are module-level functions (or functools.partial objects).
+'''
+
+import arcpy
+import os
+import math
+import functools
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.raster_parallel as raster_parallel
+import NB_SEEA_ESRI.lib.rusle_kernels as rusle_kernels
+import NB_SEEA_ESRI.lib.tile_workers as tile_workers
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, raster_blocks, raster_parallel, rusle_kernels, tile_workers])
+
+
+class FactorSource(object):
+
+    '''
+    A RUSLE factor read block by block from one or more input rasters.
+
+    If blockFunction is given, it is called with one block from each of the input rasters and
+    returns the factor values for that block. Otherwise the factor is the first input raster.
+    If outRaster is given, the factor values are also saved to this raster.
+    If arrayFile is given, the factor is read from this memory-mapped array (staged from the input raster
+    on the same grid) instead of from the raster.
+    '''
+
+    def __init__(self, name, rasters, blockFunction=None, outRaster=None, arrayFile=None):
+
+        if type(rasters) is not list:
+            rasters = [rasters]
+
+        self.name = name
+        self.rasters = rasters
+        self.blockFunction = blockFunction
+        self.outRaster = outRaster
+        self.arrayFile = arrayFile
+
+
+# Preprocessing tool inputs which determine the DEM-derived layers and the study area mask
+terrainInputs = ['Digital_elevation_model', 'Study_area_mask', 'Recondition_DEM', 'Stream_network',
+                 'Stream_initiation_accumulation_threshold', 'River_initiation_accumulation_threshold',
+                 'Stream_smooth_drop_buffer_distance', 'Stream_drop_buffer', 'Stream_drop']
+
+# Preprocessing tool inputs which determine the preprocessed soil layer
+soilInputs = ['Soil', 'Soil_linking_code']
+
+
+class FactorStore(object):
+
+    '''
+    Factor layers shared between runs of the RUSLE function, such as Year A and Year B of the accounts tools.
+
+    names lists the factors ('R', 'LS' and/or 'K') which are the same in each run. The first run calculates
+    these factors and adds them to the store, and later runs reuse them instead of calculating them again.
+    The shared factors are also stored multiplied together as a single 'base' layer: a memory-mapped array written
+    in the same pass as the first run's soil loss with the NumPy engine, or a temporary raster with the ArcPy engine.
+    '''
+
+    def __init__(self, names, prefix):
+
+        self.names = list(names)
+        self.prefix = prefix
+        self.rasters = {}
+        self.arrays = {}
+        self.tempRasters = []
+
+    def isShared(self, name):
+
+        return name in self.names
+
+    def get(self, name):
+
+        ''' Returns the stored layer for the factor, or None if it has not been calculated yet '''
+
+        raster = self.rasters.get(name)
+
+        if raster is not None and arcpy.Exists(raster):
+            return raster
+        else:
+            return None
+
+    def getArray(self, name):
+
+        ''' Returns the stored memory-mapped array for the factor, or None if it has not been calculated yet '''
+
+        arrayFile = self.arrays.get(name)
+
+        if arrayFile is not None and os.path.exists(arrayFile):
+            return arrayFile
+        else:
+            return None
+
+    def add(self, name, raster):
+
+        self.rasters[name] = raster
+
+    def addArray(self, name, arrayFile):
+
+        self.arrays[name] = arrayFile
+
+    def arrayFilename(self, name):
+
+        ''' Returns the name of a memory-mapped array for the factor, deleted when the store is cleared '''
+
+        return raster_parallel.arrayFilename('shared' + name)
+
+    def tempRaster(self, name):
+
+        ''' Returns the name of a temporary layer for the factor, deleted when the store is cleared '''
+
+        raster = self.prefix + "shared" + name
+        self.tempRasters.append(raster)
+
+        return raster
+
+    def clear(self):
+
+        for raster in self.tempRasters:
+            if arcpy.Exists(raster):
+                arcpy.Delete_management(raster)
+
+        raster_parallel.deleteArrays(list(self.arrays.values()))
+
+        self.rasters = {}
+        self.arrays = {}
+        self.tempRasters = []
+
+
+def samePreprocessInputs(folderA, folderB, paramNames):
+
+    ''' Checks if two preprocessing folders were produced from the same values of the given preprocessing inputs '''
+
+    if os.path.normcase(os.path.abspath(folderA)) == os.path.normcase(os.path.abspath(folderB)):
+        return True
+
+    # Without a record of the inputs, the folders cannot be compared
+    if common.getInputValue(folderA, 'Digital_elevation_model') is None:
+        return False
+
+    for paramName in paramNames:
+        if common.getInputValue(folderA, paramName) != common.getInputValue(folderB, paramName):
+            return False
+
+    return True
+
+
+def invariantFactors(yearAFolder, yearBFolder, sameRainfall, sameSoil):
+
+    '''
+    Returns the factors which are the same for Year A and Year B.
+
+    sameRainfall and sameSoil are whether the rainfall erosivity and soil inputs are the same for both years.
+    All factors depend on the DEM and study area mask, so none are shared unless the terrain inputs match.
+    '''
+
+    if not samePreprocessInputs(yearAFolder, yearBFolder, terrainInputs):
+        return []
+
+    names = ['LS']
+
+    if sameRainfall:
+        names.append('R')
+
+    if sameSoil:
+        names.append('K')
+
+    return names
+
+
+def lsSlopeLengthFunction(cellSize, slopeAngle):
+
+    ''' Returns a block function calculating the LS-factor from slope (in percent) and slope length only '''
+
+    cutoffPercent = math.tan(float(slopeAngle) * (math.pi / 180.0)) * 100.0
+
+    return functools.partial(rusle_kernels.ls_slope_length, cellsize=float(cellSize), cutoff=cutoffPercent)
+
+
+def lsUpslopeAreaFunction(cellSize, slopeAngle, m=0.5, n=1.2):
+
+    ''' Returns a block function calculating the LS-factor from flow accumulation and slope (in degrees) '''
+
+    return functools.partial(rusle_kernels.ls_upslope_area, cellsize=float(cellSize), m=float(m), n=float(n),
+                             cutoff=float(slopeAngle))
+
+
+def loadLookupTable(table, codeField, valueField):
+
+    ''' Reads a code table (such as rusle_hwsd.dbf) into a dense lookup table from code to factor value '''
+
+    try:
+        codes = []
+        values = []
+
+        with arcpy.da.SearchCursor(table, [codeField, valueField]) as cursor:
+            for code, value in cursor:
+                if code is not None:
+                    codes.append(code)
+                    values.append(value)
+
+        return rusle_kernels.build_lut(codes, values)
+
+    except Exception:
+        log.error("Could not read " + valueField + " values from table " + str(table))
+        raise
+
+
+def lookupFunction(lut):
+
+    ''' Returns a block function assigning factor values to codes using the lookup table '''
+
+    return functools.partial(rusle_kernels.apply_lut, lut=lut)
+
+
+def reportUnmappedCodes(raster, lut, factorName):
+
+    '''
+    Warns about codes in the raster which have no value in the lookup table.
+    These cells will be NoData in the factor layer.
+    '''
+
+    try:
+        with arcpy.da.SearchCursor(raster, ["VALUE"]) as cursor:
+            codes = [row[0] for row in cursor]
+
+    except Exception:
+        log.warning("Could not read attribute table of " + str(raster) + " to check for unmapped codes")
+        return []
+
+    unmapped = rusle_kernels.unmapped_codes(codes, lut).tolist()
+
+    if len(unmapped) > 0:
+        log.warning(str(len(unmapped)) + " codes have no " + factorName + " value and will be NoData: "
+                    + ", ".join([str(code) for code in unmapped]))
+
+    return unmapped
+
+
+def fusedSoilLoss(gridRaster, factors, soilLoss, blockSize=None, numWorkers=None, baseNames=None, baseFile=None):
+
+    '''
+    Calculates soil loss as the product of the factors, reading each input block once.
+
+    gridRaster is the raster (normally the DEM) defining the extent and cell size of the output.
+    factors is a list of FactorSource objects.
+    If baseFile is given, the product of the factors named in baseNames is also written to this memory-mapped
+    array in the same pass, so that later runs sharing these factors can read them as a single factor.
+    '''
+
+    if numWorkers is None:
+        numWorkers = raster_parallel.getNumWorkers()
+
+    # The base factors are put first, so the base is the product of the first numBase factors
+    numBase = 0
+    if baseFile is not None:
+        factors = ([factor for factor in factors if factor.name in baseNames]
+                   + [factor for factor in factors if factor.name not in baseNames])
+        numBase = len([factor for factor in factors if factor.name in baseNames])
+
+    if numWorkers > 1:
+        parallelSoilLoss(gridRaster, factors, soilLoss, numWorkers, blockSize, baseFile, numBase)
+        return
+
+    try:
+        grid = raster_blocks.RasterGrid(gridRaster)
+
+        if baseFile is not None:
+            raster_parallel.createArray(baseFile, grid)
+
+        readers = []
+        writers = []
+        for factor in factors:
+            if factor.arrayFile is not None:
+                readers.append([raster_parallel.ArrayReader(factor.arrayFile)])
+            else:
+                readers.append([raster_blocks.BlockReader(raster, grid) for raster in factor.rasters])
+
+            if factor.outRaster is not None:
+                writers.append(raster_blocks.BlockWriter(factor.outRaster, grid))
+            else:
+                writers.append(None)
+
+        soilLossWriter = raster_blocks.BlockWriter(soilLoss, grid)
+
+        # Limit the block size so that the input, factor and soil loss blocks fit within the memory budget
+        if blockSize is None:
+            numArrays = sum([len(factor.rasters) + 1 for factor in factors]) + 2
+            blockSize = raster_blocks.blockSizeForBudget(numArrays)
+
+        for block in raster_blocks.iterBlocks(grid, blockSize):
+
+            factorBlocks = []
+            for factor, factorReaders, writer in zip(factors, readers, writers):
+
+                inputBlocks = [reader.read(block) for reader in factorReaders]
+
+                if factor.blockFunction is not None:
+                    factorBlock = factor.blockFunction(*inputBlocks)
+                else:
+                    factorBlock = inputBlocks[0]
+
+                if writer is not None:
+                    writer.write(block, factorBlock)
+
+                factorBlocks.append(factorBlock)
+
+            if baseFile is not None:
+                baseBlock = rusle_kernels.multiply_factors(factorBlocks[:numBase])
+                tile_workers.writeTile(baseFile, (block.row, block.col, block.nRows, block.nCols), baseBlock)
+                factorBlocks = [baseBlock] + factorBlocks[numBase:]
+
+            soilLossWriter.write(block, rusle_kernels.multiply_factors(factorBlocks))
+            del factorBlocks
+
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+
+        soilLossWriter.close()
+
+        log.info("Soil loss calculated in a single pass over " + ", ".join([factor.name for factor in factors]))
+
+    except Exception:
+        log.error("Fused soil loss calculation failed")
+        raise
+
+
+def parallelSoilLoss(gridRaster, factors, soilLoss, numWorkers, blockSize=None, baseFile=None, numBase=0):
+
+    '''
+    Calculates soil loss as the product of the factors, with the tiles processed by a pool of worker processes.
+
+    Each input raster is staged once into a memory-mapped array which the workers read their tiles from.
+    If baseFile is given, the product of the first numBase factors is also written to this memory-mapped array.
+    '''
+
+    arrayFiles = []
+
+    try:
+        grid = raster_blocks.RasterGrid(gridRaster)
+
+        # Each worker holds its input, factor and soil loss tiles in memory at once
+        if blockSize is None:
+            numArrays = sum([len(factor.rasters) + 1 for factor in factors]) + 2
+            blockSize = raster_blocks.blockSizeForBudget(numArrays * numWorkers)
+
+        # Stage each input raster once, even if it is used by more than one factor
+        stagedInputs = {}
+        factorSpecs = []
+        savedFactors = []
+
+        for factor in factors:
+
+            inputFiles = []
+            if factor.arrayFile is not None:
+                # Factor has already been staged
+                inputFiles.append(factor.arrayFile)
+
+            else:
+                for raster in factor.rasters:
+                    if raster not in stagedInputs:
+                        arrayFile = raster_parallel.arrayFilename('in' + str(len(stagedInputs)))
+                        stagedInputs[raster] = raster_parallel.stageRaster(raster, grid, arrayFile)
+                        arrayFiles.append(arrayFile)
+
+                    inputFiles.append(stagedInputs[raster])
+
+            outFile = None
+            if factor.outRaster is not None:
+                outFile = raster_parallel.createArray(raster_parallel.arrayFilename(factor.name + 'Factor'), grid)
+                arrayFiles.append(outFile)
+                savedFactors.append((outFile, factor.outRaster))
+
+            factorSpecs.append((inputFiles, factor.blockFunction, outFile))
+
+        soilLossFile = raster_parallel.createArray(raster_parallel.arrayFilename('soilLoss'), grid)
+        arrayFiles.append(soilLossFile)
+
+        if baseFile is not None:
+            raster_parallel.createArray(baseFile, grid)
+
+        tasks = [(tile, factorSpecs, soilLossFile, baseFile, numBase) for tile in raster_parallel.listTiles(grid, blockSize)]
+        raster_parallel.runTiles(tile_workers.fusedSoilLossTile, tasks, numWorkers)
+
+        # Write outputs
+        for outFile, outRaster in savedFactors:
+            raster_parallel.writeArrayToRaster(outFile, grid, outRaster)
+
+        raster_parallel.writeArrayToRaster(soilLossFile, grid, soilLoss)
+
+        log.info("Soil loss calculated in parallel over " + ", ".join([factor.name for factor in factors]))
+
+    except Exception:
+        log.error("Parallel soil loss calculation failed")
+        raise
+
+    finally:
+        raster_parallel.deleteArrays(arrayFiles)
+
+
+def summariseRaster(raster):
+
+    '''
+    Summarises the values of a raster, read block by block.
+
+    Returns a dictionary with the number of cells with data ('count'), and the 'mean', 'min', 'max'
+    and 'total' (the sum of the cell values multiplied by the cell area in hectares) of the values.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(raster)
+        reader = raster_blocks.BlockReader(raster, grid)
+
+        count = 0
+        total = 0.0
+        minValue = None
+        maxValue = None
+
+        for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(2)):
+
+            blockCount, blockTotal, blockMin, blockMax = rusle_kernels.block_stats(reader.read(block))
+
+            if blockCount > 0:
+                count += blockCount
+                total += blockTotal
+                minValue = blockMin if minValue is None else min(minValue, blockMin)
+                maxValue = blockMax if maxValue is None else max(maxValue, blockMax)
+
+        cellAreaHa = grid.cellWidth * grid.cellHeight / 10000.0
+
+        summary = {'count': count,
+                   'mean': total / count if count > 0 else None,
+                   'min': minValue,
+                   'max': maxValue,
+                   'total': total * cellAreaHa}
+
+        return summary
+
+    except Exception:
+        log.error("Could not summarise raster " + str(raster))
+        raise
+
+
+def soilLossDifference(soilLossA, soilLossB, soilLossDiff, blockSize=None):
+
+    '''
+    Writes the difference in soil loss between two years (soilLossB - soilLossA) to soilLossDiff in a single pass,
+    with areas of zero difference set to NoData.
+
+    Returns a dictionary with the total 'gain', 'loss' and 'net' change in soil loss (tons/yr),
+    calculated from the same pass.
+    '''
+
+    try:
+        grid = raster_blocks.RasterGrid(soilLossA)
+        readerA = raster_blocks.BlockReader(soilLossA, grid)
+        readerB = raster_blocks.BlockReader(soilLossB, grid)
+        writer = raster_blocks.BlockWriter(soilLossDiff, grid)
+
+        if blockSize is None:
+            blockSize = raster_blocks.blockSizeForBudget(3)
+
+        gain = 0.0
+        loss = 0.0
+
+        for block in raster_blocks.iterBlocks(grid, blockSize):
+
+            diff = rusle_kernels.soil_loss_difference(readerA.read(block), readerB.read(block))
+            writer.write(block, diff)
+
+            blockGain, blockLoss = rusle_kernels.gain_loss_totals(diff)
+            gain += blockGain
+            loss += blockLoss
+
+        writer.close()
+
+        cellAreaHa = grid.cellWidth * grid.cellHeight / 10000.0
+
+        totals = {'gain': gain * cellAreaHa,
+                  'loss': loss * cellAreaHa,
+                  'net': (gain + loss) * cellAreaHa}
+
+        return totals
+
+    except Exception:
+        log.error("Soil loss difference calculation failed")
+        raise
@@ -0,0 +1,184 @@
+'''
+NumPy kernels for the RUSLE soil loss calculations.
+
+These functions operate on blocks of float32 values in which NoData cells are NaN,
+and do not depend on arcpy, so they can be used on any array.
+'''
+
+import numpy as np
+
+
+def multiply_factors(factors, out=None):
+
+    '''
+    Multiplies a sequence of factor blocks together in a single pass.
+
+    The product is accumulated in place in out (a float32 array of the same shape as the factors),
+    which is created if not given. NaN (NoData) in any factor gives NaN in the product.
+    '''
+
+    factors = list(factors)
+
+    if out is None:
+        out = np.ones(np.shape(factors[0]), dtype=np.float32)
+    else:
+        out.fill(1.0)
+
+    for factor in factors:
+        np.multiply(out, factor, out=out)
+
+    return out
+
+
+def ls_slope_length(slope_pct, cellsize, cutoff, out=None):
+
+    '''
+    LS-factor from slope (in percent) and slope length only:
+
+        LS = (cellsize / 22) ^ 0.5 * (0.065 + 0.045 s + 0.0065 s^2)
+
+    where s is the slope, capped at cutoff (in percent).
+    The result is written to out, which defaults to slope_pct (i.e. slope_pct is overwritten).
+    '''
+
+    if out is None:
+        out = slope_pct
+
+    np.minimum(slope_pct, cutoff, out=out)
+
+    # Evaluate the polynomial as 0.065 + s * (0.045 + 0.0065 s)
+    poly = np.multiply(out, 0.0065)
+    poly += 0.045
+    out *= poly
+    out += 0.065
+    out *= (cellsize / 22.0) ** 0.5
+
+    return out
+
+
+def ls_upslope_area(fac, slope_deg, cellsize, m, n, cutoff, out=None):
+
+    '''
+    LS-factor including upslope contributing area:
+
+        LS = (m + 1) * (A / 22.1) ^ m * (sin(b) / 0.09) ^ n
+
+    where A is the upslope area (flow accumulation multiplied by the cell size) and b is the slope,
+    capped at cutoff (in degrees). The result is written to out, which defaults to fac.
+    Both fac and slope_deg are overwritten.
+    '''
+
+    if out is None:
+        out = fac
+
+    # Upslope area term
+    np.multiply(fac, cellsize / 22.1, out=out)
+    np.power(out, m, out=out)
+
+    # Slope term, with the slope converted from degrees to radians
+    np.minimum(slope_deg, cutoff, out=slope_deg)
+    slope_deg *= 0.01745
+    np.sin(slope_deg, out=slope_deg)
+    slope_deg /= 0.09
+    np.power(slope_deg, n, out=slope_deg)
+
+    out *= slope_deg
+    out *= (m + 1)
+
+    return out
+
+
+def build_lut(codes, values):
+
+    '''
+    Builds a dense lookup table from codes (non-negative integers) to factor values.
+
+    The table is a float32 array indexed by code, with NaN (NoData) for codes not in codes.
+    Where a code appears more than once, the first value is used. None values are treated as NoData.
+    '''
+
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.array([np.nan if value is None else value for value in values], dtype=np.float32)
+
+    lut = np.full(int(codes.max()) + 1 if codes.size > 0 else 0, np.nan, dtype=np.float32)
+
+    # Assign in reverse so that the first occurrence of a duplicated code is kept
+    lut[codes[::-1]] = values[::-1]
+
+    return lut
+
+
+def apply_lut(codes, lut, out=None):
+
+    '''
+    Looks up the factor value for each cell of a block of codes by indexing into a dense lookup table.
+
+    Cells which are NaN (NoData), or whose code is not in the table, are NaN in the result.
+    The result is written to out, which defaults to codes (i.e. codes is overwritten).
+    '''
+
+    if out is None:
+        out = codes
+
+    valid = np.isfinite(codes)
+    valid[valid] = (codes[valid] >= 0) & (codes[valid] < lut.size)
+
+    index = codes[valid].astype(np.int64)
+
+    out.fill(np.nan)
+    out[valid] = lut[index]
+
+    return out
+
+
+def unmapped_codes(codes, lut):
+
+    ''' Returns the sorted unique codes which have no value (or a NoData value) in the lookup table '''
+
+    codes = np.unique(np.asarray(codes, dtype=np.int64))
+
+    inTable = (codes >= 0) & (codes < lut.size)
+    inTable[inTable] = np.isfinite(lut[codes[inTable]])
+
+    return codes[~inTable]
+
+
+def block_stats(values):
+
+    '''
+    Returns (count, total, minimum, maximum) of the non-NaN values in a block.
+    The total is accumulated in float64. The minimum and maximum are NaN if there are no values.
+    '''
+
+    valid = values[np.isfinite(values)]
+
+    if valid.size == 0:
+        return 0, 0.0, np.nan, np.nan
+
+    return valid.size, float(np.sum(valid, dtype=np.float64)), float(valid.min()), float(valid.max())
+
+
+def soil_loss_difference(loss_a, loss_b, out=None):
+
+    '''
+    Difference in soil loss between two years (loss_b - loss_a), with cells of zero difference set to NaN (NoData).
+    The result is written to out, which defaults to loss_b (i.e. loss_b is overwritten).
+    '''
+
+    if out is None:
+        out = loss_b
+
+    np.subtract(loss_b, loss_a, out=out)
+    out[out == 0] = np.nan
+
+    return out
+
+
+def gain_loss_totals(diff):
+
+    ''' Returns the totals (in float64) of the positive and negative values in a block of differences '''
+
+    gain = float(np.sum(diff[diff > 0], dtype=np.float64))
+    loss = float(np.sum(diff[diff < 0], dtype=np.float64))
+
+    return gain, loss
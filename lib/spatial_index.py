@@ -0,0 +1,149 @@
+'''
+Packed STR-tree spatial index for the bounding boxes of features.
+
+The tree is bulk loaded once for a data set using Sort-Tile-Recursive packing, and held as a contiguous
+float64 array of boxes for each level of the tree, with the range of child nodes of each node. Queries are run
+in batches: all of the query boxes descend the tree together, one level at a time, with NumPy operations
+over every (query, node) pair at that level. Results are returned as arrays of indices rather than feature lists,
+so tools can test only the candidate pairs instead of every item against every query.
+
+Boxes are arrays of shape (n, 4) holding xMin, yMin, xMax and yMax. The module does not depend on arcpy.
+'''
+
+import numpy as np
+
+
+def strOrder(boxes, nodeCapacity):
+
+    '''
+    Returns the Sort-Tile-Recursive order of the boxes: sorted by the x of their centres into vertical slices,
+    then by the y of their centres within each slice, so that each run of nodeCapacity boxes is spatially compact.
+    '''
+
+    numBoxes = boxes.shape[0]
+    if numBoxes == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    numNodes = -(-numBoxes // nodeCapacity)
+    numSlices = int(np.ceil(np.sqrt(numNodes)))
+    sliceSize = nodeCapacity * -(-numNodes // numSlices)
+
+    # Empty boxes have NaN centres, which sort last
+    with np.errstate(invalid='ignore'):
+        centreX = boxes[:, 0] + boxes[:, 2]
+        centreY = boxes[:, 1] + boxes[:, 3]
+
+    byX = np.argsort(centreX, kind='mergesort')
+    slices = np.empty(numBoxes, dtype=np.int64)
+    slices[byX] = np.arange(numBoxes) // sliceSize
+
+    return np.lexsort((centreY, slices))
+
+
+class STRTree(object):
+
+    '''
+    Packed STR-tree of bounding boxes.
+
+    levels[0] are the leaves (the boxes themselves, in packed order, with items giving their index in the input)
+    and levels[-1] is the root. Each level holds the boxes of its nodes and the start and end of each node's
+    children in the level below.
+    '''
+
+    def __init__(self, boxes, nodeCapacity=16):
+
+        boxes = np.ascontiguousarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+        self.nodeCapacity = nodeCapacity
+        self.numItems = boxes.shape[0]
+
+        order = strOrder(boxes, nodeCapacity)
+        self.items = order
+        self.levels = [(np.ascontiguousarray(boxes[order]), None, None)]
+
+        # Pack each level into nodes of the level above until there is a single root node
+        while self.levels[-1][0].shape[0] > 1:
+
+            childBoxes, childStarts, childEnds = self.levels[-1]
+            numChildren = childBoxes.shape[0]
+
+            # Put the children in STR order, so each parent's children are a contiguous run
+            if childStarts is not None:
+                order = strOrder(childBoxes, nodeCapacity)
+                childBoxes = np.ascontiguousarray(childBoxes[order])
+                self.levels[-1] = (childBoxes, childStarts[order], childEnds[order])
+
+            starts = np.arange(0, numChildren, nodeCapacity)
+            ends = np.minimum(starts + nodeCapacity, numChildren)
+
+            nodeBoxes = np.empty((starts.size, 4), dtype=np.float64)
+            nodeBoxes[:, 0] = np.minimum.reduceat(childBoxes[:, 0], starts)
+            nodeBoxes[:, 1] = np.minimum.reduceat(childBoxes[:, 1], starts)
+            nodeBoxes[:, 2] = np.maximum.reduceat(childBoxes[:, 2], starts)
+            nodeBoxes[:, 3] = np.maximum.reduceat(childBoxes[:, 3], starts)
+
+            self.levels.append((nodeBoxes, starts, ends))
+
+    def queryBoxes(self, boxes, batchSize=100000):
+
+        '''
+        Finds the items whose boxes intersect (or touch) each of the query boxes.
+
+        Returns two arrays of the same length: the index of the query box and the index of the item (in the boxes
+        the tree was built from) for each intersecting pair, sorted by query and then item.
+        Queries are run batchSize at a time to limit the number of candidate pairs held at once.
+        '''
+
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+        queryParts = []
+        itemParts = []
+
+        if self.numItems > 0:
+            for batchStart in range(0, boxes.shape[0], batchSize):
+                queries, items = self.descend(boxes[batchStart:batchStart + batchSize])
+                queryParts.append(queries + batchStart)
+                itemParts.append(items)
+
+        if len(queryParts) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        queries = np.concatenate(queryParts)
+        items = np.concatenate(itemParts)
+
+        order = np.lexsort((items, queries))
+
+        return queries[order], items[order]
+
+    def descend(self, boxes):
+
+        ''' Runs a batch of queries from the root of the tree down to the leaves '''
+
+        queries = np.arange(boxes.shape[0])
+        nodes = np.zeros(boxes.shape[0], dtype=np.int64)
+
+        for levelNo in range(len(self.levels) - 1, -1, -1):
+
+            nodeBoxes, starts, ends = self.levels[levelNo]
+
+            # Keep the (query, node) pairs whose boxes intersect
+            candidates = nodeBoxes[nodes]
+            queryBoxes = boxes[queries]
+            hits = ((candidates[:, 0] <= queryBoxes[:, 2]) & (candidates[:, 2] >= queryBoxes[:, 0]) &
+                    (candidates[:, 1] <= queryBoxes[:, 3]) & (candidates[:, 3] >= queryBoxes[:, 1]))
+
+            queries = queries[hits]
+            nodes = nodes[hits]
+
+            if starts is None:
+                break
+
+            # Replace each node with its children
+            counts = ends[nodes] - starts[nodes]
+            firstChild = np.repeat(starts[nodes], counts)
+            childNo = np.arange(firstChild.size) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            queries = np.repeat(queries, counts)
+            nodes = firstChild + childNo
+
+        return queries, self.items[nodes]
@@ -0,0 +1,238 @@
+'''
+Stream extraction from the preprocessed flow accumulation and flow direction layers.
+
+Any number of pairs of stream and river initiation thresholds are evaluated in a single pass over the
+flow accumulation blocks, so streams can be extracted for several thresholds without recalculating
+the hydrology. Stream order and the stream feature classes are then created for each pair of thresholds,
+either with the Spatial Analyst StreamOrder and StreamToFeature tools or, with the NumPy hydrology engine,
+by walking the flow direction graph once for each pair to find the Strahler order and trace the stream links.
+'''
+
+import arcpy
+import os
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.hydro_kernels as hydro_kernels
+import NB_SEEA_ESRI.lib.hydrology_engine as hydrology_engine
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, raster_blocks, hydro_kernels, hydrology_engine])
+
+# NoData value for the 8-bit stream rasters
+streamNoData = 255
+
+
+class StreamOutputs(object):
+
+    '''
+    Stream layers for one pair of thresholds (in hectares): the inverse stream raster
+    (0 for stream, 1 for no stream), and the stream feature classes for analysis and for display.
+    '''
+
+    def __init__(self, minAccThresh, majAccThresh, streamInvRas, streams, streamDisplay):
+
+        self.minAccThresh = float(minAccThresh)
+        self.majAccThresh = float(majAccThresh)
+        self.streamInvRas = streamInvRas
+        self.streams = streams
+        self.streamDisplay = streamDisplay
+
+        # Filled in by extractStreams
+        self.streamCells = 0
+        self.streamsRaster = None
+
+
+def streamRasters(hydFAC, outputs, classRasters=True):
+
+    '''
+    Writes the inverse stream raster and (if classRasters is True) a temporary raster of stream classes
+    (1 stream, 2 major river) for each StreamOutputs in outputs, in a single pass over the flow accumulation.
+    Returns the maximum flow accumulation in hectares.
+    '''
+
+    grid = raster_blocks.RasterGrid(hydFAC)
+    reader = raster_blocks.BlockReader(hydFAC, grid)
+    cellAreaHa = grid.cellWidth * grid.cellHeight / 10000.0
+
+    writers = []
+    for index, output in enumerate(outputs):
+
+        output.streamCells = 0
+
+        classWriter = None
+        if classRasters:
+            output.streamsRaster = os.path.join(arcpy.env.scratchFolder, "base_StreamsRaster" + str(index) + ".tif")
+            classWriter = raster_blocks.BlockWriter(output.streamsRaster, grid, np.uint8, streamNoData)
+
+        writers.append((raster_blocks.BlockWriter(output.streamInvRas, grid, np.uint8, streamNoData), classWriter))
+
+    maxAccHa = 0.0
+
+    for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(2 + 2 * len(outputs))):
+
+        accHa = reader.read(block) * np.float32(cellAreaHa)
+
+        if np.isfinite(accHa).any():
+            maxAccHa = max(maxAccHa, float(np.nanmax(accHa)))
+
+        for output, (invWriter, classWriter) in zip(outputs, writers):
+
+            inverse, classes = hydro_kernels.stream_classes(accHa, output.minAccThresh, output.majAccThresh)
+            output.streamCells += int(np.count_nonzero(inverse == 0))
+
+            invWriter.write(block, inverse)
+            if classWriter is not None:
+                classWriter.write(block, classes)
+
+    for invWriter, classWriter in writers:
+        invWriter.close()
+        if classWriter is not None:
+            classWriter.close()
+
+    return maxAccHa
+
+
+def streamFeatures(streamsRaster, hydFDR, streams, streamDisplay):
+
+    ''' Creates the stream feature classes (for analysis and for display), with the Strahler order of each stream '''
+
+    streamOrderRaster = arcpy.sa.StreamOrder(streamsRaster, hydFDR, "STRAHLER")
+
+    # Create two streams feature classes - one for analysis and one for display
+    arcpy.sa.StreamToFeature(streamOrderRaster, hydFDR, streams, 'NO_SIMPLIFY')
+    arcpy.sa.StreamToFeature(streamOrderRaster, hydFDR, streamDisplay, 'SIMPLIFY')
+
+    # Rename grid_code column to 'Strahler'
+    for streamFC in [streams, streamDisplay]:
+
+        arcpy.AddField_management(streamFC, "Strahler", "LONG")
+        arcpy.CalculateField_management(streamFC, "Strahler", "!GRID_CODE!", "PYTHON_9.3")
+        arcpy.DeleteField_management(streamFC, "GRID_CODE")
+
+    del streamOrderRaster
+
+
+def writePolylines(outFC, spatialRef, x, y, offsets, strahler):
+
+    ''' Writes lines (vertices offsets[i] to offsets[i + 1] of x and y) to a new polyline feature class with their Strahler order '''
+
+    if arcpy.Exists(outFC):
+        arcpy.Delete_management(outFC)
+
+    arcpy.CreateFeatureclass_management(os.path.dirname(outFC), os.path.basename(outFC), "POLYLINE", spatial_reference=spatialRef)
+    arcpy.AddField_management(outFC, "Strahler", "LONG")
+
+    xList = x.tolist()
+    yList = y.tolist()
+
+    with arcpy.da.InsertCursor(outFC, ["SHAPE@", "Strahler"]) as cursor:
+        for start, end, order in zip(offsets[:-1].tolist(), offsets[1:].tolist(), strahler.tolist()):
+
+            # Single cell streams have no length
+            if end - start < 2:
+                continue
+
+            points = arcpy.Array([arcpy.Point(xList[i], yList[i]) for i in range(start, end)])
+            cursor.insertRow([arcpy.Polyline(points, spatialRef), order])
+
+
+def numpyStreamFeatures(hydFAC, hydFDR, outputs, tolerance=None):
+
+    '''
+    Creates the stream feature classes for each StreamOutputs in outputs using NumPy, in place of StreamOrder and StreamToFeature.
+
+    For each pair of thresholds, the Strahler order of the stream cells is calculated and the stream links traced
+    through the cell centres in one walk of the flow direction graph. Both feature classes are written with
+    the Strahler field already set, the display version simplified by Douglas-Peucker with a tolerance of
+    one cell (unless tolerance is given).
+    '''
+
+    grid = raster_blocks.RasterGrid(hydFDR)
+    fdr = hydrology_engine.fdrBlock(hydrology_engine.readGrid(hydFDR, grid))
+    accHa = hydrology_engine.readGrid(hydFAC, grid) * np.float32(grid.cellWidth * grid.cellHeight / 10000.0)
+
+    if tolerance is None:
+        tolerance = grid.cellWidth
+
+    for output in outputs:
+
+        streams = hydro_kernels.stream_classes(accHa, output.minAccThresh, output.majAccThresh)[0] == 0
+
+        receivers = hydro_kernels.stream_receivers(fdr, streams)
+        order = hydro_kernels.strahler_order(receivers, streams).ravel()
+        offsets, vertices = hydro_kernels.stream_links(receivers, streams)
+
+        # Order of each link is the order of its first cell
+        strahler = order[vertices[offsets[:-1]]]
+
+        # Cell centre coordinates of the vertices
+        rows, cols = np.divmod(vertices, grid.nCols)
+        x = grid.xMin + (cols + 0.5) * grid.cellWidth
+        y = grid.yMax - (rows + 0.5) * grid.cellHeight
+
+        writePolylines(output.streams, grid.spatialRef, x, y, offsets, strahler)
+
+        keep = hydro_kernels.douglas_peucker(x, y, offsets, tolerance)
+        simplifiedOffsets = offsets
+        if offsets.size > 1:
+            simplifiedOffsets = np.r_[0, np.cumsum(np.add.reduceat(keep.astype(np.int64), offsets[:-1]))]
+
+        writePolylines(output.streamDisplay, grid.spatialRef, x[keep], y[keep], simplifiedOffsets, strahler)
+
+        log.info(str(offsets.size - 1) + ' stream links traced for stream initiation threshold ' + str(output.minAccThresh) + ' ha')
+
+
+def extractStreams(hydFAC, hydFDR, multRaster, outputs, outputFolder, engine='ArcPy'):
+
+    '''
+    Extracts the streams for each StreamOutputs in outputs from the existing flow accumulation and direction.
+
+    Where the stream initiation threshold is not reached, a warning is logged (in outputFolder) and the
+    inverse stream raster is copied from the multiplier raster (all cells no stream).
+    With the NumPy engine, the stream feature classes are created by numpyStreamFeatures, unless the grid
+    does not fit within the memory budget, when the Spatial Analyst tools are used instead.
+    Returns the outputs for which streams were created.
+    '''
+
+    try:
+        # Stream links are traced over the whole grid, with flow direction, accumulation, streams, order and receivers
+        if engine == 'NumPy' and not raster_blocks.fitsInBudget(raster_blocks.RasterGrid(hydFDR), numArrays=8, bytesPerCell=8):
+            log.info('Flow direction does not fit within the memory budget. Creating stream features with StreamToFeature.')
+            engine = 'ArcPy'
+
+        maxAccHa = streamRasters(hydFAC, outputs, classRasters=(engine != 'NumPy'))
+
+        created = []
+        for output in outputs:
+
+            if maxAccHa > output.minAccThresh:
+
+                if engine != 'NumPy':
+                    streamFeatures(output.streamsRaster, hydFDR, output.streams, output.streamDisplay)
+                    log.info("Stream files created for stream initiation threshold " + str(output.minAccThresh) + " ha")
+
+                created.append(output)
+
+            else:
+                warning = 'No streams initiated for stream initiation threshold ' + str(output.minAccThresh) + ' ha'
+                log.warning(warning)
+                common.logWarnings(outputFolder, warning)
+
+                # Create NBStream file from multiplier raster (i.e. all cells have value of 1 = no stream)
+                arcpy.Delete_management(output.streamInvRas)
+                arcpy.CopyRaster_management(multRaster, output.streamInvRas)
+
+            if output.streamsRaster is not None:
+                arcpy.Delete_management(output.streamsRaster)
+
+        if engine == 'NumPy' and len(created) > 0:
+            numpyStreamFeatures(hydFAC, hydFDR, created)
+
+        return created
+
+    except Exception:
+        log.error("Streams could not be extracted from " + str(hydFAC))
+        raise
@@ -0,0 +1,247 @@
+'''
+Raster-based study area mask operations.
+
+The study area mask polygon is rasterized once onto a grid (such as the DEM grid) and reused,
+so that checks against the mask and clipping can be carried out block by block without vector overlays.
+The rasterized mask is stored as a bit-packed array (one bit per cell) in the preprocess folder (or next to the
+study area mask), keyed by fingerprints of the mask and the grid, so that later runs using the same mask and DEM reuse it.
+'''
+
+import arcpy
+import os
+import hashlib
+import numpy as np
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, raster_blocks])
+
+# Rasterized masks, keyed by scratch GDB, study area mask and grid
+maskRasters = {}
+
+# Bit-packed masks loaded in this session, keyed by fingerprint
+maskGrids = {}
+
+# Percentage of the study area which may be outside the input data coverage before a warning is given
+maxPercentOutside = 2.5
+
+
+def gridKey(grid):
+
+    return (round(grid.xMin, 6), round(grid.yMax, 6), grid.nCols, grid.nRows, round(grid.cellWidth, 6))
+
+
+def rasterizeMask(studyMask, gridRaster):
+
+    '''
+    Rasterizes the study area mask onto the grid of gridRaster, returning the mask raster.
+    Cells whose centres are inside the mask have data and all other cells are NoData.
+    The mask is only rasterized once for each grid.
+    '''
+
+    grid = raster_blocks.RasterGrid(gridRaster)
+    key = (arcpy.env.scratchGDB, str(studyMask), gridKey(grid))
+
+    if key in maskRasters and arcpy.Exists(maskRasters[key]):
+        return maskRasters[key]
+
+    maskRaster = os.path.join(arcpy.env.scratchGDB, "studymask_ras" + str(len(maskRasters)))
+
+    # Snap the mask raster to the grid
+    origSnapRaster = arcpy.env.snapRaster
+    origExtent = arcpy.env.extent
+    origMask = arcpy.env.mask
+
+    try:
+        arcpy.env.snapRaster = gridRaster
+        arcpy.env.extent = gridRaster
+        arcpy.env.mask = None
+
+        oidField = arcpy.Describe(studyMask).OIDFieldName
+        arcpy.PolygonToRaster_conversion(studyMask, oidField, maskRaster, "CELL_CENTER", "", grid.cellWidth)
+
+    except Exception:
+        log.error("Study area mask " + str(studyMask) + " could not be rasterized")
+        raise
+
+    finally:
+        arcpy.env.snapRaster = origSnapRaster
+        arcpy.env.extent = origExtent
+        arcpy.env.mask = origMask
+
+    maskRasters[key] = maskRaster
+
+    return maskRaster
+
+
+class MaskGrid(object):
+
+    '''
+    Study area mask on a grid, held as a bit-packed array with each row of cells packed into bytes.
+    Blocks of the mask are unpacked as they are read.
+    '''
+
+    def __init__(self, bits, nRows, nCols):
+
+        self.bits = bits
+        self.nRows = nRows
+        self.nCols = nCols
+
+    def inside(self, block):
+
+        ''' Returns a boolean array for the block (plus halo), which is True inside the study area mask '''
+
+        window, padding = block.window(self)
+
+        byteStart = window.col // 8
+        byteEnd = (window.col + window.nCols + 7) // 8
+        bitStart = window.col - byteStart * 8
+
+        unpacked = np.unpackbits(self.bits[window.row:window.row + window.nRows, byteStart:byteEnd], axis=1)
+        values = unpacked[:, bitStart:bitStart + window.nCols].astype(bool)
+
+        if block.halo > 0:
+            values = np.pad(values, padding, mode='constant', constant_values=False)
+
+        return values
+
+    def read(self, block):
+
+        ''' Reads the block in the same way as raster_blocks.BlockReader, as 1 inside the mask and NaN (NoData) outside '''
+
+        values = np.ones((block.nRows + 2 * block.halo, block.nCols + 2 * block.halo), dtype=np.float32)
+        values[~self.inside(block)] = np.nan
+
+        return values
+
+
+def fingerprint(studyMask, grid):
+
+    ''' Returns a fingerprint of the study area mask and the grid, which changes if either changes '''
+
+    desc = arcpy.Describe(studyMask)
+    catalogPath = desc.catalogPath
+
+    parts = [os.path.normcase(os.path.abspath(catalogPath))]
+
+    # For shapefiles, the size and modification time of the files show if the mask has changed.
+    # Otherwise (such as for geodatabase feature classes) the geometry of the features is hashed.
+    if catalogPath.lower().endswith('.shp'):
+        for ext in ['.shp', '.shx', '.dbf']:
+            fileName = catalogPath[:-4] + ext
+            if os.path.exists(fileName):
+                stat = os.stat(fileName)
+                parts.append((ext, stat.st_size, int(stat.st_mtime)))
+    else:
+        geometryHash = hashlib.md5()
+        with arcpy.da.SearchCursor(studyMask, ['SHAPE@WKB']) as cursor:
+            for row in cursor:
+                if row[0] is not None:
+                    geometryHash.update(bytes(row[0]))
+
+        parts.append(geometryHash.hexdigest())
+
+    parts.append(gridKey(grid))
+    parts.append(grid.spatialRef.exportToString())
+
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def getMaskGrid(studyMask, gridRaster, cacheFolder=None):
+
+    '''
+    Returns the study area mask on the grid of gridRaster as a MaskGrid.
+
+    The mask is loaded from the bit-packed cache file in cacheFolder if there is one for this mask and grid.
+    Otherwise it is rasterized and saved to the cache file. cacheFolder (normally the preprocess folder)
+    defaults to the folder holding the study area mask, or its geodatabase.
+    '''
+
+    grid = raster_blocks.RasterGrid(gridRaster)
+    key = fingerprint(studyMask, grid)
+
+    if key in maskGrids:
+        return maskGrids[key]
+
+    if cacheFolder is None:
+        cacheFolder = os.path.dirname(arcpy.Describe(studyMask).catalogPath)
+        if cacheFolder.lower().endswith('.gdb'):
+            cacheFolder = os.path.dirname(cacheFolder)
+
+    cacheFile = os.path.join(cacheFolder, 'studyareamask_' + key + '.npy')
+
+    if os.path.exists(cacheFile):
+        bits = np.load(cacheFile)
+        log.info('Study area mask loaded from ' + cacheFile)
+
+    else:
+        maskRaster = rasterizeMask(studyMask, gridRaster)
+        reader = raster_blocks.BlockReader(maskRaster, grid)
+
+        bits = np.zeros((grid.nRows, (grid.nCols + 7) // 8), dtype=np.uint8)
+
+        # Blocks are a whole number of bytes wide, so each block's bits can be packed separately
+        blockSize = max(8, raster_blocks.blockSizeForBudget(2) // 8 * 8)
+        for block in raster_blocks.iterBlocks(grid, blockSize):
+            inside = np.isfinite(reader.read(block))
+            bits[block.row:block.row + block.nRows, block.col // 8:(block.col + block.nCols + 7) // 8] = np.packbits(inside, axis=1)
+
+        arcpy.Delete_management(maskRaster)
+
+        try:
+            np.save(cacheFile, bits)
+            log.info('Study area mask saved to ' + cacheFile)
+        except Exception:
+            log.warning('Study area mask could not be saved to ' + cacheFile + '. It will be rasterized again in later runs.')
+
+    maskGrids[key] = MaskGrid(bits, grid.nRows, grid.nCols)
+
+    return maskGrids[key]
+
+
+def checkRasterCoverage(raster, studyMask, inputFile=None, gridRaster=None, cacheFolder=None):
+
+    '''
+    Checks how much of the study area mask is not covered by data in the raster.
+
+    The mask is rasterized onto the grid of gridRaster (which defaults to the raster itself), and the NoData
+    cells of the raster inside the mask are counted block by block. A warning is given if more than 2.5 percent
+    of the study area is not covered. Returns the percentage of the study area outside the data coverage.
+    The rasterized mask is cached in cacheFolder, as in getMaskGrid.
+    '''
+
+    try:
+        if gridRaster is None:
+            gridRaster = raster
+
+        grid = raster_blocks.RasterGrid(gridRaster)
+        maskGrid = getMaskGrid(studyMask, gridRaster, cacheFolder)
+        dataReader = raster_blocks.BlockReader(raster, grid)
+
+        cellsInside = 0
+        cellsMissing = 0
+
+        for block in raster_blocks.iterBlocks(grid, raster_blocks.blockSizeForBudget(2)):
+
+            inside = maskGrid.inside(block)
+            missing = inside & np.isnan(dataReader.read(block))
+
+            cellsInside += int(np.count_nonzero(inside))
+            cellsMissing += int(np.count_nonzero(missing))
+
+        percOut = 0.0
+        if cellsInside > 0:
+            percOut = float(cellsMissing) / float(cellsInside) * 100.0
+
+        if percOut > maxPercentOutside:
+            log.warning('Input data coverage is less than ' + str(100 - maxPercentOutside) + ' percent of the study area')
+            log.warning('This may cause discrepancies in later calculations')
+            log.warning('Please check this input: ' + str(inputFile if inputFile is not None else raster))
+
+        return percOut
+
+    except Exception:
+        log.error("Coverage of " + str(raster) + " could not be checked against the study area mask")
+        raise
@@ -0,0 +1,80 @@
+'''
+NumPy terrain kernels.
+
+Blocks passed to these functions include a halo of one cell on each side (see raster_blocks.Block),
+with NoData cells as NaN. The results are returned for the block without the halo.
+'''
+
+import numpy as np
+
+
+def horn_gradients(dem, cell_width, cell_height):
+
+    '''
+    Calculates the east-west and north-south gradients of a DEM block using Horn's method,
+    as used by the Spatial Analyst Slope tool.
+
+    As in Slope, NoData neighbours are given the value of the centre cell, and cells
+    which are NoData themselves are NaN in the output.
+    '''
+
+    centre = dem[1:-1, 1:-1]
+
+    def neighbour(row_offset, col_offset):
+
+        rows = dem.shape[0]
+        cols = dem.shape[1]
+        values = dem[1 + row_offset:rows - 1 + row_offset, 1 + col_offset:cols - 1 + col_offset]
+
+        return np.where(np.isnan(values), centre, values)
+
+    a = neighbour(-1, -1)
+    b = neighbour(-1, 0)
+    c = neighbour(-1, 1)
+    d = neighbour(0, -1)
+    f = neighbour(0, 1)
+    g = neighbour(1, -1)
+    h = neighbour(1, 0)
+    i = neighbour(1, 1)
+
+    dz_dx = ((c + 2.0 * f + i) - (a + 2.0 * d + g)) / (8.0 * cell_width)
+    dz_dy = ((g + 2.0 * h + i) - (a + 2.0 * b + c)) / (8.0 * cell_height)
+
+    # The centre cell is not part of Horn's kernel, so NoData cells are set explicitly
+    nodata = np.isnan(centre)
+    dz_dx[nodata] = np.nan
+    dz_dy[nodata] = np.nan
+
+    return dz_dx, dz_dy
+
+
+def slope_degrees_percent(dem, cell_width, cell_height, degrees=True, percent=True):
+
+    '''
+    Slope of a DEM block in degrees and as percent rise, from a single calculation of the gradients.
+    Returns (degrees, percent), with None for either output which is not requested.
+    '''
+
+    dz_dx, dz_dy = horn_gradients(dem, cell_width, cell_height)
+
+    rise = np.sqrt(dz_dx * dz_dx + dz_dy * dz_dy)
+    del dz_dx, dz_dy
+
+    slopeDegrees = None
+    slopePercent = None
+
+    if degrees:
+        slopeDegrees = np.degrees(np.arctan(rise)).astype(np.float32)
+
+    if percent:
+        rise *= 100.0
+        slopePercent = rise.astype(np.float32)
+
+    return slopeDegrees, slopePercent
+
+
+def slope_percent(dem, cell_width, cell_height):
+
+    ''' Slope of a DEM block as percent rise '''
+
+    return slope_degrees_percent(dem, cell_width, cell_height, degrees=False)[1]
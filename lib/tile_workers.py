@@ -0,0 +1,207 @@
+'''
+Functions run by worker processes during parallel tile processing.
+
+Inputs and outputs are shared between processes as float32 arrays memory-mapped from .npy files
+in the scratch folder, so each worker only reads and writes its own tile. Tiles are given as
+(row, col, nRows, nCols) tuples. This module does not import arcpy, so that workers start quickly.
+'''
+
+import numpy as np
+
+import NB_SEEA_ESRI.lib.rusle_kernels as rusle_kernels
+import NB_SEEA_ESRI.lib.hydro_kernels as hydro_kernels
+
+
+def readTile(arrayFile, tile, halo=0, dtype=np.float32):
+
+    ''' Reads a tile (plus a halo of cells, NaN outside the array) from a memory-mapped array '''
+
+    data = np.load(arrayFile, mmap_mode='r')
+    row, col, nRows, nCols = tile
+
+    rowStart = max(row - halo, 0)
+    colStart = max(col - halo, 0)
+    rowEnd = min(row + nRows + halo, data.shape[0])
+    colEnd = min(col + nCols + halo, data.shape[1])
+
+    values = np.array(data[rowStart:rowEnd, colStart:colEnd], dtype=dtype)
+    del data
+
+    if halo > 0:
+        padding = ((rowStart - (row - halo), (row + nRows + halo) - rowEnd),
+                   (colStart - (col - halo), (col + nCols + halo) - colEnd))
+        values = np.pad(values, padding, mode='constant', constant_values=np.nan)
+
+    return values
+
+
+def writeTile(arrayFile, tile, values):
+
+    ''' Writes the values for a tile into a memory-mapped array '''
+
+    data = np.load(arrayFile, mmap_mode='r+')
+    row, col, nRows, nCols = tile
+
+    data[row:row + nRows, col:col + nCols] = values
+    data.flush()
+    del data
+
+
+def fusedSoilLossTile(task):
+
+    '''
+    Calculates soil loss for one tile.
+
+    task is (tile, factorSpecs, soilLossFile, baseFile, numBase), where each factor spec is (inputFiles, blockFunction, outFile).
+    blockFunction may be None (the factor is the first input) and outFile may be None (the factor is not saved).
+    If baseFile is not None, the product of the first numBase factors is also written to it.
+    '''
+
+    tile, factorSpecs, soilLossFile, baseFile, numBase = task
+
+    factorBlocks = []
+    for inputFiles, blockFunction, outFile in factorSpecs:
+
+        inputBlocks = [readTile(inputFile, tile) for inputFile in inputFiles]
+
+        if blockFunction is not None:
+            factorBlock = blockFunction(*inputBlocks)
+        else:
+            factorBlock = inputBlocks[0]
+
+        if outFile is not None:
+            writeTile(outFile, tile, factorBlock)
+
+        factorBlocks.append(factorBlock)
+
+    if baseFile is not None:
+        baseBlock = rusle_kernels.multiply_factors(factorBlocks[:numBase])
+        writeTile(baseFile, tile, baseBlock)
+        factorBlocks = [baseBlock] + factorBlocks[numBase:]
+
+    writeTile(soilLossFile, tile, rusle_kernels.multiply_factors(factorBlocks))
+
+    return tile
+
+
+def fillTile(task):
+
+    '''
+    First pass of the tiled fill: fills one tile on its own, labelling the area draining to each cell on its edge.
+
+    task is (tile, demFile, outletFile, filledFile, labelFile, labelBase). outletFile (which may be None) marks other
+    cells which drain freely, and the tile's labels are numbered from labelBase. The filled tile and its labels are
+    written to filledFile and labelFile. Returns the spill edges within the tile, and the filled values and labels
+    of its top row, bottom row, left column and right column.
+    '''
+
+    tile, demFile, outletFile, filledFile, labelFile, labelBase = task
+
+    # Cells next to NoData in the whole grid (including in neighbouring tiles) drain out of the DEM
+    dem = readTile(demFile, tile, halo=1)
+    drains = hydro_kernels.next_to_nodata(dem)[1:-1, 1:-1]
+
+    if outletFile is not None:
+        drains |= readTile(outletFile, tile) > 0
+
+    filled, labels, spills = hydro_kernels.priority_flood_labels(dem[1:-1, 1:-1], drains)
+    labels = hydro_kernels.global_labels(labels, labelBase)
+
+    writeTile(filledFile, tile, filled)
+    writeTile(labelFile, tile, labels)
+
+    spills = (hydro_kernels.global_labels(spills[0], labelBase), hydro_kernels.global_labels(spills[1], labelBase), spills[2])
+    sides = [(filled[0], labels[0]), (filled[-1], labels[-1]),
+             (np.array(filled[:, 0]), np.array(labels[:, 0])), (np.array(filled[:, -1]), np.array(labels[:, -1]))]
+
+    return spills, sides
+
+
+def fdrTile(fdrFile, tile):
+
+    ''' Reads a tile of flow directions with a halo of one cell, as uint8 codes '''
+
+    values = readTile(fdrFile, tile, halo=1)
+
+    return np.where(np.isnan(values), hydro_kernels.fdr_nodata, values).astype(np.uint8)
+
+
+def weightTile(weightFile, tile, fdr):
+
+    ''' Reads the flow accumulation weights for a tile (1 for each cell if there is no weight array), with 0 for NoData '''
+
+    row, col, nRows, nCols = tile
+
+    if weightFile is None:
+        weights = np.ones((nRows, nCols), dtype=np.float64)
+    else:
+        weights = readTile(weightFile, tile, dtype=np.float64)
+        weights[np.isnan(weights)] = 0.0
+
+    weights[fdr[1:-1, 1:-1] == hydro_kernels.fdr_nodata] = 0.0
+
+    return weights
+
+
+def accumulationTile(task):
+
+    '''
+    First pass of tiled flow accumulation: accumulates flow within one tile.
+
+    task is (tile, fdrFile, weightFile, totalFile, gridCols). The local totals are written to totalFile.
+    Returns the links of the tile to other tiles as global flat indices: the outflow cells, the cells
+    they flow to and their local totals, and the inlet cells with the outflow cell their flow leaves the tile at.
+    '''
+
+    tile, fdrFile, weightFile, totalFile, gridCols = task
+    row, col, nRows, nCols = tile
+
+    fdr = fdrTile(fdrFile, tile)
+    receivers, outflow, targetRows, targetCols, inlets = hydro_kernels.tile_flow(fdr)
+
+    total = hydro_kernels.accumulate(receivers, weightTile(weightFile, tile, fdr))
+    writeTile(totalFile, tile, total.reshape((nRows, nCols)))
+
+    def globalIndex(cells):
+        return (row + cells // nCols) * gridCols + col + cells % nCols
+
+    outCells = np.flatnonzero(outflow)
+    outTargets = (row + targetRows[outCells]) * gridCols + col + targetCols[outCells]
+
+    exits = hydro_kernels.tile_exits(receivers, outflow)[inlets]
+    inletExits = np.where(exits >= 0, globalIndex(exits), -1)
+
+    return globalIndex(outCells), outTargets, total[outCells], globalIndex(inlets), inletExits
+
+
+def inflowTile(task):
+
+    '''
+    Second pass of tiled flow accumulation: adds the inflow from other tiles to the cells downstream of each inlet.
+
+    task is (tile, fdrFile, weightFile, totalFile, accFile, inlets, inflow), where inlets are flat indices within the tile.
+    The flow accumulation for the tile (excluding each cell's own weight, NaN for NoData) is written to accFile.
+    '''
+
+    tile, fdrFile, weightFile, totalFile, accFile, inlets, inflow = task
+    row, col, nRows, nCols = tile
+
+    fdr = fdrTile(fdrFile, tile)
+    weights = weightTile(weightFile, tile, fdr)
+    total = readTile(totalFile, tile, dtype=np.float64).ravel()
+
+    if inlets.size > 0:
+        receivers = hydro_kernels.tile_flow(fdr)[0]
+
+        extra = np.zeros(nRows * nCols, dtype=np.float64)
+        extra[inlets] = inflow
+        total += hydro_kernels.accumulate(receivers, extra)
+
+    total -= weights.ravel()
+
+    acc = total.reshape((nRows, nCols)).astype(np.float32)
+    acc[fdr[1:-1, 1:-1] == hydro_kernels.fdr_nodata] = np.nan
+
+    writeTile(accFile, tile, acc)
+
+    return tile
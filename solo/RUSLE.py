@@ -4,6 +4,7 @@ NB RUSLE function
 
 import sys
 import os
+import traceback
 import configuration
 import numpy as np
 import arcpy
@@ -12,31 +13,31 @@ from arcpy.sa import Reclassify, RemapRange, RemapValue, Raster, Slope, Con, IsN
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.progress as progress
 import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.raster_parallel as raster_parallel
+import NB_SEEA_ESRI.lib.resample as resample
+import NB_SEEA_ESRI.lib.rusle_engine as rusle_engine
+import NB_SEEA_ESRI.lib.study_mask as study_mask
 from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log, common])
+refresh_modules([log, common, raster_blocks, raster_parallel, resample, rusle_engine, study_mask])
 
-def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, soilData, soilCode, lcOption, landCoverData, landCoverCode, rData, saveFactors, supportData, rerun=False):
+def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, soilData, soilCode, lcOption, landCoverData, landCoverCode, rData, saveFactors, supportData, rerun=False, engine=None, m=0.5, n=1.2, factorStore=None, numWorkers=None):
 
     try:
         # Set temporary variables
         prefix = os.path.join(arcpy.env.scratchGDB, "rusle_")
 
-        supportCopy = prefix + "supportCopy"
-        soilResample = prefix + "soilResample"
-        lcResample = prefix + "lcResample"
-        rainResample = prefix + "rainResample"
-        supportResample = prefix + "supportResample"        
         soilClip = prefix + "soilClip"
         landCoverClip = prefix + "landCoverClip"
         rainClip = prefix + "rainClip"
         supportClip = prefix + "supportClip"
-        DEMSlopeCut = prefix + "DEMSlopeCut"
-        DEMSlopeRad = prefix + "DEMSlopeRad"
-        upslopeArea = prefix + "upslopeArea"
-        soilJoin = prefix + "soilJoin"
-        lcJoin = prefix + "lcJoin"
+        rainResample = prefix + "rainResample"
+        soilResample = prefix + "soilResample"
+        lcResample = prefix + "lcResample"
+        supportCopy = prefix + "supportCopy"
+        supportResample = prefix + "supportResample"
         rFactor = prefix + "rFactor"
         lsFactor = prefix + "lsFactor"
         kFactor = prefix + "kFactor"
@@ -73,6 +74,35 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
 
         reconOpt = common.getInputValue(preprocessFolder, 'Recondition_DEM')
 
+        # The 'ArcPy' engine saves each factor layer and then multiplies the layers together.
+        # The 'NumPy' engine reads the inputs block by block and multiplies the factors together in a single pass.
+        if engine is None:
+            engine = common.getUserSetting('rusleEngine', 'ArcPy')
+
+        log.info('Using ' + str(engine) + ' soil loss engine')
+
+        # K- and C-factor lookup tables are loaded once, and used again when calculating soil loss
+        kLookup = None
+        cLookup = None
+
+        # Factors shared with a previous run (e.g. Year A of the accounts tools) are reused rather than recalculated
+        sharedFactors = []
+        reusedFactors = []
+
+        if factorStore is not None:
+            sharedFactors = [name for name in ['R', 'LS', 'K'] if factorStore.isShared(name)]
+
+            if engine == 'NumPy':
+                # The saved factor layers of the previous run are needed if this run's factor layers are to be saved
+                if factorStore.getArray('base') is not None:
+                    if not saveFactors or all([factorStore.get(name) is not None for name in sharedFactors]):
+                        reusedFactors = sharedFactors
+            else:
+                reusedFactors = [name for name in sharedFactors if factorStore.get(name) is not None]
+
+            if len(reusedFactors) > 0:
+                log.info('Reusing ' + ', '.join(reusedFactors) + ' factors from previous run')
+
         arcpy.env.overwriteOutput= 'True'
 
         ####################
@@ -134,7 +164,7 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
                 else:
                     arcpy.CopyRaster_management(landCoverData, landCoverRas)
 
-            if soilData is not None:
+            if soilData is not None and 'K' not in reusedFactors:
                 soilFormat = arcpy.Describe(soilData).dataType
 
                 if soilFormat in ['ShapeFile', 'FeatureClass']:
@@ -147,92 +177,131 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
 
             progress.logProgress(codeBlock, outputFolder)
 
-        codeBlock = 'Resample down to DEM cell size'
-        if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
+        if engine == 'NumPy':
 
-            # Resample down to DEM cell size
-            log.info("Resampling inputs down to DEM cell size")
+            # Runs started with the ArcPy engine record this step as 'Resample down to DEM cell size' and 'Clip inputs'
+            codeBlock = 'Resample and clip inputs to DEM grid'
+            if not (progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun)
+                    or progress.codeSuccessfullyRun('Clip inputs', outputFolder, rerun)):
 
-            resampledRainTemp = arcpy.sa.ApplyEnvironment(rData)
-            resampledRainTemp.save(rainResample)
-            del resampledRainTemp
+                # Inputs are resampled to the DEM grid and clipped to the study area mask in a single pass
+                log.info("Resampling inputs to DEM grid and clipping to study area mask")
 
-            if soilData is not None: 
-                resampledSoilTemp = arcpy.sa.ApplyEnvironment(soilRas)
-                resampledSoilTemp.save(soilResample)
-                del resampledSoilTemp
+                if 'R' not in reusedFactors:
+                    resample.resampleToGrid(rData, rainClip, rawDEM, 'NEAREST', studyMask)
 
-                # Delete soil raster
-                arcpy.Delete_management(soilRas)
+                if soilData is not None and 'K' not in reusedFactors:
+                    resample.resampleToGrid(soilRas, soilClip, rawDEM, 'NEAREST', studyMask)
 
-            if landCoverData is not None:
-                resampledLCTemp = arcpy.sa.ApplyEnvironment(landCoverRas)
-                resampledLCTemp.save(lcResample)
-                del resampledLCTemp
+                    # Delete soil raster
+                    arcpy.Delete_management(soilRas)
 
-                # Delete land cover raster
-                arcpy.Delete_management(landCoverRas)
+                if landCoverData is not None:
+                    resample.resampleToGrid(landCoverRas, landCoverClip, rawDEM, 'MAJORITY', studyMask)
 
-            if supportData is not None:
+                    # Delete land cover raster
+                    arcpy.Delete_management(landCoverRas)
 
-                arcpy.CopyRaster_management(supportData, supportCopy)                
-                resampledPTemp = arcpy.sa.ApplyEnvironment(supportCopy)
-                resampledPTemp.save(supportResample)
-                del resampledPTemp
+                if supportData is not None:
+                    resample.resampleToGrid(supportData, supportClip, rawDEM, 'NEAREST', studyMask)
 
-                # Delete support raster
-                arcpy.Delete_management(supportCopy)
+                log.info("Inputs resampled and clipped")
 
-            log.info("Inputs resampled")
+                progress.logProgress(codeBlock, outputFolder)
 
-            progress.logProgress(codeBlock, outputFolder)
+        else:
 
-        codeBlock = 'Clip inputs'
-        if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
+            codeBlock = 'Resample down to DEM cell size'
+            if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            log.info("Clipping inputs")
-            
-            arcpy.Clip_management(rainResample, "#", rainClip, studyMask, clipping_geometry="ClippingGeometry")
+                # Resample down to DEM cell size
+                log.info("Resampling inputs down to DEM cell size")
 
-            # Delete resampled R-factor
-            arcpy.Delete_management(rainResample)
+                if 'R' not in reusedFactors:
+                    resampledRainTemp = arcpy.sa.ApplyEnvironment(rData)
+                    resampledRainTemp.save(rainResample)
+                    del resampledRainTemp
 
-            if soilData is not None: 
-                arcpy.Clip_management(soilResample, "#", soilClip, studyMask, clipping_geometry="ClippingGeometry")
+                if soilData is not None and 'K' not in reusedFactors:
+                    resampledSoilTemp = arcpy.sa.ApplyEnvironment(soilRas)
+                    resampledSoilTemp.save(soilResample)
+                    del resampledSoilTemp
 
-                # Delete resampled soil
-                arcpy.Delete_management(soilResample)
-            
-            if landCoverData is not None:
-                arcpy.Clip_management(lcResample, "#", landCoverClip, studyMask, clipping_geometry="ClippingGeometry")
+                    # Delete soil raster
+                    arcpy.Delete_management(soilRas)
 
-                # Delete resampled land cover
-                arcpy.Delete_management(lcResample)
+                if landCoverData is not None:
+                    resampledLCTemp = arcpy.sa.ApplyEnvironment(landCoverRas)
+                    resampledLCTemp.save(lcResample)
+                    del resampledLCTemp
 
-            if supportData is not None:
-                arcpy.Clip_management(supportResample, "#", supportClip, studyMask, clipping_geometry="ClippingGeometry")
+                    # Delete land cover raster
+                    arcpy.Delete_management(landCoverRas)
 
-                # Delete resampled support data
-                arcpy.Delete_management(supportResample)
-            
-            log.info("Inputs clipped")
+                if supportData is not None:
 
-            progress.logProgress(codeBlock, outputFolder)
+                    arcpy.CopyRaster_management(supportData, supportCopy)
+                    resampledPTemp = arcpy.sa.ApplyEnvironment(supportCopy)
+                    resampledPTemp.save(supportResample)
+                    del resampledPTemp
+
+                    # Delete support raster
+                    arcpy.Delete_management(supportCopy)
+
+                log.info("Inputs resampled")
+
+                progress.logProgress(codeBlock, outputFolder)
+
+            codeBlock = 'Clip inputs'
+            if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
+
+                log.info("Clipping inputs")
+
+                if 'R' not in reusedFactors:
+                    arcpy.Clip_management(rainResample, "#", rainClip, studyMask, clipping_geometry="ClippingGeometry")
+
+                    # Delete resampled R-factor
+                    arcpy.Delete_management(rainResample)
+
+                if soilData is not None and 'K' not in reusedFactors:
+                    arcpy.Clip_management(soilResample, "#", soilClip, studyMask, clipping_geometry="ClippingGeometry")
+
+                    # Delete resampled soil
+                    arcpy.Delete_management(soilResample)
+
+                if landCoverData is not None:
+                    arcpy.Clip_management(lcResample, "#", landCoverClip, studyMask, clipping_geometry="ClippingGeometry")
+
+                    # Delete resampled land cover
+                    arcpy.Delete_management(lcResample)
+
+                if supportData is not None:
+                    arcpy.Clip_management(supportResample, "#", supportClip, studyMask, clipping_geometry="ClippingGeometry")
+
+                    # Delete resampled support data
+                    arcpy.Delete_management(supportResample)
+
+                log.info("Inputs clipped")
+
+                progress.logProgress(codeBlock, outputFolder)
 
         codeBlock = 'Check against study area mask'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            inputs = [rainClip]
+            inputs = []
 
-            optInputs = [soilClip, landCoverClip, supportClip]
+            optInputs = [rainClip, soilClip, landCoverClip, supportClip]
             for data in optInputs:
                 if arcpy.Exists(data):
                     inputs.append(data)
 
+            # The NumPy engine resamples inputs onto the DEM grid, so the study area mask is only rasterized once
+            gridRaster = None
+            if engine == 'NumPy':
+                gridRaster = rawDEM
+
             for data in inputs:
-                dataMask = common.extractRasterMask(data)
-                common.checkCoverage(dataMask, studyMask, data)
-                del dataMask
+                study_mask.checkRasterCoverage(data, studyMask, gridRaster=gridRaster)
 
             progress.logProgress(codeBlock, outputFolder)
 
@@ -243,13 +312,31 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
         codeBlock = 'Produce R-factor layer'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            # Copy resampled raster
-            arcpy.CopyRaster_management(rainClip, rFactor)
+            if 'R' in reusedFactors and engine == 'NumPy':
+                # R-factor is read from the base product of the previous run when calculating soil loss
+                if saveFactors:
+                    reuseFactor(factorStore, 'R', rFactor, saveFactors)
+                else:
+                    log.info("R-factor reused from previous run")
 
-            # Delete clipped R-factor
-            arcpy.Delete_management(rainClip)
+            elif 'R' in reusedFactors:
+                rFactor = reuseFactor(factorStore, 'R', rFactor, saveFactors)
 
-            log.info("R-factor layer produced")
+            elif engine == 'NumPy':
+                # R-factor is read directly from the clipped rainfall erosivity layer when calculating soil loss
+                log.info("R-factor will be read from clipped rainfall erosivity layer")
+
+            else:
+                # Copy resampled raster
+                arcpy.CopyRaster_management(rainClip, rFactor)
+
+                # Delete clipped R-factor
+                arcpy.Delete_management(rainClip)
+
+                if 'R' in sharedFactors:
+                    factorStore.add('R', rFactor)
+
+                log.info("R-factor layer produced")
 
             progress.logProgress(codeBlock, outputFolder)
 
@@ -260,72 +347,55 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
         codeBlock = 'Produce LS-factor layer'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            # Calculate the threshold slope angle in percent
-            lsFactorRad = float(slopeAngle) * (math.pi / 180.0)
-            riseRun = math.tan(lsFactorRad)
-            cutoffPercent = riseRun * 100.0
-            
-            if lsOption == 'SlopeLength':
+            if 'LS' in reusedFactors and engine == 'NumPy':
+                # LS-factor is read from the base product of the previous run when calculating soil loss
+                if saveFactors:
+                    reuseFactor(factorStore, 'LS', lsFactor, saveFactors)
+                else:
+                    log.info("LS-factor reused from previous run")
 
-                log.info("Calculating LS-factor based on slope length and steepness only")
+            elif 'LS' in reusedFactors:
+                lsFactor = reuseFactor(factorStore, 'LS', lsFactor, saveFactors)
 
-                # Produce slope cutoff raster
-                DEMSlopeCutTemp = Con(Raster(DEMSlopePerc) > float(cutoffPercent), float(cutoffPercent), Raster(DEMSlopePerc))
-                DEMSlopeCutTemp.save(DEMSlopeCut)
-                del DEMSlopeCutTemp
+            elif engine == 'NumPy':
 
-                # Calculate the parts of the LS-factor equation separately
-                lsCalcA = (cellsizedem / 22.0) ** 0.5
-                lsCalcB = 0.065 + (0.045 * Raster(DEMSlopeCut)) + (0.0065 * Power(Raster(DEMSlopeCut), 2.0))
+                if lsOption == 'UpslopeArea' and reconOpt == 'false':
+                    log.error('Cannot calculate LS-factor including upslope contributing area on unreconditioned DEM')
+                    log.error('Rerun the preprocessing tool to recondition the DEM')
+                    sys.exit()
 
-                # Calculate the LS-factor
-                lsOrigTemp = lsCalcA * lsCalcB
-                lsOrigTemp.save(lsFactor)
+                # LS-factor is calculated block by block from the slope (and flow accumulation) layers when calculating soil loss
+                log.info("LS-factor will be calculated from preprocessed slope layers")
 
-                # Delete temporary files
-                del lsCalcB
-                del lsOrigTemp
-                arcpy.Delete_management(DEMSlopeCut)
-
-                log.info("LS-factor layer produced")
+            else:
 
-            elif lsOption == 'UpslopeArea':                
+                if lsOption == 'SlopeLength':
 
-                if reconOpt == 'false':
-                    log.error('Cannot calculate LS-factor including upslope contributing area on unreconditioned DEM')
-                    log.error('Rerun the preprocessing tool to recondition the DEM')
-                    sys.exit()
+                    log.info("Calculating LS-factor based on slope length and steepness only")
 
-                log.info("Calculating LS-factor including upslope contributing area")
+                    # Slope is capped at the threshold angle and the LS-factor calculated block by block
+                    lsFunction = rusle_engine.lsSlopeLengthFunction(cellsizedem, slopeAngle)
+                    raster_blocks.processBlocks(DEMSlopePerc, lsFactor, lsFunction, gridRaster=rawDEM)
 
-                # Produce slope cutoff raster
-                DEMSlopeCutTemp = Con(Raster(DEMSlope) > float(slopeAngle), float(slopeAngle), Raster(DEMSlope))
-                DEMSlopeCutTemp.save(DEMSlopeCut)
-                del DEMSlopeCutTemp
+                    log.info("LS-factor layer produced")
 
-                # Convert from degrees to radian
-                DEMSlopeRadTemp = Raster(DEMSlopeCut) * 0.01745
-                DEMSlopeRadTemp.save(DEMSlopeRad)
-                del DEMSlopeRadTemp
+                elif lsOption == 'UpslopeArea':                
 
-                # Currently hardcoded, but should have them as options in future
-                m = 0.5
-                n = 1.2
+                    if reconOpt == 'false':
+                        log.error('Cannot calculate LS-factor including upslope contributing area on unreconditioned DEM')
+                        log.error('Rerun the preprocessing tool to recondition the DEM')
+                        sys.exit()
 
-                upslopeAreaTemp = Raster(hydFAC) * float(cellsizedem)
-                upslopeAreaTemp.save(upslopeArea)
-                del upslopeAreaTemp
+                    log.info("Calculating LS-factor including upslope contributing area")
 
-                lsFactorTemp = (m + 1) * Power(Raster(upslopeArea) / 22.1, float(m)) * Power(Sin(Raster(DEMSlopeRad)) / 0.09, float(n))
-                lsFactorTemp.save(lsFactor)
-                del lsFactorTemp
+                    # Upslope area and slope (capped at the threshold angle) are combined block by block
+                    lsFunction = rusle_engine.lsUpslopeAreaFunction(cellsizedem, slopeAngle, m, n)
+                    raster_blocks.processBlocks([hydFAC, DEMSlope], lsFactor, lsFunction, gridRaster=rawDEM)
 
-                # Delete temporary files
-                arcpy.Delete_management(DEMSlopeCut)
-                arcpy.Delete_management(DEMSlopeRad)
-                arcpy.Delete_management(upslopeArea)
+                    log.info("LS-factor layer produced")
 
-                log.info("LS-factor layer produced")
+                if 'LS' in sharedFactors:
+                    factorStore.add('LS', lsFactor)
 
             progress.logProgress(codeBlock, outputFolder)
 
@@ -336,24 +406,32 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
         codeBlock = 'Produce K-factor layer'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
         
-            if soilOption == 'PreprocessSoil':
+            if 'K' in reusedFactors and engine == 'NumPy':
+                # K-factor is read from the base product of the previous run when calculating soil loss
+                if saveFactors:
+                    reuseFactor(factorStore, 'K', kFactor, saveFactors)
+                else:
+                    log.info("K-factor reused from previous run")
 
-                # Use the soil from the preprocessFolder
-                arcpy.CopyRaster_management(inputSoil, soilClip)
+            elif 'K' in reusedFactors:
+                kFactor = reuseFactor(factorStore, 'K', kFactor, saveFactors)
 
-                kTable = os.path.join(configuration.tablesPath, "rusle_hwsd.dbf")
-                arcpy.JoinField_management(soilClip, "VALUE", kTable, "MU_GLOBAL")
-                arcpy.CopyRaster_management(soilClip, soilJoin)
+            elif soilOption == 'PreprocessSoil':
 
-                # Delete temporary files
-                arcpy.Delete_management(soilClip)
+                # Use the soil from the preprocessFolder, with K-factor values looked up from the soil codes
+                kLookup = kFactorLookup()
+                rusle_engine.reportUnmappedCodes(inputSoil, kLookup, 'K-factor')
 
-                kOrigTemp = Lookup(soilJoin, "K_Stewart")
-                kOrigTemp.save(kFactor)
+                if engine == 'NumPy':
+                    # K-factor is looked up block by block when calculating soil loss
+                    log.info("K-factor will be looked up from preprocessed soil layer")
+                else:
+                    raster_blocks.processBlocks(inputSoil, kFactor, rusle_engine.lookupFunction(kLookup))
 
-                # Delete temporary files
-                del kOrigTemp
-                arcpy.Delete_management(soilJoin)
+            elif soilOption == 'LocalSoil' and engine == 'NumPy':
+
+                # User input is their own K-factor dataset, read directly when calculating soil loss
+                pass
 
             elif soilOption == 'LocalSoil':
 
@@ -368,6 +446,9 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
             else:
                 log.error('Invalid soil erodibility option')
                 sys.exit()
+
+            if 'K' in sharedFactors and engine != 'NumPy':
+                factorStore.add('K', kFactor)
             
             log.info("K-factor layer produced")
 
@@ -382,23 +463,20 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
 
             if lcOption == 'PrerocessLC':
 
-                # Use LC from the preprocess folder
+                # Use LC from the preprocess folder, with C-factor values looked up from the land cover codes
+                cLookup = cFactorLookup()
+                rusle_engine.reportUnmappedCodes(inputLC, cLookup, 'C-factor')
 
-                arcpy.CopyRaster_management(inputLC, landCoverClip)
-
-                cTable = os.path.join(configuration.tablesPath, "rusle_esacci.dbf")
-
-                arcpy.JoinField_management(landCoverClip, "VALUE", cTable, "LC_CODE")
-                arcpy.CopyRaster_management(landCoverClip, lcJoin)
-
-                arcpy.Delete_management(landCoverClip)
+                if engine == 'NumPy':
+                    # C-factor is looked up block by block when calculating soil loss
+                    log.info("C-factor will be looked up from preprocessed land cover layer")
+                else:
+                    raster_blocks.processBlocks(inputLC, cFactor, rusle_engine.lookupFunction(cLookup))
 
-                cOrigTemp = Lookup(lcJoin, "CFACTOR")
-                cOrigTemp.save(cFactor)
+            elif lcOption == 'LocalCfactor' and engine == 'NumPy':
 
-                # Delete temporary files
-                del cOrigTemp                
-                arcpy.Delete_management(lcJoin)
+                # User input is their own C-factor dataset, read directly when calculating soil loss
+                pass
 
             elif lcOption == 'LocalCfactor':
 
@@ -426,7 +504,11 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
         codeBlock = 'Produce P-factor layer'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            if supportData is not None:
+            if supportData is not None and engine == 'NumPy':
+                # P-factor is read directly from the clipped support practice layer when calculating soil loss
+                log.info("P-factor will be read from clipped support practice layer")
+
+            elif supportData is not None:
                 arcpy.CopyRaster_management(supportClip, pFactor)
                 log.info("P-factor layer produced")
 
@@ -442,18 +524,148 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
         codeBlock = 'Produce soil loss layer'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            if supportData is not None:
-                soilLossTemp = Raster(rFactor) * Raster(lsFactor) * Raster(kFactor) * Raster(cFactor) * Raster(pFactor)
+            if engine == 'NumPy':
 
-            else:
-                soilLossTemp = Raster(rFactor) * Raster(lsFactor) * Raster(kFactor) * Raster(cFactor)
+                def savedFactor(factorRaster):
+                    # Factor layers are only written if they are to be saved
+                    if saveFactors:
+                        return factorRaster
+                    else:
+                        return None
 
-            if lsOption == 'UpslopeArea':
-                soilLossTemp = soilLossTemp * Raster(streamInvRas)
-                soilLossTemp.save(soilLoss)
+                factors = [rusle_engine.FactorSource('R', rainClip, outRaster=savedFactor(rFactor))]
+
+                if lsOption == 'SlopeLength':
+                    lsFunction = rusle_engine.lsSlopeLengthFunction(cellsizedem, slopeAngle)
+                    factors.append(rusle_engine.FactorSource('LS', DEMSlopePerc, lsFunction, savedFactor(lsFactor)))
+
+                elif lsOption == 'UpslopeArea':
+                    lsFunction = rusle_engine.lsUpslopeAreaFunction(cellsizedem, slopeAngle, m, n)
+                    factors.append(rusle_engine.FactorSource('LS', [hydFAC, DEMSlope], lsFunction, savedFactor(lsFactor)))
+
+                if 'K' in reusedFactors:
+                    # K-factor is read from the base product of the previous run
+                    pass
+
+                elif soilOption == 'PreprocessSoil':
+                    # The lookup table is only loaded here if the K-factor step was completed by an earlier run of the tool
+                    if kLookup is None:
+                        kLookup = kFactorLookup()
+
+                    factors.append(rusle_engine.FactorSource('K', inputSoil, rusle_engine.lookupFunction(kLookup), savedFactor(kFactor)))
+
+                else:
+                    factors.append(rusle_engine.FactorSource('K', soilClip, outRaster=savedFactor(kFactor)))
+
+                if lcOption == 'PrerocessLC':
+                    # The lookup table is only loaded here if the C-factor step was completed by an earlier run of the tool
+                    if cLookup is None:
+                        cLookup = cFactorLookup()
+
+                    factors.append(rusle_engine.FactorSource('C', inputLC, rusle_engine.lookupFunction(cLookup), savedFactor(cFactor)))
+
+                else:
+                    factors.append(rusle_engine.FactorSource('C', landCoverClip, outRaster=savedFactor(cFactor)))
+
+                if supportData is not None:
+                    factors.append(rusle_engine.FactorSource('P', supportClip, outRaster=savedFactor(pFactor)))
+
+                if lsOption == 'UpslopeArea':
+                    factors.append(rusle_engine.FactorSource('stream', streamInvRas))
+
+                baseNames = None
+                baseFile = None
+
+                if len(sharedFactors) > 0:
+
+                    # The stream network is fixed by the terrain, so is shared along with the LS-factor
+                    baseNames = list(sharedFactors)
+                    if 'LS' in baseNames:
+                        baseNames.append('stream')
+
+                    if len(reusedFactors) > 0:
+                        # Shared factors are read from the base product of the previous run
+                        baseFactor = rusle_engine.FactorSource('base', [], arrayFile=factorStore.getArray('base'))
+                        factors = [baseFactor] + [factor for factor in factors if factor.name not in baseNames]
+
+                    elif factorStore.getArray('base') is None:
+                        # Shared factors are multiplied together into a base product in the same pass, for later runs
+                        baseFile = factorStore.arrayFilename('base')
+                        log.info('Keeping product of ' + ', '.join(sharedFactors) + ' factors for later runs')
+
+                rusle_engine.fusedSoilLoss(rawDEM, factors, soilLoss, numWorkers=numWorkers, baseNames=baseNames, baseFile=baseFile)
+
+                if baseFile is not None:
+                    factorStore.addArray('base', baseFile)
+
+                    # Saved factor layers are copied by later runs rather than calculated again
+                    if saveFactors:
+                        for name, factorRaster in [('R', rFactor), ('LS', lsFactor), ('K', kFactor)]:
+                            if name in sharedFactors:
+                                factorStore.add(name, factorRaster)
+
+                # Delete temporary files
+                tempFiles = [rainClip, soilClip, landCoverClip, supportClip]
+                for tempFile in tempFiles:
+                    if arcpy.Exists(tempFile):
+                        arcpy.Delete_management(tempFile)
+
+            elif len(sharedFactors) > 0:
+
+                factorRasters = [('R', rFactor), ('LS', lsFactor), ('K', kFactor), ('C', cFactor)]
+
+                if supportData is not None:
+                    factorRasters.append(('P', pFactor))
+
+                if lsOption == 'UpslopeArea':
+                    factorRasters.append(('stream', streamInvRas))
+
+                # The stream network is fixed by the terrain, so is shared along with the LS-factor
+                baseNames = list(sharedFactors)
+                if 'LS' in baseNames:
+                    baseNames.append('stream')
+
+                # Shared factors are multiplied together once into a base layer, reused by later runs
+                baseRaster = factorStore.get('base')
+                if baseRaster is None:
+                    baseRaster = factorStore.tempRaster('base')
+
+                    baseTemp = None
+                    for name, factorRaster in factorRasters:
+                        if name in baseNames:
+                            baseTemp = Raster(factorRaster) if baseTemp is None else baseTemp * Raster(factorRaster)
+
+                    baseTemp.save(baseRaster)
+                    del baseTemp
+
+                    factorStore.add('base', baseRaster)
+                    log.info('Keeping product of ' + ', '.join(sharedFactors) + ' factors for later runs')
+
+                else:
+                    log.info('Using product of ' + ', '.join(sharedFactors) + ' factors from previous run')
+
+                soilLossTemp = Raster(baseRaster)
+                for name, factorRaster in factorRasters:
+                    if name not in baseNames:
+                        soilLossTemp = soilLossTemp * Raster(factorRaster)
 
-            else:           
                 soilLossTemp.save(soilLoss)
+                del soilLossTemp
+
+            else:
+
+                if supportData is not None:
+                    soilLossTemp = Raster(rFactor) * Raster(lsFactor) * Raster(kFactor) * Raster(cFactor) * Raster(pFactor)
+
+                else:
+                    soilLossTemp = Raster(rFactor) * Raster(lsFactor) * Raster(kFactor) * Raster(cFactor)
+
+                if lsOption == 'UpslopeArea':
+                    soilLossTemp = soilLossTemp * Raster(streamInvRas)
+                    soilLossTemp.save(soilLoss)
+
+                else:           
+                    soilLossTemp.save(soilLoss)
 
             log.info("RUSLE function completed successfully")
 
@@ -473,3 +685,114 @@ def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, s
                 exec(lyr + ' = None') in locals()
         except Exception:
             pass
+
+
+def kFactorLookup():
+
+    ''' Loads the lookup table from HWSD soil codes to K-factor values '''
+
+    kTable = os.path.join(configuration.tablesPath, "rusle_hwsd.dbf")
+
+    return rusle_engine.loadLookupTable(kTable, "MU_GLOBAL", "K_Stewart")
+
+
+def cFactorLookup():
+
+    ''' Loads the lookup table from ESA CCI land cover codes to C-factor values '''
+
+    cTable = os.path.join(configuration.tablesPath, "rusle_esacci.dbf")
+
+    return rusle_engine.loadLookupTable(cTable, "LC_CODE", "CFACTOR")
+
+
+def reuseFactor(factorStore, name, factorRaster, saveFactors):
+
+    '''
+    Returns the layer to use for a factor shared with a previous run.
+    If factor layers are being saved, the previous run's layer is copied to this run's factor layer (unless they are
+    the same layer), so that each run's saved factors are complete. Otherwise the previous run's layer is used.
+    '''
+
+    storedRaster = factorStore.get(name)
+
+    if saveFactors and os.path.normcase(os.path.abspath(storedRaster)) != os.path.normcase(os.path.abspath(factorRaster)):
+        arcpy.CopyRaster_management(storedRaster, factorRaster)
+        log.info(name + "-factor copied from previous run")
+
+        return factorRaster
+
+    log.info(name + "-factor reused from previous run")
+
+    return storedRaster
+
+
+def functionInProcess(scratchFolder, args, kwargs):
+
+    '''
+    Runs the RUSLE function in a worker process, with its own scratch geodatabase in scratchFolder.
+    args are the arguments of the RUSLE function, starting with the output folder, which also holds the log file.
+    '''
+
+    try:
+        log.setupLogging(args[0])
+        raster_parallel.setupProcessWorkspace(scratchFolder)
+
+        function(*args, **kwargs)
+
+    except (Exception, SystemExit):
+        # Errors are recorded in the log file, and the exit code tells the parent process the run failed
+        log.error(traceback.format_exc())
+        sys.exit(1)
+
+
+def runConcurrently(outputFolder, runs, numWorkers=None):
+
+    '''
+    Runs the RUSLE function for each of the runs at the same time, each in its own process.
+
+    runs is a list of (name, args, kwargs), where args are the arguments of the RUSLE function after the output folder.
+    Each run writes its outputs and log to a subfolder of outputFolder named after the run, and has its own scratch
+    geodatabase, so the temporary files of the runs do not collide. Returns the soil loss layer of each run.
+    '''
+
+    try:
+        if numWorkers is None:
+            numWorkers = raster_parallel.getNumWorkers()
+
+        # The worker processes for tile parallelism are shared between the runs
+        runWorkers = max(1, numWorkers // len(runs))
+
+        processArgs = []
+        runFolders = []
+        soilLossRasters = []
+
+        for name, args, kwargs in runs:
+
+            runFolder = os.path.join(outputFolder, name)
+            if not os.path.exists(runFolder):
+                os.mkdir(runFolder)
+
+            runScratch = os.path.join(os.path.dirname(os.path.dirname(arcpy.env.scratchGDB)), 'scratch_' + name)
+
+            kwargs = dict(kwargs)
+            kwargs['numWorkers'] = runWorkers
+
+            processArgs.append((runScratch, [runFolder] + list(args), kwargs))
+            runFolders.append(runFolder)
+            soilLossRasters.append(common.getFilenames('rusle', runFolder).soilloss)
+
+        log.info('Running RUSLE function for ' + ', '.join([run[0] for run in runs]) + ' concurrently')
+        log.info('Progress of each run is logged in the logs folder of its output subfolder')
+
+        exitCodes = raster_parallel.runProcesses(functionInProcess, processArgs)
+
+        for run, runFolder, exitCode in zip(runs, runFolders, exitCodes):
+            if exitCode != 0:
+                log.error('RUSLE function failed for ' + run[0] + '. See the log file in ' + os.path.join(runFolder, 'logs'))
+                raise RuntimeError('RUSLE function failed for ' + run[0])
+
+        return soilLossRasters
+
+    except Exception:
+        log.error("Concurrent RUSLE runs failed")
+        raise
@@ -11,13 +11,15 @@ from arcpy.sa import *
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.common as common
 from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
+import NB_SEEA_ESRI.lib.rusle_engine as rusle_engine
 import NB_SEEA_ESRI.solo.RUSLE as RUSLE
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log, common, RUSLE])
+refresh_modules([log, common, rusle_engine, RUSLE])
 
 def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, rData, soilData, soilCode,
-             YearALCData, YearALCCode, YearBLCData, YearBLCCode, YearAPData, YearBPData, saveFactors):
+             YearALCData, YearALCCode, YearBLCData, YearBLCCode, YearAPData, YearBPData, saveFactors,
+             concurrent=False):
 
     try:
         # Set temporary variables
@@ -25,10 +27,6 @@ def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, rData
 
         clipA = prefix + "clipA"
         clipB = prefix + "clipB"
-        lossA = prefix + "lossA"
-        lossB = prefix + "lossB"
-        diffLoss = prefix + "diffLoss"
-        diffNullZero = prefix + "diffNullZero"
 
         # Set output filenames
         soilLossA = os.path.join(outputFolder, "soillossA")
@@ -41,49 +39,75 @@ def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, rData
         # Set LC option for both years
         lcOption = 'LocalCfactor'
         
-        ################################
-        ### Running RUSLE for Year A ###
-        ################################
-
-        log.info('*****************************')
-        log.info('Running RUSLE tool for Year A')
-        log.info('*****************************')
-
-        filesA = common.getFilenames('preprocess', yearAFolder)
-        studyMaskA = filesA.studyareamask
-
-        # Call RUSLE function for Year A        
-        soilLoss = RUSLE.function(outputFolder, yearAFolder, lsOption, slopeAngle,
-                                  soilOption, soilData, soilCode,
-                                  lcOption, YearALCData, YearALCCode,
-                                  rData, saveFactors, YearAPData)
-        
-        arcpy.CopyRaster_management(soilLoss, soilLossA)
+        # Arguments of the RUSLE function (after the output folder) for each year
+        argsA = [yearAFolder, lsOption, slopeAngle, soilOption, soilData, soilCode,
+                 lcOption, YearALCData, YearALCCode, rData, saveFactors, YearAPData]
+        argsB = [yearBFolder, lsOption, slopeAngle, soilOption, soilData, soilCode,
+                 lcOption, YearBLCData, YearBLCCode, rData, saveFactors, YearBPData]
+
+        # Factors which are the same for both years are calculated for Year A and reused for Year B
+        # Rainfall erosivity and soil inputs are the same for both years
+        sharedFactors = rusle_engine.invariantFactors(yearAFolder, yearBFolder, sameRainfall=True, sameSoil=True)
+
+        # If set in the user settings, the years are run at the same time in separate processes
+        if concurrent:
+
+            log.info('**************************************************')
+            log.info('Running RUSLE tool for Year A and Year B concurrently')
+            log.info('**************************************************')
+
+            # Each process calculates all of its factors, so none are shared between the years
+            if len(sharedFactors) > 0:
+                log.info('Factors ' + ', '.join(sharedFactors) + ' are calculated for each year when running concurrently')
+
+            soilLossRasters = RUSLE.runConcurrently(outputFolder, [('YearA', argsA, {}), ('YearB', argsB, {})])
+
+            arcpy.CopyRaster_management(soilLossRasters[0], soilLossA)
+            arcpy.CopyRaster_management(soilLossRasters[1], soilLossB)
+
+            # Delete intermediate files
+            for soilLoss in soilLossRasters:
+                arcpy.Delete_management(soilLoss)
 
-        # Delete intermediate files
-        arcpy.Delete_management(soilLoss)
+        else:
 
-        ################################
-        ### Running RUSLE for Year B ###
-        ################################
+            factorStore = rusle_engine.FactorStore(sharedFactors, prefix)
 
-        log.info('*****************************')
-        log.info('Running RUSLE tool for Year B')
-        log.info('*****************************')
+            if len(sharedFactors) > 0:
+                log.info('Factors shared between Year A and Year B: ' + ', '.join(sharedFactors))
 
-        filesB = common.getFilenames('preprocess', yearBFolder)
-        studyMaskB = filesB.studyareamask
+            ################################
+            ### Running RUSLE for Year A ###
+            ################################
 
-        # Call RUSLE function for Year B
-        soilLoss = RUSLE.function(outputFolder, yearBFolder, lsOption, slopeAngle,
-                                  soilOption, soilData, soilCode,
-                                  lcOption, YearBLCData, YearBLCCode,
-                                  rData, saveFactors, YearBPData)
+            log.info('*****************************')
+            log.info('Running RUSLE tool for Year A')
+            log.info('*****************************')
 
-        arcpy.CopyRaster_management(soilLoss, soilLossB)
+            # Call RUSLE function for Year A
+            soilLoss = RUSLE.function(outputFolder, *argsA, factorStore=factorStore)
 
-        # Delete intermediate files
-        arcpy.Delete_management(soilLoss)
+            arcpy.CopyRaster_management(soilLoss, soilLossA)
+
+            # Delete intermediate files
+            arcpy.Delete_management(soilLoss)
+
+            ################################
+            ### Running RUSLE for Year B ###
+            ################################
+
+            log.info('*****************************')
+            log.info('Running RUSLE tool for Year B')
+            log.info('*****************************')
+
+            # Call RUSLE function for Year B
+            soilLoss = RUSLE.function(outputFolder, *argsB, factorStore=factorStore)
+
+            arcpy.CopyRaster_management(soilLoss, soilLossB)
+
+            # Delete intermediate files
+            arcpy.Delete_management(soilLoss)
+            factorStore.clear()
 
         #######################################################
         ### Calculate differences between Year A and Year B ###
@@ -93,20 +117,12 @@ def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, rData
         log.info('Calculating differences between Year A and Year B')
         log.info('*************************************************')
 
-        # Copy soil loss layers to temporary files
-        arcpy.CopyRaster_management(soilLossA, lossA)
-        arcpy.CopyRaster_management(soilLossB, lossB)
-
-        diffTemp = Raster(lossB) - Raster(lossA)
-        diffTemp.save(diffLoss)
-        del diffTemp
-
-        log.info('Removing the areas of zero difference')
-        diffNullTemp = SetNull(diffLoss, diffLoss, "VALUE = 0")
-        diffNullTemp.save(diffNullZero)
-        del diffNullTemp
+        # Difference is calculated block by block, with the areas of zero difference removed in the same pass
+        totals = rusle_engine.soilLossDifference(soilLossA, soilLossB, soilLossDiff)
 
-        arcpy.CopyRaster_management(diffNullZero, soilLossDiff)
+        log.info('Total increase in soil loss: ' + str(round(totals['gain'], 2)) + ' tons/yr')
+        log.info('Total decrease in soil loss: ' + str(round(-totals['loss'], 2)) + ' tons/yr')
+        log.info('Net change in soil loss: ' + str(round(totals['net'], 2)) + ' tons/yr')
 
         log.info("RUSLE accounts function completed successfully")
 
@@ -11,12 +11,13 @@ from arcpy.sa import *
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.common as common
 from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
+import NB_SEEA_ESRI.lib.rusle_engine as rusle_engine
 import NB_SEEA_ESRI.solo.RUSLE as RUSLE
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log, common, RUSLE])
+refresh_modules([log, common, rusle_engine, RUSLE])
 
-def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, yearARain, yearBRain, yearASupport, yearBSupport):
+def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, yearARain, yearBRain, yearASupport, yearBSupport, concurrent=False):
 
     try:
         # Set temporary variables
@@ -24,10 +25,6 @@ def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, yearA
 
         clipA = prefix + "clipA"
         clipB = prefix + "clipB"
-        lossA = prefix + "lossA"
-        lossB = prefix + "lossB"
-        diffLoss = prefix + "diffLoss"
-        diffNullZero = prefix + "diffNullZero"
 
         # Set output filenames
         soilLossA = os.path.join(outputFolder, "soillossA")
@@ -46,47 +43,77 @@ def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, yearA
         landCoverData = None
         landCoverCode = ''
 
-        ################################
-        ### Running RUSLE for Year A ###
-        ################################
+        # Arguments of the RUSLE function (after the output folder) for each year
+        argsA = [yearAFolder, lsOption, slopeAngle, soilOption, soilData, soilCode,
+                 lcOption, landCoverData, landCoverCode, yearARain, saveFactors, yearASupport]
+        argsB = [yearBFolder, lsOption, slopeAngle, soilOption, soilData, soilCode,
+                 lcOption, landCoverData, landCoverCode, yearBRain, saveFactors, yearBSupport]
 
-        log.info('*****************************')
-        log.info('Running RUSLE tool for Year A')
-        log.info('*****************************')
+        # Factors which are the same for both years are calculated for Year A and reused for Year B
+        # Rainfall erosivity may differ between years, and soil comes from each year's preprocessing folder
+        sameRainfall = (yearARain == yearBRain)
+        sameSoil = rusle_engine.samePreprocessInputs(yearAFolder, yearBFolder, rusle_engine.soilInputs)
+        sharedFactors = rusle_engine.invariantFactors(yearAFolder, yearBFolder, sameRainfall, sameSoil)
 
-        filesA = common.getFilenames('preprocess', yearAFolder)
-        studyMaskA = filesA.studyareamask
+        # If set in the user settings, the years are run at the same time in separate processes
+        if concurrent:
 
-        # Call RUSLE function for Year A        
-        soilLoss = RUSLE.function(outputFolder, yearAFolder, lsOption, slopeAngle, soilOption,
-                                  soilData, soilCode, lcOption, landCoverData,
-                                  landCoverCode, yearARain, saveFactors, yearASupport)
+            log.info('**************************************************')
+            log.info('Running RUSLE tool for Year A and Year B concurrently')
+            log.info('**************************************************')
 
-        arcpy.CopyRaster_management(soilLoss, soilLossA)
+            # Each process calculates all of its factors, so none are shared between the years
+            if len(sharedFactors) > 0:
+                log.info('Factors ' + ', '.join(sharedFactors) + ' are calculated for each year when running concurrently')
 
-        # Delete intermediate files
-        arcpy.Delete_management(soilLoss)
+            soilLossRasters = RUSLE.runConcurrently(outputFolder, [('YearA', argsA, {}), ('YearB', argsB, {})])
 
-        ################################
-        ### Running RUSLE for Year B ###
-        ################################
+            arcpy.CopyRaster_management(soilLossRasters[0], soilLossA)
+            arcpy.CopyRaster_management(soilLossRasters[1], soilLossB)
 
-        log.info('*****************************')
-        log.info('Running RUSLE tool for Year B')
-        log.info('*****************************')
+            # Delete intermediate files
+            for soilLoss in soilLossRasters:
+                arcpy.Delete_management(soilLoss)
 
-        filesB = common.getFilenames('preprocess', yearBFolder)
-        studyMaskB = filesB.studyareamask
+        else:
 
-        # Call RUSLE function for Year B
-        soilLoss = RUSLE.function(outputFolder, yearBFolder, lsOption, slopeAngle, soilOption,
-                                  soilData, soilCode, lcOption, landCoverData,
-                                  landCoverCode, yearBRain, saveFactors, yearBSupport)
+            factorStore = rusle_engine.FactorStore(sharedFactors, prefix)
 
-        arcpy.CopyRaster_management(soilLoss, soilLossB)
+            if len(sharedFactors) > 0:
+                log.info('Factors shared between Year A and Year B: ' + ', '.join(sharedFactors))
 
-        # Delete intermediate files
-        arcpy.Delete_management(soilLoss)
+            ################################
+            ### Running RUSLE for Year A ###
+            ################################
+
+            log.info('*****************************')
+            log.info('Running RUSLE tool for Year A')
+            log.info('*****************************')
+
+            # Call RUSLE function for Year A
+            soilLoss = RUSLE.function(outputFolder, *argsA, factorStore=factorStore)
+
+            arcpy.CopyRaster_management(soilLoss, soilLossA)
+
+            # Delete intermediate files
+            arcpy.Delete_management(soilLoss)
+
+            ################################
+            ### Running RUSLE for Year B ###
+            ################################
+
+            log.info('*****************************')
+            log.info('Running RUSLE tool for Year B')
+            log.info('*****************************')
+
+            # Call RUSLE function for Year B
+            soilLoss = RUSLE.function(outputFolder, *argsB, factorStore=factorStore)
+
+            arcpy.CopyRaster_management(soilLoss, soilLossB)
+
+            # Delete intermediate files
+            arcpy.Delete_management(soilLoss)
+            factorStore.clear()
 
         #######################################################
         ### Calculate differences between Year A and Year B ###
@@ -96,20 +123,12 @@ def function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle, yearA
         log.info('Calculating differences between Year A and Year B')
         log.info('*************************************************')
 
-        # Copy soil loss layers to temporary files
-        arcpy.CopyRaster_management(soilLossA, lossA)
-        arcpy.CopyRaster_management(soilLossB, lossB)
-
-        diffTemp = Raster(lossB) - Raster(lossA)
-        diffTemp.save(diffLoss)
-        del diffTemp
-
-        log.info('Removing the areas of zero difference')
-        diffNullTemp = SetNull(diffLoss, diffLoss, "VALUE = 0")
-        diffNullTemp.save(diffNullZero)
-        del diffNullTemp
+        # Difference is calculated block by block, with the areas of zero difference removed in the same pass
+        totals = rusle_engine.soilLossDifference(soilLossA, soilLossB, soilLossDiff)
 
-        arcpy.CopyRaster_management(diffNullZero, soilLossDiff)
+        log.info('Total increase in soil loss: ' + str(round(totals['gain'], 2)) + ' tons/yr')
+        log.info('Total decrease in soil loss: ' + str(round(-totals['loss'], 2)) + ' tons/yr')
+        log.info('Net change in soil loss: ' + str(round(totals['net'], 2)) + ' tons/yr')
 
         log.info("RUSLE accounts function completed successfully")
 
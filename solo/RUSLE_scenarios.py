@@ -0,0 +1,123 @@
+'''
+NB RUSLE scenarios function
+'''
+
+import sys
+import os
+import re
+import csv
+import configuration
+import arcpy
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.progress as progress
+import NB_SEEA_ESRI.lib.rusle_engine as rusle_engine
+from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
+import NB_SEEA_ESRI.solo.RUSLE as RUSLE
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, progress, rusle_engine, RUSLE])
+
+def function(outputFolder, preprocessFolder, lsOption, slopeAngle, soilOption, soilData, soilCode, rData, scenarios):
+
+    '''
+    Calculates soil loss for a batch of land cover and support practice scenarios on the same catchment.
+
+    scenarios is a list of (name, landCoverData, supportData) tuples. If landCoverData is None, the scenario
+    uses the preprocessed land cover. If supportData is None, the scenario has no P-factor.
+
+    The R-, LS- and K-factors are the same for every scenario, so they are multiplied together once into a base
+    layer, held as a memory-mapped array by the NumPy soil loss engine or as a raster by the ArcPy engine.
+    Each scenario then only prepares its C- and P-factors and multiplies them with the base. Each scenario's soil loss layer is written to a subfolder of outputFolder
+    named after the scenario, and a summary row for each scenario is written to RUSLE_scenarios.csv.
+    '''
+
+    try:
+        # Set temporary variables
+        prefix = os.path.join(arcpy.env.scratchGDB, "rusleScen_")
+
+        # Set output filenames
+        summaryTable = os.path.join(outputFolder, "RUSLE_scenarios.csv")
+
+        if len(scenarios) == 0:
+            log.error('No scenarios have been given')
+            sys.exit()
+
+        # Check scenario names are unique once converted to folder names
+        scenarioFolders = []
+        for name, landCoverData, supportData in scenarios:
+
+            scenarioFolder = os.path.join(outputFolder, re.sub(r'[^A-Za-z0-9_]', '_', name))
+
+            if scenarioFolder in scenarioFolders:
+                log.error('Scenario name ' + str(name) + ' is not unique')
+                sys.exit()
+
+            scenarioFolders.append(scenarioFolder)
+
+        factorStore = rusle_engine.FactorStore(['R', 'LS', 'K'], prefix)
+
+        summaryRows = []
+
+        try:
+            for (name, landCoverData, supportData), scenarioFolder in zip(scenarios, scenarioFolders):
+
+                log.info('*****************************************')
+                log.info('Calculating soil loss for scenario ' + str(name))
+                log.info('*****************************************')
+
+                if not os.path.exists(scenarioFolder):
+                    os.mkdir(scenarioFolder)
+
+                progress.initProgress(scenarioFolder, False)
+
+                if landCoverData is None:
+                    lcOption = 'PrerocessLC'
+                else:
+                    lcOption = 'LocalCfactor'
+
+                # The first scenario also calculates the R.LS.K base, which later scenarios reuse
+                soilLoss = RUSLE.function(scenarioFolder, preprocessFolder, lsOption, slopeAngle,
+                                          soilOption, soilData, soilCode,
+                                          lcOption, landCoverData, '',
+                                          rData, False, supportData,
+                                          factorStore=factorStore)
+
+                summary = rusle_engine.summariseRaster(soilLoss)
+
+                summaryRows.append([name, landCoverData or 'Preprocessed land cover', supportData or '',
+                                    summary['count'], summary['mean'], summary['max'], summary['total']])
+
+                log.info('Soil loss calculated for scenario ' + str(name))
+
+        finally:
+            factorStore.clear()
+
+        ####################################
+        ### Write scenario summary table ###
+        ####################################
+
+        headings = ['Scenario', 'C-factor dataset', 'P-factor dataset', 'Cells',
+                    'Mean soil loss (tons/ha/yr)', 'Maximum soil loss (tons/ha/yr)', 'Total soil loss (tons/yr)']
+
+        if six.PY2:
+            csv_file = open(summaryTable, 'wb')
+        else:
+            csv_file = open(summaryTable, 'w', newline='')
+
+        with csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(headings)
+
+            for row in summaryRows:
+                writer.writerow(row)
+
+        log.info('Scenario summary table created')
+
+        log.info("RUSLE scenarios function completed successfully")
+
+        return summaryTable
+
+    except Exception:
+        arcpy.AddError("RUSLE scenarios function failed")
+        raise
@@ -11,21 +11,42 @@ import stat
 import math
 import configuration
 import sys
+import numpy as np
 
 import NB_SEEA_ESRI.lib.progress as progress
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.common as common
 import NB_SEEA_ESRI.solo.reconditionDEM as reconditionDEM
 import NB_SEEA_ESRI.lib.baseline as baseline
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+import NB_SEEA_ESRI.lib.hydrology_engine as hydrology_engine
+import NB_SEEA_ESRI.lib.streams as streams_lib
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log, common, reconditionDEM, baseline])
+refresh_modules([log, common, reconditionDEM, baseline, raster_blocks, hydrology_engine, streams_lib])
 
 
 def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAccThresh,
-             smoothDropBuffer, smoothDrop, streamDrop, reconDEM, rerun=False):
+             smoothDropBuffer, smoothDrop, streamDrop, reconDEM, rerun=False, engine=None, displayLayers=True):
+
+    '''
+    Generates the hydrological and topographical layers from the DEM.
+
+    engine chooses the hydrology engine (ArcPy or NumPy) and defaults to the user setting.
+    displayLayers controls whether layers used only for display (such as flow direction in degrees) are produced.
+    '''
 
     try:
+        # Hydrology engine (ArcPy uses the Spatial Analyst tools, NumPy uses hydrology_engine)
+        if engine is None:
+            engine = common.getUserSetting('hydrologyEngine', 'ArcPy')
+
+        if engine not in ['ArcPy', 'NumPy']:
+            log.error('Invalid hydrology engine ' + str(engine) + '. Should be ArcPy or NumPy.')
+            sys.exit()
+
+        log.info('Hydrology engine: ' + engine)
+
         # Set environment variables
         arcpy.env.compression = "None"
         arcpy.env.snapRaster = DEM
@@ -59,18 +80,20 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
 
         prefix = os.path.join(arcpy.env.scratchGDB, "base_")
 
-        cellSizeDEM = float(arcpy.env.cellSize)
+        # DEMs larger than the memory budget are processed block by block (or tile by tile) with hydrology_engine,
+        # whichever hydrology engine is set. Flow direction and stream features then use the Spatial Analyst tools.
+        tiled = not raster_blocks.fitsInBudget(raster_blocks.RasterGrid(DEM))
+        if tiled:
+            log.info('DEM is larger than the memory budget. Processing in tiles.')
+
+        blockwise = tiled or engine == 'NumPy'
 
         burnedDEM = prefix + "burnedDEM"
-        streamAccHaFile = prefix + "streamAccHa"
         rawFDR = prefix + "rawFDR"        
         allPolygonSinks = prefix + "allPolygonSinks"
         DEMTemp = prefix + "DEMTemp"
         hydFACTemp = prefix + "hydFACTemp"
 
-        # Saved as .tif as did not save as ESRI grid on server
-        streamsRasterFile = os.path.join(arcpy.env.scratchFolder, "base_") + "StreamsRaster.tif"
-
         ###############################
         ### Save DEM to base folder ###
         ###############################
@@ -103,15 +126,27 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
         codeBlock = 'Create multiplier raster'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            Reclassify(rawDEM, "Value", RemapRange([[-999999.9, 999999.9, 1]]), "NODATA").save(multRaster)
+            if tiled:
+                def multBlock(dem):
+                    return np.where(np.isnan(dem), 255, 1)
+
+                raster_blocks.processBlocks(rawDEM, multRaster, multBlock, dtype=np.uint8, noDataValue=255)
+
+            else:
+                Reclassify(rawDEM, "Value", RemapRange([[-999999.9, 999999.9, 1]]), "NODATA").save(multRaster)
+
             progress.logProgress(codeBlock, outputFolder)
         
         codeBlock = 'Calculate slope in percent'
         if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-            intSlopeRawPer = Slope(rawDEM, "PERCENT_RISE")
-            intSlopeRawPer.save(slopeRawPer)
-            del intSlopeRawPer
+            if blockwise:
+                hydrology_engine.slopeRasters(rawDEM, outPercent=slopeRawPer)
+
+            else:
+                intSlopeRawPer = Slope(rawDEM, "PERCENT_RISE")
+                intSlopeRawPer.save(slopeRawPer)
+                del intSlopeRawPer
 
             log.info('Slope calculated in percent')
 
@@ -128,7 +163,10 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
 
                 # Recondition DEM (burning stream network in using AGREE method)
                 log.info("Burning streams into DEM.")
-                reconditionDEM.function(rawDEM, streamInput, smoothDropBuffer, smoothDrop, streamDrop, burnedDEM)
+                if blockwise:
+                    reconditionDEM.function(rawDEM, streamInput, smoothDropBuffer, smoothDrop, streamDrop, burnedDEM, 'NumPy')
+                else:
+                    reconditionDEM.function(rawDEM, streamInput, smoothDropBuffer, smoothDrop, streamDrop, burnedDEM, engine)
                 log.info("Completed stream network burn in to DEM")
 
                 progress.logProgress(codeBlock, outputFolder)
@@ -140,7 +178,11 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
             codeBlock = 'Fill sinks'
             if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-                Fill(burnedDEM).save(hydDEM)
+                if blockwise:
+                    # Cells on the boundary of the study area mask drain out, as well as those on the edge of the DEM
+                    hydrology_engine.fillSinks(burnedDEM, hydDEM, studyAreaMask)
+                else:
+                    Fill(burnedDEM).save(hydDEM)
 
                 log.info("Sinks in DEM filled")
                 progress.logProgress(codeBlock, outputFolder)
@@ -152,7 +194,11 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
             codeBlock = 'Flow direction'
             if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-                FlowDirection(hydDEM, "NORMAL").save(hydFDR)
+                if engine == 'NumPy':
+                    hydrology_engine.flowDirection(hydDEM, hydFDR)
+                else:
+                    FlowDirection(hydDEM, "NORMAL").save(hydFDR)
+
                 log.info("Flow Direction calculated")
                 progress.logProgress(codeBlock, outputFolder)
 
@@ -164,8 +210,16 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
             if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
                 # Save flow direction raster in degrees (for display purposes)
-                degreeValues = RemapValue([[1, 90], [2, 135], [4, 180], [8, 225], [16, 270], [32, 315], [64, 0], [128, 45]])
-                Reclassify(hydFDR, "Value", degreeValues, "NODATA").save(hydFDRDegrees)
+                if not displayLayers:
+                    log.info('Display layers not requested. Flow direction in degrees not saved.')
+
+                elif blockwise:
+                    hydrology_engine.flowDirectionDegrees(hydFDR, hydFDRDegrees)
+
+                else:
+                    degreeValues = RemapValue([[1, 90], [2, 135], [4, 180], [8, 225], [16, 270], [32, 315], [64, 0], [128, 45]])
+                    Reclassify(hydFDR, "Value", degreeValues, "NODATA").save(hydFDRDegrees)
+
                 progress.logProgress(codeBlock, outputFolder)
 
             #########################
@@ -175,9 +229,13 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
             codeBlock = 'Flow accumulation'
             if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-                hydFACTemp = FlowAccumulation(hydFDR, "", "FLOAT")
-                hydFACTemp.save(hydFAC)
-                arcpy.sa.Int(Raster(hydFAC)).save(hydFACInt) # integer version
+                if blockwise:
+                    hydrology_engine.flowAccumulation(hydFDR, hydFAC, hydFACInt) # float and integer versions in one pass
+                else:
+                    hydFACTemp = FlowAccumulation(hydFDR, "", "FLOAT")
+                    hydFACTemp.save(hydFAC)
+                    arcpy.sa.Int(Raster(hydFAC)).save(hydFACInt) # integer version
+
                 log.info("Flow Accumulation calculated")
 
                 progress.logProgress(codeBlock, outputFolder)
@@ -190,13 +248,18 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
             codeBlock = 'Calculate slope on burned DEM'
             if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
 
-                intSlopeHydDeg = Slope(hydDEM, "DEGREE")
-                intSlopeHydDeg.save(slopeHydDeg)
-                del intSlopeHydDeg
+                if blockwise:
+                    # Degrees and percent from one calculation of the gradients
+                    hydrology_engine.slopeRasters(hydDEM, slopeHydDeg, slopeHydPer)
+
+                else:
+                    intSlopeHydDeg = Slope(hydDEM, "DEGREE")
+                    intSlopeHydDeg.save(slopeHydDeg)
+                    del intSlopeHydDeg
 
-                intSlopeHydPer = Slope(hydDEM, "PERCENT_RISE")
-                intSlopeHydPer.save(slopeHydPer)
-                del intSlopeHydPer
+                    intSlopeHydPer = Slope(hydDEM, "PERCENT_RISE")
+                    intSlopeHydPer.save(slopeHydPer)
+                    del intSlopeHydPer
 
                 log.info('Slope calculated')
 
@@ -208,58 +271,10 @@ def function(outputFolder, DEM, studyAreaMask, streamInput, minAccThresh, majAcc
 
             codeBlock = 'Create stream file'
             if not progress.codeSuccessfullyRun(codeBlock, outputFolder, rerun):
-                
-                # Create accumulation in metres
-                streamAccHaFileInt = hydFACTemp * cellSizeDEM * cellSizeDEM / 10000.0
-                streamAccHaFileInt.save(streamAccHaFile)
-                del streamAccHaFileInt
-
-                # Check stream initiation threshold reached
-                streamYes = float(arcpy.GetRasterProperties_management(streamAccHaFile, "MAXIMUM").getOutput(0))
-
-                if streamYes > float(minAccThresh):
-
-                    reclassifyRanges = RemapRange([[-1000000, float(minAccThresh), 1],
-                                                   [float(minAccThresh), 9999999999, 0]])
-
-                    outNBstream = Reclassify(streamAccHaFile, "VALUE", reclassifyRanges)
-                    outNBstream.save(streamInvRas)
-                    del outNBstream
-                    log.info("Stream raster for input to NB created")
-
-                    # Create stream file for display
-                    reclassifyRanges = RemapRange([[0, float(minAccThresh), "NODATA"],
-                                        [float(minAccThresh), float(majAccThresh), 1],
-                                        [float(majAccThresh), 99999999999999, 2]])
-
-                    streamsRaster = Reclassify(streamAccHaFile, "Value", reclassifyRanges, "NODATA")
-                    streamOrderRaster = StreamOrder(streamsRaster, hydFDR, "STRAHLER")
-                    streamsRaster.save(streamsRasterFile)
-
-                    # Create two streams feature classes - one for analysis and one for display
-                    arcpy.sa.StreamToFeature(streamOrderRaster, hydFDR, streams, 'NO_SIMPLIFY')
-                    arcpy.sa.StreamToFeature(streamOrderRaster, hydFDR, streamDisplay, 'SIMPLIFY')
-
-                    # Rename grid_code column to 'Strahler'
-                    for streamFC in [streams, streamDisplay]:
-
-                        arcpy.AddField_management(streamFC, "Strahler", "LONG")
-                        arcpy.CalculateField_management(streamFC, "Strahler", "!GRID_CODE!", "PYTHON_9.3")
-                        arcpy.DeleteField_management(streamFC, "GRID_CODE")
-
-                    del streamsRaster
-                    del streamOrderRaster
-
-                    log.info("Stream files created")
-
-                else:
-
-                    warning = 'No streams initiated'
-                    log.warning(warning)
-                    common.logWarnings(outputFolder, warning)
 
-                    # Create NBStream file from multiplier raster (i.e. all cells have value of 1 = no stream)
-                    arcpy.CopyRaster_management(multRaster, streamInvRas)
+                # Stream raster for input to NB and stream files for display
+                streamOutputs = streams_lib.StreamOutputs(minAccThresh, majAccThresh, streamInvRas, streams, streamDisplay)
+                streams_lib.extractStreams(hydFAC, hydFDR, multRaster, [streamOutputs], outputFolder, engine)
 
                 progress.logProgress(codeBlock, outputFolder)
 
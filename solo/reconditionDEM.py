@@ -2,12 +2,18 @@ import arcpy
 from arcpy.sa import EucDistance, Con, IsNull, Raster
 
 import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.hydrology_engine as hydrology_engine
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
-refresh_modules([log])
+refresh_modules([log, hydrology_engine])
 
-def function(DEM, streamNetwork, smoothDropBuffer, smoothDrop, streamDrop, outputReconDEM):
+def function(DEM, streamNetwork, smoothDropBuffer, smoothDrop, streamDrop, outputReconDEM, engine='ArcPy'):
 
     try:
+        if engine == 'NumPy':
+            hydrology_engine.burnStreams(DEM, streamNetwork, smoothDropBuffer, smoothDrop, streamDrop, outputReconDEM)
+            log.info("Reconditioned DEM generated")
+            return
+
         # Set environment variables
         arcpy.env.extent = DEM
         arcpy.env.mask = DEM
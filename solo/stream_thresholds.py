@@ -0,0 +1,126 @@
+'''
+NB stream threshold sweep function
+'''
+
+import sys
+import os
+import csv
+import arcpy
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.lib.streams as streams_lib
+from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, streams_lib])
+
+def thresholdName(value):
+
+    ''' Threshold as text for use in a folder name (e.g. 2.5 becomes 2_5) '''
+
+    text = ('%f' % float(value)).rstrip('0').rstrip('.')
+
+    return text.replace('.', '_').replace('-', 'm')
+
+
+def function(outputFolder, preprocessFolder, thresholds):
+
+    '''
+    Extracts streams from the preprocessed flow accumulation and flow direction for several pairs of thresholds.
+
+    thresholds is a list of (minAccThresh, majAccThresh) tuples, the stream and major river initiation
+    accumulation thresholds in hectares. The hydrology is not recalculated: all the thresholds are evaluated
+    in one pass over the flow accumulation. The stream layers for each pair are written to a subfolder
+    of outputFolder, with the same names as in the preprocessing folder, and a summary row for each pair
+    is written to stream_thresholds.csv.
+    '''
+
+    try:
+        # Set output filenames
+        summaryTable = os.path.join(outputFolder, "stream_thresholds.csv")
+
+        preprocessFiles = common.getFilenames('preprocess', preprocessFolder)
+
+        if len(thresholds) == 0:
+            log.error('No thresholds have been given')
+            sys.exit()
+
+        for dataset in [preprocessFiles.hydFAC, preprocessFiles.hydFDR, preprocessFiles.multRaster]:
+            if not arcpy.Exists(dataset):
+                log.error('Preprocessed layer ' + dataset + ' does not exist. Please run the preprocessing tool with DEM reconditioning first.')
+                sys.exit()
+
+        # Set up the outputs for each pair of thresholds
+        outputs = []
+        folders = []
+        for minAccThresh, majAccThresh in thresholds:
+
+            if float(majAccThresh) < float(minAccThresh):
+                log.error('River initiation threshold ' + str(majAccThresh) + ' ha is less than the stream initiation threshold ' + str(minAccThresh) + ' ha')
+                sys.exit()
+
+            folder = os.path.join(outputFolder, 'streams_' + thresholdName(minAccThresh) + '_' + thresholdName(majAccThresh))
+
+            if folder in folders:
+                log.error('Thresholds ' + str(minAccThresh) + ' and ' + str(majAccThresh) + ' ha are given more than once')
+                sys.exit()
+
+            if not os.path.exists(folder):
+                os.mkdir(folder)
+
+            files = common.getFilenames('preprocess', folder)
+
+            folders.append(folder)
+            outputs.append(streams_lib.StreamOutputs(minAccThresh, majAccThresh,
+                                                     files.streamInvRas, files.streams, files.streamDisplay))
+
+        log.info('Extracting streams for ' + str(len(outputs)) + ' pairs of thresholds')
+
+        engine = common.getUserSetting('hydrologyEngine', 'ArcPy')
+
+        created = streams_lib.extractStreams(preprocessFiles.hydFAC, preprocessFiles.hydFDR, preprocessFiles.multRaster,
+                                             outputs, outputFolder, engine)
+
+        ###############################
+        ### Write the summary table ###
+        ###############################
+
+        summaryRows = []
+        for output, folder in zip(outputs, folders):
+
+            numLinks = 0
+            streamLength = 0.0
+
+            if output in created:
+                with arcpy.da.SearchCursor(output.streams, ['SHAPE@LENGTH']) as cursor:
+                    for row in cursor:
+                        numLinks += 1
+                        streamLength += row[0]
+
+            summaryRows.append([output.minAccThresh, output.majAccThresh, folder,
+                                output.streamCells, numLinks, streamLength / 1000.0])
+
+        headings = ['Stream initiation threshold (ha)', 'River initiation threshold (ha)', 'Output folder',
+                    'Stream cells', 'Stream links', 'Total stream length (km)']
+
+        if six.PY2:
+            csv_file = open(summaryTable, 'wb')
+        else:
+            csv_file = open(summaryTable, 'w', newline='')
+
+        with csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(headings)
+
+            for row in summaryRows:
+                writer.writerow(row)
+
+        log.info('Stream threshold summary table created')
+
+        log.info("Stream threshold function completed successfully")
+
+        return summaryTable
+
+    except Exception:
+        arcpy.AddError("Stream threshold function failed")
+        raise
@@ -0,0 +1,23 @@
+'''
+Test configuration.
+
+The modules under test are the NumPy kernels, which do not depend on arcpy. The NB_SEEA_ESRI package __init__
+imports arcpy, so the package is registered here from the repository folder without running its __init__,
+and the kernels are imported as NB_SEEA_ESRI.lib modules in the same way as the tools import them.
+Tests of modules which import arcpy are skipped where arcpy is not installed.
+'''
+
+import os
+import sys
+import types
+
+repoPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which use arcpy import configuration from the repository folder
+if repoPath not in sys.path:
+    sys.path.append(repoPath)
+
+if 'NB_SEEA_ESRI' not in sys.modules:
+    package = types.ModuleType('NB_SEEA_ESRI')
+    package.__path__ = [repoPath]
+    sys.modules['NB_SEEA_ESRI'] = package
@@ -0,0 +1,89 @@
+import numpy as np
+
+from NB_SEEA_ESRI.lib.diversity import UnitClassMatrix
+
+
+def randomMatrix(rng, numUnits, numClasses, numEntries):
+
+    units = rng.randint(0, numUnits, numEntries)
+    classes = rng.randint(0, numClasses, numEntries)
+    areas = rng.uniform(0, 10, numEntries)
+
+    return units, classes, areas
+
+
+def unitAreas(units, classes, areas, numUnits):
+
+    ''' Area of each class in each unit, as a list of dictionaries '''
+
+    unitClasses = [dict() for unit in range(numUnits)]
+    for unit, classNo, area in zip(units, classes, areas):
+        unitClasses[unit][classNo] = unitClasses[unit].get(classNo, 0.0) + area
+
+    return unitClasses
+
+
+def test_from_pairs_sums_repeated_pairs():
+
+    matrix = UnitClassMatrix.fromPairs([0, 0, 2, 0], [1, 1, 0, 3], [1.0, 2.0, 5.0, 0.5], numUnits=4)
+
+    assert matrix.indptr.tolist() == [0, 2, 2, 3, 3]
+    assert matrix.classes.tolist() == [1, 3, 0]
+    assert matrix.areas.tolist() == [3.0, 0.5, 5.0]
+    assert matrix.numClasses == 4
+
+
+def test_metrics_match_per_unit_formulas():
+
+    rng = np.random.RandomState(0)
+    numUnits = 50
+    units, classes, areas = randomMatrix(rng, numUnits, 8, 300)
+    unitSizes = rng.uniform(40, 60, numUnits)
+    numPatches = rng.randint(0, 5, numUnits)
+
+    matrix = UnitClassMatrix.fromPairs(units, classes, areas, numUnits)
+    shannon = matrix.shannon(unitSizes)
+    inverseSimpson = matrix.inverseSimpson(unitSizes)
+    evenness = matrix.evenness(unitSizes)
+    meanPatchArea = matrix.meanPatchArea(numPatches)
+
+    for unit, classAreas in enumerate(unitAreas(units, classes, areas, numUnits)):
+
+        p = np.array(list(classAreas.values())) / unitSizes[unit]
+
+        assert matrix.richness()[unit] == len(classAreas)
+        assert np.isclose(matrix.unitTotals()[unit], sum(classAreas.values()))
+
+        if len(classAreas) == 0:
+            assert shannon[unit] == -1 and inverseSimpson[unit] == -1
+            continue
+
+        assert np.isclose(shannon[unit], -np.sum(p * np.log(p)))
+        assert np.isclose(inverseSimpson[unit], 1.0 / np.sum(p * p))
+
+        if len(classAreas) > 1:
+            assert np.isclose(evenness[unit], -np.sum(p * np.log(p)) / np.log(len(classAreas)))
+        else:
+            assert evenness[unit] == -1
+
+        if numPatches[unit] > 0:
+            assert np.isclose(meanPatchArea[unit], sum(classAreas.values()) / numPatches[unit])
+        else:
+            assert meanPatchArea[unit] == 0
+
+
+def test_proportions_default_to_unit_totals():
+
+    matrix = UnitClassMatrix.fromPairs([0, 0, 1], [0, 1, 1], [1.0, 3.0, 2.0], numUnits=2)
+
+    assert matrix.proportions().tolist() == [0.25, 0.75, 1.0]
+    assert np.isclose(matrix.shannon()[1], 0.0)
+
+
+def test_empty_matrix():
+
+    matrix = UnitClassMatrix.fromPairs([], [], [], numUnits=3)
+
+    assert matrix.richness().tolist() == [0, 0, 0]
+    assert matrix.shannon().tolist() == [-1.0, -1.0, -1.0]
+    assert matrix.inverseSimpson().tolist() == [-1.0, -1.0, -1.0]
@@ -0,0 +1,519 @@
+import numpy as np
+
+import NB_SEEA_ESRI.lib.hydro_kernels as hydro_kernels
+import NB_SEEA_ESRI.lib.tile_workers as tile_workers
+
+neighbours = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def shifted(values, rowOffset, colOffset, fill):
+
+    ''' Value of the neighbour at (rowOffset, colOffset) of each cell, with fill outside the array '''
+
+    padded = np.pad(values, 1, mode='constant', constant_values=fill)
+    rows, cols = values.shape
+
+    return padded[1 + rowOffset:1 + rowOffset + rows, 1 + colOffset:1 + colOffset + cols]
+
+
+def randomDEM(rng, nRows, nCols, levels=None, nodataFraction=0.05):
+
+    dem = rng.uniform(0, 10, (nRows, nCols)).astype(np.float32)
+    if levels is not None:
+        dem = np.round(dem * levels / 10.0).astype(np.float32)
+
+    dem[rng.uniform(size=(nRows, nCols)) < nodataFraction] = np.nan
+
+    return dem
+
+
+def bruteForceFill(dem, outlets=None):
+
+    '''
+    Fill by definition (as the Fill tool with no z limit): each cell is raised to the lowest level, over all paths
+    from the cell to an outlet, of the highest cell on the path. Outlets are cells next to NoData or the edge of the grid.
+    '''
+
+    nodata = np.isnan(dem)
+    isOutlet = np.zeros(dem.shape, dtype=bool)
+    for rowOffset, colOffset in neighbours:
+        isOutlet |= shifted(nodata, rowOffset, colOffset, True)
+
+    if outlets is not None:
+        isOutlet |= outlets
+
+    isOutlet &= ~nodata
+
+    level = np.where(isOutlet, dem, np.inf)
+    level[nodata] = np.nan
+
+    while True:
+        lowest = level.copy()
+        for rowOffset, colOffset in neighbours:
+            lowest = np.fmin(lowest, shifted(level, rowOffset, colOffset, np.inf))
+
+        updated = np.where(nodata, np.nan, np.maximum(dem, lowest))
+        if np.array_equal(updated, level, equal_nan=True):
+            return level
+
+        level = updated
+
+
+def tiledFill(dem, blockSize, tmpPath, outlets=None):
+
+    '''
+    Fills the DEM tile by tile with the first pass tile worker and the spill level solve of
+    hydrology_engine.tiledFillSinks, with the tiles in memory-mapped arrays in tmpPath
+    '''
+
+    nRows, nCols = dem.shape
+    tiles = [(row, col, min(blockSize, nRows - row), min(blockSize, nCols - col))
+             for row in range(0, nRows, blockSize) for col in range(0, nCols, blockSize)]
+
+    demFile = str(tmpPath / 'dem.npy')
+    np.save(demFile, dem)
+
+    outletFile = None
+    if outlets is not None:
+        outletFile = str(tmpPath / 'outlets.npy')
+        np.save(outletFile, outlets.astype(np.float32))
+
+    filledFile = str(tmpPath / 'filled.npy')
+    np.save(filledFile, np.full(dem.shape, np.nan, dtype=np.float32))
+    labelFile = str(tmpPath / 'labels.npy')
+    np.save(labelFile, np.full(dem.shape, hydro_kernels.label_nodata, dtype=np.int32))
+
+    results = []
+    numLabels = 1
+    for tile in tiles:
+        results.append(tile_workers.fillTile((tile, demFile, outletFile, filledFile, labelFile, numLabels)))
+        numLabels += 2 * (tile[2] + tile[3])
+
+    tilesPerRow = (nCols + blockSize - 1) // blockSize
+    levels = hydro_kernels.tile_spill_levels(numLabels, [result[0] for result in results], [result[1] for result in results],
+                                             tilesPerRow)
+
+    return hydro_kernels.raise_to_levels(np.load(filledFile), np.load(labelFile), levels)
+
+
+def test_fill_matches_definition():
+
+    rng = np.random.RandomState(0)
+
+    for trial in range(20):
+        dem = randomDEM(rng, rng.randint(3, 40), rng.randint(3, 40), levels=[None, 5][trial % 2])
+
+        assert np.array_equal(hydro_kernels.priority_flood_fill(dem), bruteForceFill(dem), equal_nan=True)
+
+
+def test_fill_with_outlets_matches_definition():
+
+    rng = np.random.RandomState(1)
+
+    for trial in range(10):
+        dem = randomDEM(rng, 30, 25)
+        outlets = rng.uniform(size=dem.shape) < 0.02
+
+        assert np.array_equal(hydro_kernels.priority_flood_fill(dem, outlets), bruteForceFill(dem, outlets), equal_nan=True)
+
+
+def test_fill_pit_and_flat():
+
+    dem = np.array([[5, 5, 5, 5, 5],
+                    [5, 1, 2, 1, 5],
+                    [5, 2, 3, 2, 4],
+                    [5, 5, 5, 5, 5]], dtype=np.float32)
+
+    filled = hydro_kernels.priority_flood_fill(dem)
+
+    # The depression fills to the level of its lowest outlet (4), and nothing else changes
+    expected = dem.copy()
+    expected[1:3, 1:4] = 4
+
+    assert np.array_equal(filled, expected)
+
+
+def test_fill_study_area_outlet():
+
+    dem = np.array([[9, 9, 9, 9, 9],
+                    [9, 1, 1, 1, 9],
+                    [9, 1, 1, 1, 9],
+                    [9, 9, 9, 9, 9]], dtype=np.float32)
+
+    outlets = np.zeros(dem.shape, dtype=bool)
+    outlets[1, 1] = True
+
+    assert np.array_equal(hydro_kernels.priority_flood_fill(dem, outlets), dem)
+    assert hydro_kernels.priority_flood_fill(dem)[1:3, 1:4].min() == 9
+
+
+def test_tiled_fill_matches_whole_grid(tmp_path):
+
+    rng = np.random.RandomState(2)
+
+    for trial in range(20):
+        dem = randomDEM(rng, rng.randint(5, 50), rng.randint(5, 50), levels=[None, 8][trial % 2])
+        outlets = None
+        if trial % 3 == 0:
+            outlets = rng.uniform(size=dem.shape) < 0.01
+
+        expected = hydro_kernels.priority_flood_fill(dem, outlets)
+
+        for blockSize in [3, 4, 7, 16]:
+            assert np.array_equal(tiledFill(dem, blockSize, tmp_path, outlets), expected, equal_nan=True)
+
+
+def test_tiled_fill_depression_across_tiles(tmp_path):
+
+    # A single depression spanning four tiles, draining over a saddle in one corner
+    dem = np.full((12, 12), 10, dtype=np.float32)
+    dem[2:10, 2:10] = 1
+    dem[0:3, 0:3] = 6
+
+    expected = hydro_kernels.priority_flood_fill(dem)
+
+    assert expected[5, 5] == 6
+    assert np.array_equal(tiledFill(dem, 6, tmp_path), expected)
+
+
+def bruteForceD8(dem, cellWidth, cellHeight):
+
+    ''' Steepest descent direction of each cell, with ties to the first code, or the first NoData neighbour at edges '''
+
+    nRows, nCols = dem.shape
+    fdr = np.zeros(dem.shape, dtype=np.uint8)
+
+    for row in range(nRows):
+        for col in range(nCols):
+
+            if np.isnan(dem[row, col]):
+                fdr[row, col] = hydro_kernels.fdr_nodata
+                continue
+
+            bestDrop = 0.0
+            toNoData = 0
+            for code, (rowOffset, colOffset) in zip(hydro_kernels.d8_codes, hydro_kernels.d8_offsets):
+
+                r = row + rowOffset
+                c = col + colOffset
+                if r < 0 or r >= nRows or c < 0 or c >= nCols or np.isnan(dem[r, c]):
+                    if toNoData == 0:
+                        toNoData = code
+                    continue
+
+                distance = np.float32(np.hypot(rowOffset * cellHeight, colOffset * cellWidth))
+                drop = (dem[row, col] - dem[r, c]) / distance
+                if drop > bestDrop:
+                    bestDrop = drop
+                    fdr[row, col] = code
+
+            if fdr[row, col] == 0:
+                fdr[row, col] = toNoData
+
+    return fdr
+
+
+def downstreamCell(fdr, row, col):
+
+    code = fdr[row, col]
+    if code in hydro_kernels.d8_codes:
+        rowOffset, colOffset = hydro_kernels.d8_offsets[hydro_kernels.d8_codes.index(code)]
+        r = row + rowOffset
+        c = col + colOffset
+        if 0 <= r < fdr.shape[0] and 0 <= c < fdr.shape[1] and fdr[r, c] != hydro_kernels.fdr_nodata:
+            return r, c
+
+    return None
+
+
+def test_d8_matches_brute_force_without_flats():
+
+    rng = np.random.RandomState(3)
+
+    for trial in range(10):
+        dem = randomDEM(rng, rng.randint(3, 30), rng.randint(3, 30))
+        cellHeight = [10.0, 12.5][trial % 2]
+
+        fdr = hydro_kernels.d8_flow_direction(dem, 10.0, cellHeight)
+        expected = bruteForceD8(dem, 10.0, cellHeight)
+
+        # Cells with a lower neighbour or on the edge of the data are not on flats
+        resolved = expected != 0
+        assert np.array_equal(fdr[resolved], expected[resolved])
+
+
+def test_d8_flats_drain_out_of_filled_dem():
+
+    rng = np.random.RandomState(4)
+
+    for trial in range(10):
+        dem = hydro_kernels.priority_flood_fill(randomDEM(rng, 25, 30, levels=4))
+        fdr = hydro_kernels.d8_flow_direction(dem, 10.0, 10.0)
+
+        assert np.array_equal(fdr == hydro_kernels.fdr_nodata, np.isnan(dem))
+        assert not (fdr == hydro_kernels.no_flow).any()
+
+        # Every path leaves the grid, never climbing, without visiting a cell twice
+        for row, col in zip(*np.nonzero(~np.isnan(dem))):
+            visited = set()
+            cell = (row, col)
+            while cell is not None:
+                assert cell not in visited
+                visited.add(cell)
+                nextCell = downstreamCell(fdr, *cell)
+                if nextCell is not None:
+                    assert dem[nextCell] <= dem[cell]
+                cell = nextCell
+
+
+def bruteForceAccumulation(fdr, weights):
+
+    acc = np.zeros(fdr.shape, dtype=np.float64)
+
+    for row, col in zip(*np.nonzero(fdr != hydro_kernels.fdr_nodata)):
+        cell = downstreamCell(fdr, row, col)
+        while cell is not None:
+            acc[cell] += weights[row, col]
+            cell = downstreamCell(fdr, *cell)
+
+    acc[fdr == hydro_kernels.fdr_nodata] = np.nan
+
+    return acc
+
+
+def test_flow_accumulation_matches_brute_force():
+
+    rng = np.random.RandomState(5)
+
+    for trial in range(10):
+        dem = hydro_kernels.priority_flood_fill(randomDEM(rng, 20, 25, levels=[None, 5][trial % 2]))
+        fdr = hydro_kernels.d8_flow_direction(dem, 10.0, 10.0)
+
+        weights = rng.uniform(0, 2, dem.shape)
+        weights[rng.uniform(size=dem.shape) < 0.1] = np.nan
+
+        expected = bruteForceAccumulation(fdr, np.where(np.isnan(weights), 0.0, weights))
+        assert np.allclose(hydro_kernels.flow_accumulation(fdr, weights), expected, equal_nan=True, rtol=1e-5)
+
+        expected = bruteForceAccumulation(fdr, np.ones(dem.shape))
+        assert np.array_equal(hydro_kernels.flow_accumulation(fdr), expected.astype(np.float32), equal_nan=True)
+
+
+def test_fdr_degrees():
+
+    fdr = np.array([[1, 2, 4, 8], [16, 32, 64, 128], [0, 255, 1, 1]], dtype=np.uint8)
+    expected = [[90, 135, 180, 225], [270, 315, 0, 45], [-1, -1, 90, 90]]
+
+    assert hydro_kernels.fdr_degrees(fdr).tolist() == expected
+
+
+def bruteForceStrahler(fdr, streams):
+
+    nRows, nCols = fdr.shape
+    inflows = {}
+    for row, col in zip(*np.nonzero(streams)):
+        cell = downstreamCell(fdr, row, col)
+        if cell is not None and streams[cell]:
+            inflows.setdefault(cell, []).append((row, col))
+
+    order = np.zeros(fdr.shape, dtype=np.int32)
+
+    def cellOrder(cell):
+        if order[cell] == 0:
+            upstream = sorted([cellOrder(inflow) for inflow in inflows.get(cell, [])], reverse=True)
+            if len(upstream) == 0:
+                order[cell] = 1
+            elif len(upstream) > 1 and upstream[0] == upstream[1]:
+                order[cell] = upstream[0] + 1
+            else:
+                order[cell] = upstream[0]
+        return order[cell]
+
+    for row, col in zip(*np.nonzero(streams)):
+        cellOrder((row, col))
+
+    return order
+
+
+def streamNetwork(rng, nRows, nCols, threshold):
+
+    dem = hydro_kernels.priority_flood_fill(randomDEM(rng, nRows, nCols, nodataFraction=0.0))
+    fdr = hydro_kernels.d8_flow_direction(dem, 10.0, 10.0)
+    streams = hydro_kernels.flow_accumulation(fdr) > threshold
+
+    return fdr, streams
+
+
+def test_strahler_order_matches_brute_force():
+
+    rng = np.random.RandomState(6)
+
+    for trial in range(10):
+        fdr, streams = streamNetwork(rng, 30, 30, 3)
+        receivers = hydro_kernels.stream_receivers(fdr, streams)
+
+        assert np.array_equal(hydro_kernels.strahler_order(receivers, streams), bruteForceStrahler(fdr, streams))
+
+
+def test_stream_links_follow_the_flow():
+
+    rng = np.random.RandomState(7)
+
+    for trial in range(10):
+        fdr, streams = streamNetwork(rng, 30, 30, 3)
+        receivers = hydro_kernels.stream_receivers(fdr, streams)
+        inDegree = np.bincount(receivers[receivers >= 0], minlength=receivers.size)
+
+        offsets, vertices = hydro_kernels.stream_links(receivers, streams)
+
+        linkCells = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            link = vertices[start:end]
+
+            # Each link starts at a source or confluence and follows the receivers
+            assert inDegree[link[0]] != 1
+            assert np.array_equal(receivers[link[:-1]], link[1:])
+
+            # Cells after the head have one inflow, except a confluence added as the last vertex to join the next link
+            if link.size > 1 and inDegree[link[-1]] >= 2:
+                link = link[:-1]
+
+            assert (inDegree[link[1:]] == 1).all()
+            linkCells.extend(link.tolist())
+
+        # Every stream cell is in exactly one link
+        assert sorted(linkCells) == np.flatnonzero(streams.ravel()).tolist()
+
+
+def test_stream_classes_thresholds():
+
+    acc = np.array([[0, 1, 1.5, 10, 12, np.nan]], dtype=np.float32)
+    inverse, classes = hydro_kernels.stream_classes(acc, 1.0, 10.0)
+
+    assert np.array_equal(inverse, np.array([[1, 1, 0, 0, 0, np.nan]], dtype=np.float32), equal_nan=True)
+    assert np.array_equal(classes, np.array([[np.nan, np.nan, 1, 1, 2, np.nan]], dtype=np.float32), equal_nan=True)
+
+
+def bruteForceDouglasPeucker(x, y, tolerance):
+
+    keep = np.zeros(x.size, dtype=bool)
+
+    def simplify(start, end):
+        keep[start] = keep[end] = True
+        if end - start < 2:
+            return
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        length = np.hypot(dx, dy)
+        points = np.arange(start + 1, end)
+        if length == 0:
+            distance = np.hypot(x[points] - x[start], y[points] - y[start])
+        else:
+            distance = np.abs(dx * (y[start] - y[points]) - dy * (x[start] - x[points])) / length
+        furthest = points[np.argmax(distance)]
+        if distance.max() > tolerance:
+            simplify(start, furthest)
+            simplify(furthest, end)
+
+    simplify(0, x.size - 1)
+
+    return keep
+
+
+def test_douglas_peucker_matches_recursive():
+
+    rng = np.random.RandomState(8)
+
+    lengths = rng.randint(2, 40, 20)
+    offsets = np.r_[0, np.cumsum(lengths)]
+    x = np.cumsum(rng.uniform(0, 10, offsets[-1]))
+    y = rng.uniform(0, 10, offsets[-1])
+
+    keep = hydro_kernels.douglas_peucker(x, y, offsets, 2.0)
+
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        assert np.array_equal(keep[start:end], bruteForceDouglasPeucker(x[start:end], y[start:end], 2.0))
+
+
+def test_rasterize_lines_marks_connected_cells():
+
+    rows = np.array([0.5, 9.5, 2.2, 2.2, 7.9])
+    cols = np.array([0.5, 9.5, 1.1, 8.7, 3.3])
+    offsets = np.array([0, 2, 5])
+
+    streams = hydro_kernels.rasterize_lines(rows, cols, offsets, 10, 10)
+
+    # The diagonal, and every vertex
+    assert streams[np.arange(10), np.arange(10)].all()
+    assert streams[np.floor(rows).astype(int), np.floor(cols).astype(int)].all()
+
+    # Each sample is at most one cell from the next along the longer axis, so each segment is 8-connected
+    rowStart, colStart, rowEnd, colEnd = hydro_kernels.line_segments(rows, cols, offsets)
+    for segment in range(rowStart.size):
+        alone = hydro_kernels.rasterize_segments(rowStart[segment:segment + 1], colStart[segment:segment + 1],
+                                                 rowEnd[segment:segment + 1], colEnd[segment:segment + 1], 10, 10)
+        assert (alone & streams).sum() == alone.sum()
+        length = max(abs(rowEnd[segment] - rowStart[segment]), abs(colEnd[segment] - colStart[segment]))
+        assert alone.sum() >= np.floor(length)
+
+
+def test_rasterize_segments_ignores_cells_outside():
+
+    streams = hydro_kernels.rasterize_segments(np.array([-5.0]), np.array([2.5]), np.array([15.0]), np.array([2.5]), 10, 10)
+
+    assert streams[:, 2].all()
+    assert streams.sum() == 10
+
+
+def bruteForceDistance(streams, maxDistance):
+
+    streamRows, streamCols = np.nonzero(streams)
+    rows, cols = np.indices(streams.shape)
+
+    distance = np.full(streams.shape, np.inf)
+    for row, col in zip(streamRows, streamCols):
+        distance = np.minimum(distance, np.hypot(rows - row, cols - col))
+
+    distance[distance > maxDistance] = np.inf
+
+    return distance.astype(np.float32)
+
+
+def test_band_distance_matches_brute_force():
+
+    rng = np.random.RandomState(9)
+
+    for trial in range(20):
+        streams = rng.uniform(size=(rng.randint(1, 40), rng.randint(1, 40))) < [0.002, 0.02, 0.2][trial % 3]
+        maxDistance = rng.uniform(0.5, 15)
+
+        assert np.array_equal(hydro_kernels.band_distance(streams, maxDistance), bruteForceDistance(streams, maxDistance))
+
+
+def test_band_distance_block_seams():
+
+    ''' Block by block with a halo of max_distance cells, as in hydrology_engine.burnStreams, gives the whole-grid result '''
+
+    rng = np.random.RandomState(10)
+
+    for trial in range(10):
+        nRows, nCols = rng.randint(20, 80, 2)
+        streams = rng.uniform(size=(nRows, nCols)) < 0.01
+        maxDistance = rng.uniform(1, 10)
+        halo = int(np.ceil(maxDistance))
+        blockSize = rng.randint(4, 20)
+
+        expected = hydro_kernels.band_distance(streams, maxDistance)
+        blocked = np.empty(expected.shape, dtype=np.float32)
+
+        for row in range(0, nRows, blockSize):
+            for col in range(0, nCols, blockSize):
+                rowStart = max(row - halo, 0)
+                colStart = max(col - halo, 0)
+                window = streams[rowStart:row + blockSize + halo, colStart:col + blockSize + halo]
+
+                distance = hydro_kernels.band_distance(window, maxDistance)
+                core = distance[row - rowStart:row - rowStart + blockSize, col - colStart:col - colStart + blockSize]
+                blocked[row:row + blockSize, col:col + blockSize] = core
+
+        assert np.array_equal(blocked, expected)
@@ -0,0 +1,44 @@
+import collections
+
+import numpy as np
+import pytest
+
+arcpy = pytest.importorskip('arcpy')
+
+import NB_SEEA_ESRI.lib.raster_blocks as raster_blocks
+
+Grid = collections.namedtuple('Grid', ['nRows', 'nCols'])
+
+
+def test_blocks_cover_the_grid_once():
+
+    grid = Grid(23, 17)
+    covered = np.zeros((grid.nRows, grid.nCols), dtype=np.int32)
+
+    for block in raster_blocks.iterBlocks(grid, 5, halo=2):
+        assert block.halo == 2
+        covered[block.row:block.row + block.nRows, block.col:block.col + block.nCols] += 1
+
+    assert (covered == 1).all()
+
+
+def test_window_and_core_match_padded_grid():
+
+    grid = Grid(23, 17)
+    values = np.arange(grid.nRows * grid.nCols, dtype=np.float32).reshape(grid.nRows, grid.nCols)
+
+    for halo in [0, 1, 3, 8]:
+        padded = np.pad(values, halo, mode='constant', constant_values=np.nan)
+
+        for block in raster_blocks.iterBlocks(grid, 6, halo):
+
+            # Read the window clipped to the grid, and pad it as BlockReader does
+            window, padding = block.window(grid)
+            read = values[window.row:window.row + window.nRows, window.col:window.col + window.nCols]
+            read = np.pad(read, padding, mode='constant', constant_values=np.nan)
+
+            expected = padded[block.row:block.row + block.nRows + 2 * halo, block.col:block.col + block.nCols + 2 * halo]
+            assert np.array_equal(read, expected, equal_nan=True)
+
+            core = values[block.row:block.row + block.nRows, block.col:block.col + block.nCols]
+            assert np.array_equal(block.core(read), core)
@@ -0,0 +1,104 @@
+import collections
+
+import numpy as np
+
+import NB_SEEA_ESRI.lib.resample_kernels as resample_kernels
+
+
+def test_nearest_matches_brute_force():
+
+    rng = np.random.RandomState(0)
+    source = rng.uniform(0, 10, (15, 20)).astype(np.float32)
+    source[rng.uniform(size=source.shape) < 0.1] = np.nan
+
+    # Target cells of 7 x 3.5 units offset from source cells of 5 units, partly outside the source
+    rows = resample_kernels.nearest_index(-6.0, 3.5, 25, 5.0, 15)
+    cols = resample_kernels.nearest_index(2.0, 7.0, 16, 5.0, 20)
+    result = resample_kernels.nearest(source, rows, cols)
+
+    for row in range(25):
+        for col in range(16):
+            y = -6.0 + (row + 0.5) * 3.5
+            x = 2.0 + (col + 0.5) * 7.0
+            sourceRow = int(np.floor(y / 5.0))
+            sourceCol = int(np.floor(x / 5.0))
+
+            if 0 <= sourceRow < 15 and 0 <= sourceCol < 20:
+                assert np.array_equal(result[row, col], source[sourceRow, sourceCol], equal_nan=True)
+            else:
+                assert np.isnan(result[row, col])
+
+
+def test_bilinear_matches_brute_force():
+
+    rng = np.random.RandomState(1)
+    source = rng.uniform(0, 10, (12, 14)).astype(np.float32)
+    source[rng.uniform(size=source.shape) < 0.15] = np.nan
+
+    rows = resample_kernels.bilinear_weights(-3.0, 2.0, 35, 5.0, 12)
+    cols = resample_kernels.bilinear_weights(1.0, 3.0, 24, 5.0, 14)
+    result = resample_kernels.bilinear(source, rows, cols)
+
+    for row in range(35):
+        for col in range(24):
+            y = -3.0 + (row + 0.5) * 2.0
+            x = 1.0 + (col + 0.5) * 3.0
+
+            if not (0 <= y < 60 and 0 <= x < 70):
+                assert np.isnan(result[row, col])
+                continue
+
+            # Weighted mean of the four nearest cell centres (clamped at the edge), leaving out NoData
+            position = (y / 5.0 - 0.5, x / 5.0 - 0.5)
+            total = 0.0
+            weightTotal = 0.0
+            for r in [int(np.floor(position[0])), int(np.floor(position[0])) + 1]:
+                for c in [int(np.floor(position[1])), int(np.floor(position[1])) + 1]:
+                    weight = (1 - abs(position[0] - r)) * (1 - abs(position[1] - c))
+                    value = source[min(max(r, 0), 11), min(max(c, 0), 13)]
+                    if not np.isnan(value):
+                        total += weight * value
+                        weightTotal += weight
+
+            if weightTotal == 0:
+                assert np.isnan(result[row, col])
+            else:
+                assert np.isclose(result[row, col], total / weightTotal, rtol=1e-5)
+
+
+def test_mode_matches_brute_force():
+
+    rng = np.random.RandomState(2)
+    source = rng.randint(0, 4, (30, 40)).astype(np.float32)
+    source[rng.uniform(size=source.shape) < 0.2] = np.nan
+
+    # Source cells of 2 units aggregated to target cells of 5 units, offset so some source cells fall outside
+    targetRows = resample_kernels.nearest_index(1.0, 2.0, 30, 5.0, 11)
+    targetCols = resample_kernels.nearest_index(-3.0, 2.0, 40, 5.0, 16)
+
+    result, hasSource = resample_kernels.mode(source, targetRows, targetCols, 11, 16)
+
+    counts = collections.defaultdict(collections.Counter)
+    for row in range(30):
+        for col in range(40):
+            if targetRows[row] >= 0 and targetCols[col] >= 0 and not np.isnan(source[row, col]):
+                counts[(targetRows[row], targetCols[col])][source[row, col]] += 1
+
+    for row in range(11):
+        for col in range(16):
+            if (row, col) in counts:
+                valueCounts = counts[(row, col)]
+                highest = max(valueCounts.values())
+                assert result[row, col] == min(value for value, count in valueCounts.items() if count == highest)
+                assert hasSource[row, col]
+            else:
+                assert np.isnan(result[row, col])
+                assert not hasSource[row, col]
+
+
+def test_mode_ties_go_to_lowest_value():
+
+    source = np.array([[3, 1, 1, 3]], dtype=np.float32)
+    result, hasSource = resample_kernels.mode(source, np.array([0]), np.array([0, 0, 0, 0]), 1, 1)
+
+    assert result[0, 0] == 1
@@ -0,0 +1,107 @@
+import numpy as np
+
+import NB_SEEA_ESRI.lib.rusle_kernels as rusle_kernels
+
+
+def randomFactor(rng, shape, nodataFraction=0.1):
+
+    values = rng.uniform(0, 5, shape).astype(np.float32)
+    values[rng.uniform(size=shape) < nodataFraction] = np.nan
+
+    return values
+
+
+def test_multiply_factors_matches_product():
+
+    rng = np.random.RandomState(0)
+    factors = [randomFactor(rng, (20, 30)) for i in range(5)]
+
+    expected = factors[0].copy()
+    for factor in factors[1:]:
+        expected = expected * factor
+
+    assert np.allclose(rusle_kernels.multiply_factors(factors), expected, equal_nan=True)
+
+    out = np.empty((20, 30), dtype=np.float32)
+    assert rusle_kernels.multiply_factors(factors, out) is out
+    assert np.allclose(out, expected, equal_nan=True)
+
+
+def test_ls_slope_length_matches_formula():
+
+    slope = np.array([0, 1, 5, 20, 50, 100, np.nan], dtype=np.float32)
+    cutoff = 50.0
+    s = np.minimum(slope.astype(np.float64), cutoff)
+    expected = (25.0 / 22) ** 0.5 * (0.065 + 0.045 * s + 0.0065 * s ** 2)
+
+    result = rusle_kernels.ls_slope_length(slope.copy(), 25.0, cutoff)
+
+    assert np.allclose(result, expected, equal_nan=True, rtol=1e-6)
+
+
+def test_ls_upslope_area_matches_formula():
+
+    rng = np.random.RandomState(1)
+    fac = rng.uniform(0, 1000, 50).astype(np.float32)
+    slopeDeg = rng.uniform(0, 60, 50).astype(np.float32)
+    m = 0.5
+    n = 1.3
+    cutoff = 45.0
+
+    b = np.minimum(slopeDeg.astype(np.float64), cutoff) * 0.01745
+    expected = (m + 1) * (fac * 30.0 / 22.1) ** m * (np.sin(b) / 0.09) ** n
+
+    result = rusle_kernels.ls_upslope_area(fac.copy(), slopeDeg.copy(), 30.0, m, n, cutoff)
+
+    assert np.allclose(result, expected, rtol=1e-4)
+
+
+def test_lookup_table():
+
+    lut = rusle_kernels.build_lut([3, 1, 3, 5], [0.3, 0.1, 0.9, None])
+
+    assert lut.size == 6
+    assert np.allclose(lut[[1, 3]], [0.1, 0.3])
+    assert np.isnan(lut[[0, 2, 4, 5]]).all()
+
+    codes = np.array([[1, 3, 7], [np.nan, -1, 5]], dtype=np.float32)
+    result = rusle_kernels.apply_lut(codes.copy(), lut)
+
+    expected = np.array([[0.1, 0.3, np.nan], [np.nan, np.nan, np.nan]], dtype=np.float32)
+    assert np.allclose(result, expected, equal_nan=True)
+
+    assert rusle_kernels.unmapped_codes([1, 3, 5, 7, 7, -1], lut).tolist() == [-1, 5, 7]
+
+
+def test_apply_lut_matches_dictionary():
+
+    rng = np.random.RandomState(2)
+    table = dict(zip(range(0, 40, 3), rng.uniform(0, 1, 14)))
+    lut = rusle_kernels.build_lut(list(table.keys()), list(table.values()))
+
+    codes = rng.randint(-2, 45, (30, 30)).astype(np.float32)
+    expected = np.array([table.get(int(code), np.nan) for code in codes.ravel()], dtype=np.float32).reshape(codes.shape)
+
+    assert np.array_equal(rusle_kernels.apply_lut(codes, lut), expected, equal_nan=True)
+
+
+def test_block_stats():
+
+    values = np.array([[1, np.nan, 3], [np.nan, 2, np.inf]], dtype=np.float32)
+
+    assert rusle_kernels.block_stats(values) == (3, 6.0, 1.0, 3.0)
+
+    count, total, minimum, maximum = rusle_kernels.block_stats(np.full((2, 2), np.nan, dtype=np.float32))
+    assert (count, total) == (0, 0.0)
+    assert np.isnan(minimum) and np.isnan(maximum)
+
+
+def test_soil_loss_difference_and_totals():
+
+    lossA = np.array([1, 2, 3, np.nan, 5], dtype=np.float32)
+    lossB = np.array([2, 2, 1, 4, 5.5], dtype=np.float32)
+
+    diff = rusle_kernels.soil_loss_difference(lossA, lossB.copy())
+
+    assert np.array_equal(diff, np.array([1, np.nan, -2, np.nan, 0.5], dtype=np.float32), equal_nan=True)
+    assert rusle_kernels.gain_loss_totals(diff) == (1.5, -2.0)
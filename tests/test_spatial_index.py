@@ -0,0 +1,81 @@
+import numpy as np
+
+import NB_SEEA_ESRI.lib.spatial_index as spatial_index
+
+
+def randomBoxes(rng, numBoxes, size):
+
+    corners = rng.uniform(0, 1000, (numBoxes, 2))
+    sizes = rng.uniform(0, size, (numBoxes, 2))
+
+    return np.column_stack([corners, corners + sizes])
+
+
+def bruteForcePairs(items, queries):
+
+    hits = ((items[None, :, 0] <= queries[:, None, 2]) & (items[None, :, 2] >= queries[:, None, 0]) &
+            (items[None, :, 1] <= queries[:, None, 3]) & (items[None, :, 3] >= queries[:, None, 1]))
+
+    return np.nonzero(hits)
+
+
+def test_str_order_is_a_permutation():
+
+    boxes = randomBoxes(np.random.RandomState(0), 1000, 10)
+    order = spatial_index.strOrder(boxes, 16)
+
+    assert np.array_equal(np.sort(order), np.arange(1000))
+
+
+def test_str_order_slices_are_compact():
+
+    boxes = randomBoxes(np.random.RandomState(1), 4096, 1)
+    order = spatial_index.strOrder(boxes, 64)
+
+    # Each run of 64 boxes covers a small part of the area
+    runs = boxes[order].reshape(-1, 64, 4)
+    widths = runs[:, :, 2].max(axis=1) - runs[:, :, 0].min(axis=1)
+    heights = runs[:, :, 3].max(axis=1) - runs[:, :, 1].min(axis=1)
+
+    assert np.median(widths * heights) < 1000.0 * 1000.0 / 10
+
+
+def test_str_order_empty():
+
+    assert spatial_index.strOrder(np.zeros((0, 4)), 16).size == 0
+
+
+def test_query_boxes_matches_brute_force():
+
+    rng = np.random.RandomState(2)
+    items = randomBoxes(rng, 3000, 30)
+    queries = randomBoxes(rng, 500, 60)
+
+    tree = spatial_index.STRTree(items, nodeCapacity=8)
+    queryNos, itemNos = tree.queryBoxes(queries, batchSize=64)
+
+    expectedQueries, expectedItems = bruteForcePairs(items, queries)
+
+    assert np.array_equal(queryNos, expectedQueries)
+    assert np.array_equal(itemNos, expectedItems)
+
+
+def test_query_boxes_touching_and_empty_boxes():
+
+    items = np.array([[0, 0, 1, 1], [1, 1, 2, 2], [np.inf, np.inf, -np.inf, -np.inf], [5, 5, 6, 6]], dtype=np.float64)
+    tree = spatial_index.STRTree(items, nodeCapacity=2)
+
+    queryNos, itemNos = tree.queryBoxes([[1, 1, 1, 1], [3, 3, 4, 4]])
+
+    # Boxes which touch the query intersect it, and empty boxes never do
+    assert queryNos.tolist() == [0, 0]
+    assert itemNos.tolist() == [0, 1]
+
+
+def test_query_boxes_empty_tree():
+
+    tree = spatial_index.STRTree(np.zeros((0, 4)))
+    queryNos, itemNos = tree.queryBoxes([[0, 0, 1, 1]])
+
+    assert queryNos.size == 0
+    assert itemNos.size == 0
@@ -0,0 +1,85 @@
+import numpy as np
+
+import NB_SEEA_ESRI.lib.terrain as terrain
+
+
+def bruteForceSlope(dem, cellWidth, cellHeight):
+
+    ''' Slope in degrees and percent from Horn's method, cell by cell, with NoData neighbours given the centre value '''
+
+    nRows, nCols = dem.shape
+    degrees = np.full(dem.shape, np.nan)
+    percent = np.full(dem.shape, np.nan)
+
+    for row in range(nRows):
+        for col in range(nCols):
+
+            centre = dem[row, col]
+            if np.isnan(centre):
+                continue
+
+            def z(rowOffset, colOffset):
+                r = row + rowOffset
+                c = col + colOffset
+                if r < 0 or r >= nRows or c < 0 or c >= nCols or np.isnan(dem[r, c]):
+                    return float(centre)
+                return float(dem[r, c])
+
+            dzdx = ((z(-1, 1) + 2 * z(0, 1) + z(1, 1)) - (z(-1, -1) + 2 * z(0, -1) + z(1, -1))) / (8 * cellWidth)
+            dzdy = ((z(1, -1) + 2 * z(1, 0) + z(1, 1)) - (z(-1, -1) + 2 * z(-1, 0) + z(-1, 1))) / (8 * cellHeight)
+
+            rise = np.hypot(dzdx, dzdy)
+            degrees[row, col] = np.degrees(np.arctan(rise))
+            percent[row, col] = rise * 100
+
+    return degrees, percent
+
+
+def randomDEM(rng, nRows, nCols):
+
+    dem = rng.uniform(0, 50, (nRows, nCols)).astype(np.float32)
+    dem[rng.uniform(size=dem.shape) < 0.1] = np.nan
+
+    return dem
+
+
+def test_slope_matches_brute_force():
+
+    rng = np.random.RandomState(0)
+    dem = randomDEM(rng, 20, 25)
+    padded = np.pad(dem, 1, mode='constant', constant_values=np.nan)
+
+    slopeDegrees, slopePercent = terrain.slope_degrees_percent(padded, 10.0, 12.0)
+    expectedDegrees, expectedPercent = bruteForceSlope(dem, 10.0, 12.0)
+
+    assert np.allclose(slopeDegrees, expectedDegrees, equal_nan=True, rtol=1e-4)
+    assert np.allclose(slopePercent, expectedPercent, equal_nan=True, rtol=1e-4)
+    assert np.array_equal(terrain.slope_percent(padded, 10.0, 12.0), slopePercent, equal_nan=True)
+
+
+def test_slope_outputs_not_requested():
+
+    padded = np.pad(np.ones((3, 3), dtype=np.float32), 1, mode='constant', constant_values=np.nan)
+
+    assert terrain.slope_degrees_percent(padded, 1.0, 1.0, degrees=False)[0] is None
+    assert terrain.slope_degrees_percent(padded, 1.0, 1.0, percent=False)[1] is None
+
+
+def test_slope_block_seams():
+
+    ''' Blocks read with a halo of one cell (as raster_blocks.Block.window) give the whole-grid slope '''
+
+    rng = np.random.RandomState(1)
+    dem = randomDEM(rng, 37, 29)
+    padded = np.pad(dem, 1, mode='constant', constant_values=np.nan)
+
+    expected = terrain.slope_degrees_percent(padded, 5.0, 5.0)[0]
+
+    blockSize = 8
+    blocked = np.empty(dem.shape, dtype=np.float32)
+    for row in range(0, dem.shape[0], blockSize):
+        for col in range(0, dem.shape[1], blockSize):
+            block = padded[row:row + blockSize + 2, col:col + blockSize + 2]
+            blocked[row:row + blockSize, col:col + blockSize] = terrain.slope_degrees_percent(block, 5.0, 5.0)[0]
+
+    assert np.array_equal(blocked, expected, equal_nan=True)
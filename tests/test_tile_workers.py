@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+
+import NB_SEEA_ESRI.lib.hydro_kernels as hydro_kernels
+import NB_SEEA_ESRI.lib.tile_workers as tile_workers
+
+
+def listTiles(nRows, nCols, blockSize):
+
+    ''' Tiles covering the grid row by row, as raster_parallel.listTiles '''
+
+    return [(row, col, min(blockSize, nRows - row), min(blockSize, nCols - col))
+            for row in range(0, nRows, blockSize) for col in range(0, nCols, blockSize)]
+
+
+def createArray(arrayFile, shape, dtype=np.float32, fillValue=np.nan):
+
+    data = np.lib.format.open_memmap(arrayFile, mode='w+', dtype=dtype, shape=shape)
+    data[:] = fillValue
+    del data
+
+    return arrayFile
+
+
+def test_read_tile_with_halo(tmp_path):
+
+    values = np.arange(7 * 9, dtype=np.float32).reshape(7, 9)
+    arrayFile = str(tmp_path / 'values.npy')
+    np.save(arrayFile, values)
+
+    padded = np.pad(values, 3, mode='constant', constant_values=np.nan)
+
+    for tile in listTiles(7, 9, 4):
+        row, col, nRows, nCols = tile
+        for halo in [0, 1, 3]:
+            expected = padded[3 + row - halo:3 + row + nRows + halo, 3 + col - halo:3 + col + nCols + halo]
+            assert np.array_equal(tile_workers.readTile(arrayFile, tile, halo), expected, equal_nan=True)
+
+
+def tiledAccumulation(fdr, weights, blockSize, folder):
+
+    ''' Tiled flow accumulation in the same steps as hydrology_engine.tiledFlowAccumulation '''
+
+    nRows, nCols = fdr.shape
+
+    fdrFile = os.path.join(folder, 'fdr.npy')
+    np.save(fdrFile, np.where(fdr == hydro_kernels.fdr_nodata, np.nan, fdr).astype(np.float32))
+
+    weightFile = None
+    if weights is not None:
+        weightFile = os.path.join(folder, 'weights.npy')
+        np.save(weightFile, weights.astype(np.float32))
+
+    totalFile = createArray(os.path.join(folder, 'total.npy'), fdr.shape, np.float64)
+    accFile = createArray(os.path.join(folder, 'acc.npy'), fdr.shape)
+
+    tiles = listTiles(nRows, nCols, blockSize)
+    links = [tile_workers.accumulationTile((tile, fdrFile, weightFile, totalFile, nCols)) for tile in tiles]
+
+    linkArrays = [np.concatenate([link[i] for link in links]) for i in range(5)]
+    inletCells, inflow = hydro_kernels.solve_tile_links(*linkArrays)
+
+    inletRows, inletCols = np.divmod(inletCells, nCols)
+    tilesPerRow = (nCols + blockSize - 1) // blockSize
+    inletTiles = (inletRows // blockSize) * tilesPerRow + inletCols // blockSize
+
+    for tileIndex, tile in enumerate(tiles):
+        row, col, tileRows, tileCols = tile
+        inTile = inletTiles == tileIndex
+        inlets = (inletRows[inTile] - row) * tileCols + inletCols[inTile] - col
+        tile_workers.inflowTile((tile, fdrFile, weightFile, totalFile, accFile, inlets, inflow[inTile]))
+
+    return np.load(accFile)
+
+
+def test_tiled_accumulation_matches_whole_grid(tmp_path):
+
+    rng = np.random.RandomState(11)
+
+    for trial in range(8):
+        nRows, nCols = rng.randint(10, 40, 2)
+        dem = rng.uniform(0, 10, (nRows, nCols)).astype(np.float32)
+        if trial % 2:
+            dem = np.round(dem / 3)
+        dem[rng.uniform(size=dem.shape) < 0.05] = np.nan
+
+        fdr = hydro_kernels.d8_flow_direction(hydro_kernels.priority_flood_fill(dem), 10.0, 10.0)
+
+        weights = None
+        if trial % 3 == 0:
+            weights = np.round(rng.uniform(0, 4, dem.shape)).astype(np.float32)
+
+        expected = hydro_kernels.flow_accumulation(fdr, weights)
+
+        for blockSize in [3, 5, 16]:
+            result = tiledAccumulation(fdr, weights, blockSize, str(tmp_path))
+            assert np.array_equal(result, expected, equal_nan=True)
+
+
+def test_fill_tile_labels_and_sides(tmp_path):
+
+    dem = np.array([[5, 5, 5, 5],
+                    [5, 1, 2, 5],
+                    [5, 2, 1, 5],
+                    [5, 5, 5, 5]], dtype=np.float32)
+
+    demFile = str(tmp_path / 'dem.npy')
+    np.save(demFile, dem)
+    filledFile = createArray(str(tmp_path / 'filled.npy'), dem.shape)
+    labelFile = createArray(str(tmp_path / 'labels.npy'), dem.shape, np.int32, -1)
+
+    # The bottom right tile has no cells on the edge of the grid other than its own edges
+    spills, sides = tile_workers.fillTile(((1, 1, 3, 3), demFile, None, filledFile, labelFile, 10))
+
+    labels = np.load(labelFile)[1:, 1:]
+    filled = np.load(filledFile)[1:, 1:]
+
+    # Cells on the edge of the grid drain out (label 0), the rest get labels from 10 upwards
+    assert (labels[-1] == 0).all() and (labels[:, -1] == 0).all()
+    assert labels[0, 0] >= 10
+    # Within the tile, the inner cell drains over the tile edge to the cell at the top left
+    assert np.array_equal(filled[:2, :2], np.array([[1, 2], [2, 1]], dtype=np.float32))
+    assert labels[1, 1] == labels[0, 0]
+
+    assert np.array_equal(sides[0][1], labels[0])
+    assert np.array_equal(sides[3][0], filled[:, -1])
+    assert all(np.concatenate(spills[:2]) >= 0)
+
+
+def test_fused_soil_loss_tile_writes_base(tmp_path):
+
+    rng = np.random.RandomState(3)
+    factorValues = [rng.uniform(0.1, 2.0, (6, 7)).astype(np.float32) for i in range(4)]
+    factorValues[2][1, 1] = np.nan
+
+    factorSpecs = []
+    for i, values in enumerate(factorValues):
+        arrayFile = str(tmp_path / ('factor' + str(i) + '.npy'))
+        np.save(arrayFile, values)
+        factorSpecs.append(([arrayFile], None, None))
+
+    soilLossFile = createArray(str(tmp_path / 'soilLoss.npy'), (6, 7))
+    baseFile = createArray(str(tmp_path / 'base.npy'), (6, 7))
+
+    for tile in listTiles(6, 7, 4):
+        tile_workers.fusedSoilLossTile((tile, factorSpecs, soilLossFile, baseFile, 2))
+
+    base = factorValues[0] * factorValues[1]
+    assert np.allclose(np.load(baseFile), base)
+    assert np.allclose(np.load(soilLossFile), base * factorValues[2] * factorValues[3], equal_nan=True)
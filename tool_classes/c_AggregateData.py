@@ -114,14 +114,14 @@ class AggregateData(object):
         param.displayName = u'Data to aggregate'
         param.parameterType = 'Required'
         param.direction = 'Input'
-        param.datatype = u'Feature Class'
+        param.datatype = [u'Feature Class', u'Raster Layer']
         params.append(param)
 
         # 8 Classification_column
         param = arcpy.Parameter()
         param.name = u'Classification_column'
         param.displayName = u'Classification column'
-        param.parameterType = 'Required'
+        param.parameterType = 'Optional'
         param.direction = 'Input'
         param.datatype = u'String'
         params.append(param)
@@ -145,6 +145,15 @@ class AggregateData(object):
         param.value = u'False'
         params.append(param)
 
+        # 11 Raster_cell_size
+        param = arcpy.Parameter()
+        param.name = u'Raster_cell_size'
+        param.displayName = u'Cell size for raster aggregation of vector data (optional)'
+        param.parameterType = 'Optional'
+        param.direction = 'Input'
+        param.datatype = u'Double'
+        params.append(param)
+
         return params
 
     def isLicensed(self):
@@ -40,10 +40,57 @@ class ChangeUserSettings(object):
                         if common.readXML(userSettings, 'developerMode') == 'Yes':
                             self.params[2].value = u'True'
 
+                    # RUSLE soil loss engine
+                    if not self.params[4].altered:
+                        rusleEngine = common.readXML(userSettings, 'rusleEngine')
+                        if rusleEngine:
+                            self.params[4].value = rusleEngine
+
+                    # Memory budget
+                    if not self.params[5].altered:
+                        memoryBudgetMb = common.readXML(userSettings, 'memoryBudgetMb')
+                        if memoryBudgetMb:
+                            self.params[5].value = int(memoryBudgetMb)
+
+                    # Tile size
+                    if not self.params[6].altered:
+                        tileSize = common.readXML(userSettings, 'tileSize')
+                        if tileSize:
+                            self.params[6].value = int(tileSize)
+
+                    # Number of worker processes
+                    if not self.params[7].altered:
+                        numWorkers = common.readXML(userSettings, 'numWorkers')
+                        if numWorkers:
+                            self.params[7].value = int(numWorkers)
+
+                    # Hydrology engine
+                    if not self.params[8].altered:
+                        hydrologyEngine = common.readXML(userSettings, 'hydrologyEngine')
+                        if hydrologyEngine:
+                            self.params[8].value = hydrologyEngine
+
+                    # Clip large DEMs
+                    if not self.params[9].altered:
+                        if common.readXML(userSettings, 'clipLargeDEM') == 'Yes':
+                            self.params[9].value = u'True'
+
+                    # Run accounts years concurrently
+                    if not self.params[10].altered:
+                        if common.readXML(userSettings, 'concurrentYears') == 'Yes':
+                            self.params[10].value = u'True'
+
                 # If the values have not been read from the configuration file, populate the values with defaults
                 defaults = {
                     'scratchPath': configuration.scratchPath,
-                    'developerMode': u'False'
+                    'developerMode': u'False',
+                    'rusleEngine': u'ArcPy',
+                    'memoryBudgetMb': 1024,
+                    'tileSize': 2048,
+                    'numWorkers': 1,
+                    'hydrologyEngine': u'ArcPy',
+                    'clipLargeDEM': u'False',
+                    'concurrentYears': u'False'
                 }
 
                 # Scratch path
@@ -59,6 +106,34 @@ class ChangeUserSettings(object):
                 if self.params[2].value is None:
                     self.params[2].value = defaults['developerMode']
 
+                # RUSLE soil loss engine
+                if self.params[4].value is None:
+                    self.params[4].value = defaults['rusleEngine']
+
+                # Memory budget
+                if self.params[5].value is None:
+                    self.params[5].value = defaults['memoryBudgetMb']
+
+                # Tile size
+                if self.params[6].value is None:
+                    self.params[6].value = defaults['tileSize']
+
+                # Number of worker processes
+                if self.params[7].value is None:
+                    self.params[7].value = defaults['numWorkers']
+
+                # Hydrology engine
+                if self.params[8].value is None:
+                    self.params[8].value = defaults['hydrologyEngine']
+
+                # Clip large DEMs
+                if self.params[9].value is None:
+                    self.params[9].value = defaults['clipLargeDEM']
+
+                # Run accounts years concurrently
+                if self.params[10].value is None:
+                    self.params[10].value = defaults['concurrentYears']
+
             except Exception:
                 pass
 
@@ -66,6 +141,13 @@ class ChangeUserSettings(object):
 
                 self.params[1].value = defaults['scratchPath']
                 self.params[2].value = defaults['developerMode']
+                self.params[4].value = defaults['rusleEngine']
+                self.params[5].value = defaults['memoryBudgetMb']
+                self.params[6].value = defaults['tileSize']
+                self.params[7].value = defaults['numWorkers']
+                self.params[8].value = defaults['hydrologyEngine']
+                self.params[9].value = defaults['clipLargeDEM']
+                self.params[10].value = defaults['concurrentYears']
     
         def updateMessages(self):
             """Modify the messages created by internal validation for each tool parameter.
@@ -123,6 +205,71 @@ class ChangeUserSettings(object):
         param.value = u'False'
         params.append(param)
 
+        # 4 RUSLE_engine
+        param = arcpy.Parameter()
+        param.name = u'RUSLE_engine'
+        param.displayName = u'RUSLE soil loss engine (NumPy multiplies the factors in one pass without saving intermediate layers)'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'String'
+        param.filter.list = [u'ArcPy', u'NumPy']
+        params.append(param)
+
+        # 5 Memory_budget
+        param = arcpy.Parameter()
+        param.name = u'Memory_budget'
+        param.displayName = u'Memory budget for tiled raster processing (Mb)'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Long'
+        params.append(param)
+
+        # 6 Tile_size
+        param = arcpy.Parameter()
+        param.name = u'Tile_size'
+        param.displayName = u'Maximum tile size for tiled raster processing (rows and columns)'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Long'
+        params.append(param)
+
+        # 7 Number_of_workers
+        param = arcpy.Parameter()
+        param.name = u'Number_of_workers'
+        param.displayName = u'Number of worker processes for parallel processing (1 = run serially)'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Long'
+        params.append(param)
+
+        # 8 Hydrology_engine
+        param = arcpy.Parameter()
+        param.name = u'Hydrology_engine'
+        param.displayName = u'Hydrology engine for preprocessing the DEM (NumPy fills sinks, calculates flow direction and accumulation and traces streams without the Spatial Analyst tools)'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'String'
+        param.filter.list = [u'ArcPy', u'NumPy']
+        params.append(param)
+
+        # 9 Clip_large_DEM
+        param = arcpy.Parameter()
+        param.name = u'Clip_large_DEM'
+        param.displayName = u'Clip DEMs larger than 1Gb to a 5km buffer around the study area in the preprocessing tool?'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Boolean'
+        params.append(param)
+
+        # 10 Run_years_concurrently
+        param = arcpy.Parameter()
+        param.name = u'Run_years_concurrently'
+        param.displayName = u'Run Year A and Year B of the RUSLE accounts tools at the same time in separate processes?'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Boolean'
+        params.append(param)
+
         return params
 
     def isLicensed(self):
@@ -0,0 +1,120 @@
+import arcpy
+import configuration
+import os
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+
+class StreamThresholds(object):
+
+    class ToolValidator:
+        """Class for validating a tool's parameter values and controlling the behavior of the tool's dialog."""
+    
+        def __init__(self, parameters):
+            """Setup the Geoprocessor and the list of tool parameters."""
+            self.params = parameters
+    
+        def initializeParameters(self):
+            """Refine the properties of a tool's parameters.
+            This method is called when the tool is opened."""
+            return
+        
+        def updateParameters(self):
+            """Modify the values and properties of parameters before internal validation is performed.
+            This method is called whenever a parameter has been changed."""
+            return
+    
+        def updateMessages(self):
+            """Modify the messages created by internal validation for each tool parameter.
+            This method is called after internal validation."""
+
+            import NB_SEEA_ESRI.lib.input_validation as input_validation
+            refresh_modules(input_validation)
+            
+            input_validation.checkFilePaths(self)
+    
+    def __init__(self):
+        self.label = u'Extract streams for several accumulation thresholds'
+        self.canRunInBackground = False
+        self.category = '1 Preprocess data'
+
+    def getParameterInfo(self):
+
+        params = []
+
+        # 0 Output__Success
+        param = arcpy.Parameter()
+        param.name = u'Output__Success'
+        param.displayName = u'Output: Success'
+        param.parameterType = 'Derived'
+        param.direction = 'Output'
+        param.datatype = u'Boolean'
+        params.append(param)
+
+        # 1 Run_system_checks
+        param = arcpy.Parameter()
+        param.name = u'Run_system_checks'
+        param.displayName = u'Run_system_checks'
+        param.parameterType = 'Derived'
+        param.direction = 'Output'
+        param.datatype = u'Boolean'
+        param.value = u'True'
+        params.append(param)
+
+        # 2 Output_folder
+        param = arcpy.Parameter()
+        param.name = u'Output_folder'
+        param.displayName = u'Output folder'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Folder'
+        params.append(param)
+
+        # 3 Output_Summary_Table
+        param = arcpy.Parameter()
+        param.name = u'Output_Summary_Table'
+        param.displayName = u'Stream threshold summary table'
+        param.parameterType = 'Derived'
+        param.direction = 'Output'
+        param.datatype = u'File'
+        params.append(param)
+
+        # 4 Preprocess_folder
+        param = arcpy.Parameter()
+        param.name = u'Preprocess_folder'
+        param.displayName = u'Preprocessed data folder'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'Folder'
+        params.append(param)
+
+        # 5 Thresholds
+        param = arcpy.Parameter()
+        param.name = u'Accumulation_thresholds'
+        param.displayName = u'Accumulation thresholds'
+        param.parameterType = 'Required'
+        param.direction = 'Input'
+        param.datatype = u'GPValueTable'
+        param.columns = [[u'GPDouble', u'Accumulation threshold for stream initiation (ha)'],
+                         [u'GPDouble', u'Accumulation threshold for major rivers (ha)']]
+        params.append(param)
+
+        return params
+
+    def isLicensed(self):
+        return True
+
+    def updateParameters(self, parameters):
+        validator = getattr(self, 'ToolValidator', None)
+        if validator:
+             return validator(parameters).updateParameters()
+
+    def updateMessages(self, parameters):
+        validator = getattr(self, 'ToolValidator', None)
+        if validator:
+             return validator(parameters).updateMessages()
+
+    def execute(self, parameters, messages):
+
+        import NB_SEEA_ESRI.tools.t_stream_thresholds as t_stream_thresholds
+        refresh_modules(t_stream_thresholds)
+
+        t_stream_thresholds.function(parameters)
@@ -60,12 +60,15 @@ def function(params):
         # Set up logging output to file
         log.setupLogging(outputFolder)
         
+        # Year A and Year B are run concurrently if set in the user settings
+        concurrent = common.getUserSetting('concurrentYears', 'No') == 'Yes'
+
         # Call RUSLE_accounts function
 
         RUSLE_accounts.function(outputFolder, yearAFolder, yearBFolder,
                                 lsOption, slopeAngle, rData, soilData, soilCode,
                                 YearALCData, YearALCCode, YearBLCData, YearBLCCode,
-                                YearAPData, YearBPData, saveFactors)
+                                YearAPData, YearBPData, saveFactors, concurrent)
 
         # Set up filenames for display purposes
         soilLossA = os.path.join(outputFolder, "soillossA")
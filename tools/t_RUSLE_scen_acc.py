@@ -47,9 +47,12 @@ def function(params):
         # Set up logging output to file
         log.setupLogging(outputFolder)
         
+        # Year A and Year B are run concurrently if set in the user settings
+        concurrent = common.getUserSetting('concurrentYears', 'No') == 'Yes'
+
         # Call RUSLE_scen_acc function
         RUSLE_scen_acc.function(outputFolder, yearAFolder, yearBFolder, lsOption, slopeAngle,
-                                yearARain, yearBRain, yearASupport, yearBSupport)
+                                yearARain, yearBRain, yearASupport, yearBSupport, concurrent)
 
         # Set up filenames for display purposes
         soilLossA = os.path.join(outputFolder, "soillossA")
@@ -0,0 +1,90 @@
+import arcpy
+import os
+import sys
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.solo.RUSLE_scenarios as RUSLE_scenarios
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, RUSLE_scenarios])
+
+def function(params):
+
+    try:
+        pText = common.paramsAsText(params)
+
+        # Get inputs
+        runSystemChecks = common.strToBool(pText[1])
+        outputFolder = pText[2]
+        preprocessFolder = pText[4]
+
+        # R-factor
+        rData = pText[5]
+
+        # LS-factor
+        slopeOption = pText[6]
+        slopeAngle = pText[7]
+
+        # K-factor
+        kOption = pText[8]
+        soilData = pText[9]
+        soilCode = pText[10]
+
+        # Scenarios (name, C-factor dataset, P-factor dataset)
+        scenarios = []
+        for row in params[11].values:
+
+            name = str(row[0]).strip()
+            landCoverData = str(row[1]) if row[1] not in [None, ''] else None
+            supportData = str(row[2]) if row[2] not in [None, ''] else None
+
+            scenarios.append((name, landCoverData, supportData))
+
+        # Create output folder
+        if not os.path.exists(outputFolder):
+            os.mkdir(outputFolder)
+
+        # System checks and setup
+        if runSystemChecks:
+            common.runSystemChecks()
+
+        # Set up logging output to file
+        log.setupLogging(outputFolder)
+
+        # Write input params to XML
+        common.writeParamsToXML(params, outputFolder)
+
+        # Set option for LS-factor
+        if slopeOption == 'Calculate based on slope and length only':
+            lsOption = 'SlopeLength'
+
+        elif slopeOption == 'Include upslope contributing area':
+            lsOption = 'UpslopeArea'
+
+        else:
+            log.error('Invalid LS-factor option')
+            sys.exit()
+
+        # Set soilOption for K-factor
+        if kOption == 'Use preprocessed soil data':
+            soilOption = 'PreprocessSoil'
+
+        elif kOption == 'Use local K-factor dataset':
+            soilOption = 'LocalSoil'
+
+        else:
+            log.error('Invalid soil erodibility option')
+            sys.exit()
+
+        # Call RUSLE scenarios function
+        summaryTable = RUSLE_scenarios.function(outputFolder, preprocessFolder, lsOption, slopeAngle,
+                                                soilOption, soilData, soilCode, rData, scenarios)
+
+        arcpy.SetParameter(3, summaryTable)
+
+        log.info("RUSLE scenarios operations completed successfully")
+
+    except Exception:
+        log.exception("RUSLE scenarios tool failed")
+        raise
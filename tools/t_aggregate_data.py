@@ -1,5 +1,6 @@
 import arcpy
 import os
+import sys
 
 import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.common as common
@@ -32,6 +33,20 @@ def function(params):
         aggregateMask = pText[9]
         maskFullyWithinSAM = common.strToBool(pText[10])
 
+        # Vector data is aggregated in raster mode if a cell size is given
+        # The value is read from the parameter object, as the text form of a double is locale formatted
+        cellSize = None
+        if len(params) > 11 and params[11].value is not None:
+            cellSize = params[11].value
+
+            if cellSize <= 0:
+                log.error('Cell size for raster aggregation must be greater than zero')
+                sys.exit()
+
+        if classificationColumn is None and not aggregate_data.isRaster(dataToAggregate):
+            log.error('A classification column is needed to aggregate vector data')
+            sys.exit()
+
         # System checks and setup
         if runSystemChecks:
             common.runSystemChecks()
@@ -47,7 +62,8 @@ def function(params):
         dataSetsToAggregate = [DataToAggregate(dataToAggregate, classificationColumn)]
 
         # Call aggregation function
-        outputStats = aggregate_data.function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSAM, dataToAggregate)
+        outputStats = aggregate_data.function(outputFolder, dataSetsToAggregate, aggregateMask, maskFullyWithinSAM, dataToAggregate,
+                                             cellSize)
 
         # Set up filenames for display purposes
         InvSimpson = os.path.join(outputFolder, "InverseSimpsonIndex.shp")
@@ -20,21 +20,52 @@ def function(params):
     p = common.paramsAsText(params)
     scratchPath = p[1]
     developerMode = common.strToBool(p[2])
+    rusleEngine = p[4]
+    memoryBudgetMb = p[5]
+    tileSize = p[6]
+    numWorkers = p[7]
+    hydrologyEngine = p[8]
+    clipLargeDEM = common.strToBool(p[9])
+    concurrentYears = common.strToBool(p[10])
 
     if developerMode == True:
         developerMode = 'Yes'
     else:
         developerMode = 'No'
 
+    if clipLargeDEM == True:
+        clipLargeDEM = 'Yes'
+    else:
+        clipLargeDEM = 'No'
+
+    if concurrentYears == True:
+        concurrentYears = 'Yes'
+    else:
+        concurrentYears = 'No'
+
     # Override the default values from user settings file (if they exist in the file)
     try:
         configValues = [('scratchPath', scratchPath),
-                        ('developerMode', developerMode)]
+                        ('developerMode', developerMode),
+                        ('rusleEngine', rusleEngine),
+                        ('memoryBudgetMb', memoryBudgetMb),
+                        ('tileSize', tileSize),
+                        ('numWorkers', numWorkers),
+                        ('hydrologyEngine', hydrologyEngine),
+                        ('clipLargeDEM', clipLargeDEM),
+                        ('concurrentYears', concurrentYears)]
 
         common.writeXML(configuration.userSettingsFile, configValues)
 
         log.info('Scratch path updated: ' + scratchPath)
         log.info('Developer mode updated: ' + developerMode)
+        log.info('RUSLE soil loss engine updated: ' + rusleEngine)
+        log.info('Memory budget updated: ' + memoryBudgetMb + 'Mb')
+        log.info('Tile size updated: ' + tileSize)
+        log.info('Number of worker processes updated: ' + numWorkers)
+        log.info('Hydrology engine updated: ' + hydrologyEngine)
+        log.info('Clip large DEMs updated: ' + clipLargeDEM)
+        log.info('Run accounts years concurrently updated: ' + concurrentYears)
 
     except Exception:
         raise
@@ -13,11 +13,12 @@ import NB_SEEA_ESRI.lib.log as log
 import NB_SEEA_ESRI.lib.progress as progress
 import NB_SEEA_ESRI.lib.common as common
 import NB_SEEA_ESRI.lib.baseline as baseline
+import NB_SEEA_ESRI.lib.study_mask as study_mask
 import NB_SEEA_ESRI.solo.preprocess_dem as preprocess_dem
 
 from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
 from NB_SEEA_ESRI.lib.external import six # Python 2/3 compatibility module
-refresh_modules([log, common, baseline, preprocess_dem])
+refresh_modules([log, common, baseline, study_mask, preprocess_dem])
 
 def function(params):
 
@@ -146,7 +147,7 @@ def function(params):
             else:
                 arcpy.CopyFeatures_management(inputStudyAreaMask, studyAreaMask)
 
-            # If DEM is large, clip it to a large buffer around the study area mask (~5km)
+            # If DEM is large and clipping large DEMs is switched on in the user settings, clip it to a buffer around the study area mask (~5km)
             inputDEM = baseline.clipLargeDEM(inputDEM, studyAreaMask)
 
             rasterInputFiles = []
@@ -260,8 +261,7 @@ def function(params):
             # Do coverage checks on land cover and soil and copy to outputFolder
             if lcFormat in ['RasterDataset', 'RasterLayer']:
 
-                lcMask = common.extractRasterMask(clippedLC)
-                common.checkCoverage(lcMask, studyAreaMaskBuff, inputLC)                
+                study_mask.checkRasterCoverage(clippedLC, studyAreaMaskBuff, inputLC, cacheFolder=outputFolder)
 
                 arcpy.CopyRaster_management(clippedLC, outputLCras)
 
@@ -273,8 +273,7 @@ def function(params):
 
             if soilFormat in ['RasterDataset', 'RasterLayer']:
 
-                soilMask = common.extractRasterMask(clippedSoil)
-                common.checkCoverage(soilMask, studyAreaMaskBuff, inputLC)
+                study_mask.checkRasterCoverage(clippedSoil, studyAreaMaskBuff, inputSoil, cacheFolder=outputFolder)
 
                 arcpy.CopyRaster_management(clippedSoil, outputSoilras)
 
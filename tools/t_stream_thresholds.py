@@ -0,0 +1,49 @@
+import arcpy
+import os
+
+import NB_SEEA_ESRI.lib.log as log
+import NB_SEEA_ESRI.lib.common as common
+import NB_SEEA_ESRI.solo.stream_thresholds as stream_thresholds
+
+from NB_SEEA_ESRI.lib.refresh_modules import refresh_modules
+refresh_modules([log, common, stream_thresholds])
+
+def function(params):
+
+    try:
+        pText = common.paramsAsText(params)
+
+        # Get inputs
+        runSystemChecks = common.strToBool(pText[1])
+        outputFolder = pText[2]
+        preprocessFolder = pText[4]
+
+        # Thresholds (stream initiation, river initiation)
+        thresholds = []
+        for row in params[5].values:
+            thresholds.append((float(row[0]), float(row[1])))
+
+        # Create output folder
+        if not os.path.exists(outputFolder):
+            os.mkdir(outputFolder)
+
+        # System checks and setup
+        if runSystemChecks:
+            common.runSystemChecks()
+
+        # Set up logging output to file
+        log.setupLogging(outputFolder)
+
+        # Write input params to XML
+        common.writeParamsToXML(params, outputFolder)
+
+        # Call stream thresholds function
+        summaryTable = stream_thresholds.function(outputFolder, preprocessFolder, thresholds)
+
+        arcpy.SetParameter(3, summaryTable)
+
+        log.info("Stream threshold operations completed successfully")
+
+    except Exception:
+        log.exception("Stream threshold tool failed")
+        raise